@@ -0,0 +1,80 @@
+"""
+Load generator client, a HeadlessClient that records per opcode latency.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import headless_client
+from headless_client import HeadlessClient
+
+OPCODE_NAMES = {
+    0x01: 'image',
+    0x02: 'csv_tag',
+    0x03: 'csv_change',
+    0x04: 'save',
+    0x05: 'clip',
+    0x06: 'partial_csv',
+}
+
+def quiet_logs():
+    # per request console logging dominates client time during a load test
+    for name in ['log_network', 'log_ok', 'log_info', 'log_warn']:
+        setattr(headless_client, name, lambda str: None)
+
+class BenchClient(HeadlessClient):
+    def __init__(self, host, port, timeout=30.0):
+        super().__init__(host, port, cache_images=False)
+        self.timeout = timeout
+        self.latency = {name: [] for name in OPCODE_NAMES.values()}
+        self.image_cnt = 0
+        self.image_bytes = 0
+        self.image_errors = 0
+        # image index -> perf_counter at send / at response
+        self.image_sent_time = {}
+        self.image_done_time = {}
+        if not self.connect_to_server():
+            raise ConnectionError(f'Failed to connect to {host}:{port}')
+
+    def timed(self, name, call, *args):
+        start = time.perf_counter()
+        result = call(*args)
+        self.latency[name].append(time.perf_counter() - start)
+        return result
+
+    def load(self):
+        self.timed('csv_tag', self.wait_for, 'csv_tag', b'\xff\x02', self.timeout)
+        self.timed('partial_csv', self.wait_for, 'csv', b'\xff\x06', self.timeout)
+        self.timed('clip', self.wait_for, 'clip', b'\xff\x05', self.timeout)
+
+    def send_with_waiter(self, key, data, callback=None, priority=headless_client.PRIORITY_INTERACTIVE):
+        if isinstance(key, tuple):
+            self.image_sent_time[key[1]] = time.perf_counter()
+        return super().send_with_waiter(key, data, callback, priority)
+
+    def resolve_waiter(self, key, result, first_only=False):
+        if isinstance(key, tuple):
+            self.image_done_time[key[1]] = time.perf_counter()
+        super().resolve_waiter(key, result, first_only)
+
+    def handle_image(self, index, img_data):
+        # skip decoding, only count what arrived
+        self.image_cnt += 1
+        self.image_bytes += len(img_data)
+        return img_data
+
+    def fetch_images(self, index_list, window=8, priority=headless_client.PRIORITY_INTERACTIVE):
+        result_dict = super().fetch_images(index_list, window=window, timeout=self.timeout, priority=priority)
+        for index, result in result_dict.items():
+            if isinstance(result, Exception):
+                self.image_errors += 1
+            self.latency['image'].append(self.image_done_time.pop(index) - self.image_sent_time.pop(index))
+        return result_dict
+
+    def change_tag(self, index1, index2, tag_list):
+        self.timed('csv_change', self.set_tags, index1, index2, tag_list, self.timeout)
+
+    def save(self):
+        self.timed('save', super().save, self.timeout)
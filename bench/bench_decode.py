@@ -0,0 +1,93 @@
+"""
+Client decode cost at every global_scale step of the Tk client.
+
+For each scale offered by scale_up / scale_down (0.25 to 3.0) decodes the
+same JPEG frames the way FrontendClient.get_rendered_image does, once from
+the full size image and once through headless_client.decode_image (JPEG
+draft below scale 1), then resizes to the display size. Reports time per
+frame and the size of the decoded pixel buffer, which is where the memory
+goes: Pillow allocates it outside the Python heap, so tracemalloc only sees
+the Python side and is reported separately.
+
+Example:
+    python bench/bench_decode.py --size 1920x1080 --images 20 --repeat 5
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from gen_dataset import make_image, parse_size
+from headless_client import decode_image
+
+SCALE_LIST = [step * 0.25 for step in range(1, 13)]
+
+def decode_full(img_data, scale):
+    image = Image.open(io.BytesIO(img_data))
+    image.load()
+    return image
+
+def render(decode, img_data, scale):
+    # mirrors get_rendered_image with the settled LANCZOS filter
+    image = decode(img_data, scale)
+    decoded_bytes = image.size[0] * image.size[1] * len(image.getbands())
+    size = Image.open(io.BytesIO(img_data)).size
+    scaled_size = (int(size[0] * scale), int(size[1] * scale))
+    if image.size != scaled_size:
+        image = image.resize(scaled_size, Image.Resampling.LANCZOS)
+    return decoded_bytes
+
+def run(decode, data_list, scale, repeat):
+    decoded_bytes = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(0, repeat):
+        for img_data in data_list:
+            decoded_bytes = max(decoded_bytes, render(decode, img_data, scale))
+    elapsed = time.perf_counter() - start
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'ms_per_frame': elapsed * 1000 / (repeat * len(data_list)),
+        'decoded_mb': decoded_bytes / 1e6,
+        'python_peak_mb': python_peak / 1e6,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark client JPEG decode at each display scale.')
+    parser.add_argument('--size', default='1920x1080', help='source image WxH')
+    parser.add_argument('--images', type=int, default=20, help='distinct source images')
+    parser.add_argument('--repeat', type=int, default=5, help='passes over the images per scale')
+    parser.add_argument('--quality', type=int, default=90, help='JPEG quality of the source images')
+    parser.add_argument('--out', default='', help='write results JSON here')
+    args = parser.parse_args(argv)
+
+    width, height = parse_size(args.size)
+    data_list = []
+    for i in range(0, args.images):
+        buffer = io.BytesIO()
+        make_image(width, height, i).save(buffer, 'JPEG', quality=args.quality)
+        data_list.append(buffer.getvalue())
+
+    result_list = []
+    print(f"{'scale':>6}  {'full ms':>8}  {'draft ms':>8}  {'full MB':>8}  {'draft MB':>8}")
+    for scale in SCALE_LIST:
+        full = run(decode_full, data_list, scale, args.repeat)
+        draft = run(decode_image, data_list, scale, args.repeat)
+        result_list.append({'scale': scale, 'full': full, 'draft': draft})
+        print(f"{scale:6.2f}  {full['ms_per_frame']:8.2f}  {draft['ms_per_frame']:8.2f}  "
+              f"{full['decoded_mb']:8.2f}  {draft['decoded_mb']:8.2f}")
+
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            json.dump({'size': args.size, 'quality': args.quality, 'results': result_list}, out_file, indent=4)
+
+if __name__ == '__main__':
+    main()
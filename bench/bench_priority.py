@@ -0,0 +1,133 @@
+"""
+Interactive image latency while bulk loads run.
+
+Boots BackendServer on loopback, then one interactive client fetches a
+random frame every --think-ms while --bulk-clients sweep the whole dataset
+with --window requests in flight each, like "Load All Image". Runs three
+phases: no bulk load, bulk sent as interactive (what every request was
+before priority classes) and bulk sent with the bulk class. With priority
+scheduling the interactive p95 of the last phase should stay close to the
+first.
+
+Example:
+    python bench/bench_priority.py --duration 10 --bulk-clients 2 --window 64
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import gen_dataset
+from bench_client import BenchClient, quiet_logs
+from run_bench import ServerProcess, find_free_port, summarize_latency
+from headless_client import PRIORITY_INTERACTIVE, PRIORITY_BULK
+
+PHASES = [('idle', None), ('bulk_as_interactive', PRIORITY_INTERACTIVE), ('bulk', PRIORITY_BULK)]
+
+def run_bulk(port, priority, window, stop):
+    client = BenchClient('127.0.0.1', port)
+    client.load()
+    index_list = list(range(0, client.data_cnt))
+    while not stop.is_set():
+        # one chunk per call so stop is noticed within a fraction of a sweep
+        for begin in range(0, len(index_list), window * 4):
+            if stop.is_set():
+                break
+            client.fetch_images(index_list[begin:begin + window * 4], window=window, priority=priority)
+    client.close()
+    return client.image_cnt
+
+def run_phase(port, priority, args, seed):
+    stop = threading.Event()
+    bulk_start = time.perf_counter()
+    bulk_cnt_list = []
+    bulk_thread_list = []
+    if priority is not None:
+        for i in range(0, args.bulk_clients):
+            thread = threading.Thread(
+                target=lambda: bulk_cnt_list.append(run_bulk(port, priority, args.window, stop)), daemon=True
+            )
+            thread.start()
+            bulk_thread_list.append(thread)
+        # let the bulk load fill the server queues first
+        time.sleep(1.0)
+
+    rng = random.Random(seed)
+    client = BenchClient('127.0.0.1', port)
+    client.load()
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.duration:
+        client.fetch_images([rng.randrange(0, client.data_cnt)], window=1)
+        time.sleep(args.think_ms / 1000)
+    client.close()
+
+    stop.set()
+    for thread in bulk_thread_list:
+        thread.join()
+    return {
+        'interactive': summarize_latency(client.latency['image']),
+        'bulk_images_per_s': sum(bulk_cnt_list) / (time.perf_counter() - bulk_start),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark interactive latency under bulk load.')
+    parser.add_argument('--dataset', help='reuse a folder made by gen_dataset.py instead of generating one')
+    parser.add_argument('--work-dir', help='folder for generated data, server setting and logs (default: temp dir)')
+    parser.add_argument('--clips', type=int, default=10)
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--cams', type=int, default=3)
+    parser.add_argument('--sizes', default='1280x720')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of interactive requests per phase')
+    parser.add_argument('--think-ms', type=float, default=50.0, help='pause between interactive requests')
+    parser.add_argument('--bulk-clients', type=int, default=2)
+    parser.add_argument('--window', type=int, default=64, help='bulk requests in flight per client')
+    parser.add_argument('--io-threads', type=int, default=8)
+    parser.add_argument('--bulk-share', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='', help='write results JSON here')
+    args = parser.parse_args(argv)
+    quiet_logs()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='fitt_priority_')
+    if args.dataset:
+        with open(os.path.join(args.dataset, 'dataset.json'), 'r') as info_file:
+            dataset_info = json.load(info_file)
+    else:
+        print(f'Generating dataset in {work_dir}')
+        dataset_info = gen_dataset.generate(
+            os.path.join(work_dir, 'data'), args.clips, args.frames, args.cams,
+            [gen_dataset.parse_size(size) for size in args.sizes.split(',')], ['jpeg'], [100, 200, 300],
+        )
+
+    port = find_free_port()
+    server = ServerProcess(work_dir, dataset_info['data_csv'], dataset_info['meta_csv'], port, {
+        'io_threads': args.io_threads,
+        'bulk_share': args.bulk_share,
+        # the bulk clients would otherwise get every row of the dataset from memory
+        'image_cache_mb': 0,
+    })
+    server.start()
+    result_dict = {}
+    try:
+        for phase, (name, priority) in enumerate(PHASES):
+            result = run_phase(port, priority, args, args.seed + phase)
+            result_dict[name] = result
+            latency = result['interactive']
+            print(f"{name:20s}  interactive p50 {latency['p50_ms']:7.2f} ms  p95 {latency['p95_ms']:7.2f} ms  "
+                  f"p99 {latency['p99_ms']:7.2f} ms  bulk {result['bulk_images_per_s']:8.1f} images/s")
+    finally:
+        server.stop()
+
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            json.dump({'args': vars(args), 'results': result_dict}, out_file, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Aggregate image throughput as shards are added.
+
+Boots one plain BackendServer, then router.py with each shard count of
+--shards, and has --clients headless clients sweep the whole dataset with
+--window requests in flight each for --duration seconds. Reports images/s
+and MB/s for every setup, plus the per-image latency. The plain server
+run shows what the extra router hop costs; throughput only grows with
+shards while a single server process is the limit (one interpreter, one
+disk queue), so expect a flat line on a machine with few cores.
+
+Example:
+    python bench/bench_shards.py --shards 1,2,4 --clients 4 --duration 10
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import gen_dataset
+from bench_client import BenchClient, quiet_logs
+from run_bench import ServerProcess, find_free_port, summarize_latency
+
+class RouterProcess(ServerProcess):
+    """router.py booted in a child process, it starts the shards itself."""
+    boot_module = 'router'
+    boot_class = 'Router'
+
+def run_client(port, window, duration, result_list):
+    client = BenchClient('127.0.0.1', port)
+    client.load()
+    index_list = list(range(0, client.data_cnt))
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for begin in range(0, len(index_list), window * 4):
+            if time.perf_counter() - start >= duration:
+                break
+            client.fetch_images(index_list[begin:begin + window * 4], window=window)
+    client.close()
+    result_list.append(client)
+
+def run_setup(port, args):
+    client_list = []
+    thread_list = [
+        threading.Thread(target=run_client, args=(port, args.window, args.duration, client_list), daemon=True)
+        for _ in range(0, args.clients)
+    ]
+    start = time.perf_counter()
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latency_list = [value for client in client_list for value in client.latency['image']]
+    return {
+        'images_per_s': sum(client.image_cnt for client in client_list) / elapsed,
+        'mb_per_s': sum(client.image_bytes for client in client_list) / elapsed / 1e6,
+        'errors': sum(client.image_errors for client in client_list),
+        'image_latency': summarize_latency(latency_list),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark image throughput of router.py per shard count.')
+    parser.add_argument('--dataset', help='reuse a folder made by gen_dataset.py instead of generating one')
+    parser.add_argument('--work-dir', help='folder for generated data, settings and logs (default: temp dir)')
+    parser.add_argument('--clips', type=int, default=16)
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--cams', type=int, default=3)
+    parser.add_argument('--sizes', default='1280x720')
+    parser.add_argument('--shards', default='1,2,4', help='comma separated shard counts')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--window', type=int, default=16, help='requests in flight per client')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per setup')
+    parser.add_argument('--io-threads', type=int, default=8)
+    parser.add_argument('--out', default='', help='write results JSON here')
+    args = parser.parse_args(argv)
+    quiet_logs()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='fitt_shards_bench_')
+    if args.dataset:
+        with open(os.path.join(args.dataset, 'dataset.json'), 'r') as info_file:
+            dataset_info = json.load(info_file)
+    else:
+        print(f'Generating dataset in {work_dir}')
+        dataset_info = gen_dataset.generate(
+            os.path.join(work_dir, 'data'), args.clips, args.frames, args.cams,
+            [gen_dataset.parse_size(size) for size in args.sizes.split(',')], ['jpeg'], [100, 200, 300],
+        )
+
+    setup_list = [('server', ServerProcess, {})]
+    for shard_cnt in [int(value) for value in args.shards.split(',')]:
+        setup_list.append((f'router_{shard_cnt}', RouterProcess, {
+            'shard_cnt': shard_cnt, 'shard_base_port': find_free_port(),
+        }))
+    result_dict = {}
+    for name, process_class, extra_setting in setup_list:
+        setup_dir = os.path.join(work_dir, name)
+        os.makedirs(setup_dir, exist_ok=True)
+        port = find_free_port()
+        process = process_class(setup_dir, dataset_info['data_csv'], dataset_info['meta_csv'], port,
+                                dict(extra_setting, io_threads=args.io_threads, image_cache_mb=0))
+        process.start()
+        try:
+            result = run_setup(port, args)
+        finally:
+            process.stop()
+        result_dict[name] = result
+        print(f"{name:10s}  {result['images_per_s']:8.1f} images/s  {result['mb_per_s']:7.1f} MB/s  "
+              f"p50 {result['image_latency'].get('p50_ms', 0):7.2f} ms  "
+              f"p95 {result['image_latency'].get('p95_ms', 0):7.2f} ms  errors {result['errors']}")
+
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            json.dump({'args': vars(args), 'cpu_cnt': os.cpu_count(), 'results': result_dict}, out_file, indent=4)
+
+if __name__ == '__main__':
+    main()
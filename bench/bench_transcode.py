@@ -0,0 +1,95 @@
+"""
+Transcode throughput against the number of pool processes.
+
+Runs the scaled image work of server_transcode.TranscodePool from several
+threads, the way client connections call it, once in-thread (workers 0,
+bound by the GIL) and then with growing process pools.
+
+Example:
+    python bench/bench_transcode.py --size 1920x1080 --images 200 --workers 0,1,2,4
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gen_dataset import make_image, parse_size
+from server_transcode import TranscodePool
+
+def make_images(out_dir, size, count):
+    path_list = []
+    for i in range(0, count):
+        path = os.path.join(out_dir, f'img_{i}.jpg')
+        make_image(size[0], size[1], i).save(path, quality=90)
+        path_list.append(path)
+    return path_list
+
+def run(path_list, worker_cnt, thread_cnt, images, target, transport):
+    pool = TranscodePool(worker_cnt, transport=transport)
+    try:
+        # start the processes outside the timed part
+        pool.transcode(path_list[0], target[0], target[1]).release()
+
+        def job(i):
+            with pool.transcode(path_list[i % len(path_list)], target[0], target[1]) as result:
+                return result.size
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(thread_cnt) as executor:
+            total_bytes = sum(executor.map(job, range(0, images)))
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.shutdown()
+    return {
+        'workers': worker_cnt,
+        'threads': thread_cnt,
+        'images': images,
+        'elapsed_s': elapsed,
+        'images_per_s': images / elapsed,
+        'out_mb': total_bytes / 1e6,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark server transcoding with process pools.')
+    parser.add_argument('--size', default='1920x1080', help='source image WxH')
+    parser.add_argument('--target', default='640x360', help='max scaled WxH')
+    parser.add_argument('--sources', type=int, default=16, help='distinct source images')
+    parser.add_argument('--images', type=int, default=200, help='transcodes per run')
+    parser.add_argument('--workers', default='', help=f'comma separated pool sizes, default 0,1,2,4..{os.cpu_count()}')
+    parser.add_argument('--threads', type=int, default=0, help='calling threads, default 2 per worker (min 4)')
+    parser.add_argument('--transport', choices=['shm', 'file'], default='shm')
+    parser.add_argument('--out', default='', help='write results JSON here')
+    args = parser.parse_args(argv)
+
+    if args.workers:
+        worker_list = [int(worker) for worker in args.workers.split(',')]
+    else:
+        worker_list = [0]
+        worker = 1
+        while worker < (os.cpu_count() or 1):
+            worker_list.append(worker)
+            worker *= 2
+        worker_list.append(os.cpu_count() or 1)
+
+    result_list = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_list = make_images(temp_dir, parse_size(args.size), args.sources)
+        for worker_cnt in worker_list:
+            thread_cnt = args.threads or max(4, worker_cnt * 2)
+            result = run(path_list, worker_cnt, thread_cnt, args.images, parse_size(args.target), args.transport)
+            result_list.append(result)
+            print(f"workers {worker_cnt:3d}  threads {thread_cnt:3d}  "
+                  f"{result['images_per_s']:8.1f} images/s  ({result['elapsed_s']:.2f}s)")
+
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            json.dump({'cpu_count': os.cpu_count(), 'size': args.size, 'target': args.target,
+                       'results': result_list}, out_file, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare two result files written by bench/run_bench.py.
+
+Exits with status 1 if any tracked number regressed by more than --threshold
+percent, so it can be used in a script between two commits.
+
+Example:
+    python bench/compare.py base.json new.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+# (path in result file, True if higher is better)
+TRACKED = [
+    (('throughput', 'images_per_s'), True),
+    (('throughput', 'mb_per_s'), True),
+    (('save', 'p50_ms'), False),
+    (('save', 'p99_ms'), False),
+    (('server', 'rss_peak_mb'), False),
+]
+LATENCY_KEYS = ['p50_ms', 'p95_ms', 'p99_ms']
+
+def lookup(results, path):
+    value = results
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+def compare(base, new, threshold):
+    tracked = list(TRACKED)
+    for name in new.get('latency', {}):
+        for key in LATENCY_KEYS:
+            tracked.append((('latency', name, key), False))
+
+    regressions = []
+    print(f"base {base['meta'].get('commit')}  ->  new {new['meta'].get('commit')}")
+    print(f"{'metric':<32}{'base':>12}{'new':>12}{'change':>10}")
+    for path, higher_is_better in tracked:
+        base_value = lookup(base, path)
+        new_value = lookup(new, path)
+        if base_value is None or new_value is None:
+            continue
+        change = (new_value - base_value) / base_value * 100 if base_value else 0.0
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            regressions.append('.'.join(path))
+        print(f"{'.'.join(path):<32}{base_value:>12.2f}{new_value:>12.2f}{change:>+9.1f}%{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed regression in percent')
+    args = parser.parse_args(argv)
+
+    with open(args.base, 'r') as base_file:
+        base = json.load(base_file)
+    with open(args.new, 'r') as new_file:
+        new = json.load(new_file)
+
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print(f'{len(regressions)} regression(s) over {args.threshold}%')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
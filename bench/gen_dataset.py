@@ -0,0 +1,134 @@
+"""
+Synthetic dataset generator for the benchmark suite.
+
+Writes a folder of images plus a data CSV (clip_id, modality, file_path,
+tag_code_*) and a matching meta CSV, in the format server.py expects.
+
+Example:
+    python bench/gen_dataset.py --out bench_data --clips 20 --frames 50 --cams 3
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+import pandas as pd
+from PIL import Image
+
+FORMAT_EXT = {
+    'jpeg': 'jpg',
+    'png': 'png',
+    'webp': 'webp',
+    'bmp': 'bmp',
+}
+
+def parse_size(size_str):
+    width, height = size_str.lower().split('x')
+    return int(width), int(height)
+
+def make_image(width, height, seed):
+    # gradient plus noise, so encoded sizes look like real photos instead of flat color
+    rng = random.Random(seed)
+    base = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), rng.uniform(20, 60))
+    r = Image.blend(base, noise, 0.5)
+    g = base.rotate(rng.choice([90, 180, 270])).resize((width, height))
+    b = noise
+    return Image.merge('RGB', (r, g, b))
+
+def generate(out_dir, clips, frames, cams, sizes, formats, tag_codes, layout='grouped',
+             unique_images=0, seed=0):
+    rng = random.Random(seed)
+    img_dir = os.path.join(out_dir, 'images')
+    os.makedirs(img_dir, exist_ok=True)
+
+    cam_names = [f'camera_{i}' for i in range(0, cams)]
+    tag_columns = [f'tag_code_{code}' for code in tag_codes]
+
+    # image file pool, reused round robin if unique_images is set
+    total_rows = clips * frames * cams
+    image_cnt = total_rows if unique_images <= 0 else min(unique_images, total_rows)
+    image_paths = []
+    bytes_written = 0
+    for i in range(0, image_cnt):
+        width, height = sizes[i % len(sizes)]
+        fmt = formats[i % len(formats)]
+        path = os.path.join(img_dir, f'img_{i:07d}.{FORMAT_EXT[fmt]}')
+        make_image(width, height, seed + i).save(path, format=fmt.upper())
+        bytes_written += os.path.getsize(path)
+        image_paths.append(os.path.abspath(path))
+
+    rows = []
+    row_cnt = 0
+    for clip_id in range(0, clips):
+        clip_rows = []
+        for cam_index, cam_name in enumerate(cam_names):
+            for frame in range(0, frames):
+                clip_rows.append((frame, cam_index, cam_name))
+        # server reorders grouped clips to alternating, keep both layouts available
+        if layout == 'alternating':
+            clip_rows.sort(key=lambda row: (row[0], row[1]))
+        for frame, cam_index, cam_name in clip_rows:
+            row = [clip_id, cam_name, image_paths[row_cnt % image_cnt]]
+            row.extend([rng.random() < 0.05 for _ in tag_columns])
+            rows.append(row)
+            row_cnt += 1
+
+    data_csv_path = os.path.join(out_dir, 'data.csv')
+    meta_csv_path = os.path.join(out_dir, 'meta.csv')
+    pd.DataFrame(rows, columns=['clip_id', 'modality', 'file_path'] + tag_columns).to_csv(data_csv_path, index=False)
+    pd.DataFrame(
+        [[code, f'Tag {code}'] for code in tag_codes], columns=['code', 'alias']
+    ).to_csv(meta_csv_path, index=False)
+
+    info = {
+        'data_csv': os.path.abspath(data_csv_path),
+        'meta_csv': os.path.abspath(meta_csv_path),
+        'rows': total_rows,
+        'clips': clips,
+        'frames_per_clip': frames,
+        'cams_per_clip': cams,
+        'sizes': [f'{w}x{h}' for w, h in sizes],
+        'formats': formats,
+        'tag_cnt': len(tag_codes),
+        'layout': layout,
+        'image_files': image_cnt,
+        'image_bytes': bytes_written,
+    }
+    with open(os.path.join(out_dir, 'dataset.json'), 'w') as info_file:
+        json.dump(info, info_file, indent=4)
+    return info
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic tagging dataset.')
+    parser.add_argument('--out', default='bench_data', help='output folder')
+    parser.add_argument('--clips', type=int, default=10)
+    parser.add_argument('--frames', type=int, default=50, help='frames per clip')
+    parser.add_argument('--cams', type=int, default=3, help='cameras per clip')
+    parser.add_argument('--sizes', default='640x360', help='comma separated WxH list, cycled per image')
+    parser.add_argument('--formats', default='jpeg', help=f'comma separated, from {list(FORMAT_EXT)}')
+    parser.add_argument('--tags', type=int, default=5, help='number of tag columns')
+    parser.add_argument('--layout', choices=['grouped', 'alternating'], default='grouped')
+    parser.add_argument('--unique-images', type=int, default=0,
+                        help='only write this many image files and reuse them (0 = one file per row)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    formats = [fmt.strip().lower() for fmt in args.formats.split(',')]
+    for fmt in formats:
+        if fmt not in FORMAT_EXT:
+            print(f'Unknown format {fmt}')
+            sys.exit(1)
+
+    info = generate(
+        args.out, args.clips, args.frames, args.cams,
+        [parse_size(size) for size in args.sizes.split(',')],
+        formats,
+        [100 * (i + 1) for i in range(0, args.tags)],
+        layout=args.layout, unique_images=args.unique_images, seed=args.seed,
+    )
+    print(json.dumps(info, indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""
+End-to-end network benchmark.
+
+Generates (or reuses) a synthetic dataset, boots BackendServer on loopback
+in a subprocess, then drives it with N headless clients replaying labeling
+patterns. Reports images/sec, p50/p95/p99 latency per opcode, save latency
+and server RSS, and writes everything to a JSON file that bench/compare.py
+can diff between commits.
+
+Example:
+    python bench/run_bench.py --clients 4 --duration 20 --output bench_results.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import gen_dataset
+from bench_client import BenchClient, OPCODE_NAMES, quiet_logs
+
+PATTERNS = ['sequential', 'scrub', 'bulk']
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def read_rss_mb(pid):
+    # Linux only, returns None elsewhere
+    try:
+        with open(f'/proc/{pid}/status', 'r') as status_file:
+            for line in status_file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def percentile(sorted_values, pct):
+    # nearest rank
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def summarize_latency(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': sum(values) / len(values) * 1000,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': values[-1] * 1000,
+    }
+
+class ServerProcess:
+    """BackendServer booted in a child process with a generated setting file."""
+    # module and class started with the setting file
+    boot_module = 'server'
+    boot_class = 'BackendServer'
+
+    def __init__(self, work_dir, data_csv, meta_csv, port, extra_setting=None):
+        self.port = port
+        self.setting_path = os.path.join(work_dir, 'server_setting.json')
+        setting = {
+            'host': '127.0.0.1',
+            'port': port,
+            'csv_dir': data_csv,
+            'csv_save_dir': os.path.join(work_dir, 'save'),
+            'meta_path': meta_csv,
+            'save_to_same_file': False,
+        }
+        if extra_setting:
+            setting.update(extra_setting)
+        with open(self.setting_path, 'w') as setting_file:
+            json.dump(setting, setting_file, indent=4)
+        self.log_path = os.path.join(work_dir, 'server.log')
+        self.proc = None
+
+    def start(self, timeout=120.0):
+        code = (
+            f'import sys; sys.path.insert(0, sys.argv[1]); import {self.boot_module}; '
+            f'{self.boot_module}.{self.boot_class}(sys.argv[2]).start()'
+        )
+        self.log_file = open(self.log_path, 'w')
+        self.proc = subprocess.Popen(
+            [sys.executable, '-c', code, ROOT_DIR, self.setting_path],
+            stdout=self.log_file, stderr=subprocess.STDOUT,
+        )
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f'Server exited early, see {self.log_path}')
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError('Server did not start listening in time')
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self.log_file.close()
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = read_rss_mb(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self.stopped.wait(self.interval)
+
+def build_frame_list(clip_list):
+    # (first row, camera count, clip number) for every frame, same grouping as client.py
+    frame_list = []
+    for clip_number, clip in enumerate(clip_list):
+        for row in range(clip['begin'], clip['end'], clip['cam']):
+            frame_list.append((row, min(clip['cam'], clip['end'] - row), clip_number))
+    return frame_list
+
+def run_client(job):
+    client_id, host, port, pattern, duration, think_ms, window, seed = job
+    rng = random.Random(seed)
+    quiet_logs()
+    client = BenchClient(host, port)
+    client.load()
+    frame_list = build_frame_list(client.clip_list)
+    frame_cnt = len(frame_list)
+    # spread annotators over the dataset, like people working on different clips
+    position = rng.randrange(frame_cnt)
+
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        if pattern == 'sequential':
+            row, cam_cnt, _ = frame_list[position % frame_cnt]
+            client.fetch_images(range(row, row + cam_cnt), window=cam_cnt)
+            for index in range(row, row + cam_cnt):
+                tag_list = [False] * client.tag_cnt
+                tag_list[rng.randrange(client.tag_cnt)] = True
+                client.change_tag(index, index, tag_list)
+            position += 1
+        elif pattern == 'scrub':
+            position = rng.randrange(frame_cnt)
+            row, cam_cnt, _ = frame_list[position]
+            client.fetch_images(range(row, row + cam_cnt), window=cam_cnt)
+        elif pattern == 'bulk':
+            row = frame_list[position % frame_cnt][0]
+            client.fetch_images(range(row, min(row + window * 4, client.data_cnt)), window=window)
+            position = (position + window * 4) % frame_cnt
+        if think_ms > 0:
+            time.sleep(think_ms / 1000)
+    elapsed = time.perf_counter() - start
+    if pattern == 'sequential':
+        # the server autosaves while labeling, one explicit save measures its latency
+        client.save()
+    client.close()
+    return {
+        'client_id': client_id,
+        'pattern': pattern,
+        'elapsed_s': elapsed,
+        'images': client.image_cnt,
+        'image_bytes': client.image_bytes,
+        'image_errors': client.image_errors,
+        'latency': client.latency,
+    }
+
+def run(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='fitt_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    if args.dataset:
+        with open(os.path.join(args.dataset, 'dataset.json'), 'r') as info_file:
+            dataset_info = json.load(info_file)
+    else:
+        print(f'Generating dataset in {work_dir}')
+        dataset_info = gen_dataset.generate(
+            os.path.join(work_dir, 'data'), args.clips, args.frames, args.cams,
+            [gen_dataset.parse_size(size) for size in args.sizes.split(',')],
+            [fmt.strip().lower() for fmt in args.formats.split(',')],
+            [100 * (i + 1) for i in range(0, args.tags)],
+            layout=args.layout,
+        )
+
+    port = args.port or find_free_port()
+    server = ServerProcess(work_dir, dataset_info['data_csv'], dataset_info['meta_csv'], port, {
+        'autosave_rows': args.autosave,
+    })
+    print(f'Booting server on 127.0.0.1:{port}')
+    boot_start = time.perf_counter()
+    server.start()
+    boot_s = time.perf_counter() - boot_start
+    rss_idle = read_rss_mb(server.proc.pid)
+    sampler = RssSampler(server.proc.pid)
+    sampler.start()
+
+    if args.pattern == 'mixed':
+        patterns = [PATTERNS[i % len(PATTERNS)] for i in range(0, args.clients)]
+    else:
+        patterns = [args.pattern] * args.clients
+    jobs = [
+        (i, '127.0.0.1', port, patterns[i], args.duration, args.think_ms, args.window, args.seed + i)
+        for i in range(0, args.clients)
+    ]
+
+    print(f'Running {args.clients} clients ({", ".join(patterns)}) for {args.duration}s')
+    try:
+        run_start = time.perf_counter()
+        with multiprocessing.get_context('spawn').Pool(args.clients) as pool:
+            client_results = pool.map(run_client, jobs)
+        wall_s = time.perf_counter() - run_start
+    finally:
+        sampler.stopped.set()
+        sampler.join()
+        server.stop()
+
+    latency = {name: [] for name in OPCODE_NAMES.values()}
+    for result in client_results:
+        for name, values in result['latency'].items():
+            latency[name].extend(values)
+    total_images = sum(result['images'] for result in client_results)
+    total_bytes = sum(result['image_bytes'] for result in client_results)
+    # measured over the replay phase only, process spawn and initial load excluded
+    run_s = max(result['elapsed_s'] for result in client_results)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'clients': args.clients,
+            'patterns': patterns,
+            'duration_s': args.duration,
+            'think_ms': args.think_ms,
+            'window': args.window,
+            'autosave': args.autosave,
+            'dataset': dataset_info,
+        },
+        'throughput': {
+            'wall_s': wall_s,
+            'run_s': run_s,
+            'images': total_images,
+            'images_per_s': total_images / run_s if run_s else None,
+            'mb_per_s': total_bytes / run_s / 1e6 if run_s else None,
+            'image_errors': sum(result['image_errors'] for result in client_results),
+        },
+        'latency': {name: summarize_latency(values) for name, values in latency.items()},
+        'save': summarize_latency(latency['save']),
+        'server': {
+            'boot_s': boot_s,
+            'rss_idle_mb': rss_idle,
+            'rss_peak_mb': max(sampler.samples) if sampler.samples else None,
+            'rss_end_mb': sampler.samples[-1] if sampler.samples else None,
+        },
+        'clients': [
+            {key: value for key, value in result.items() if key != 'latency'}
+            for result in client_results
+        ],
+    }
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=4)
+    print_summary(results)
+    print(f'Results written to {args.output}')
+    return results
+
+def print_summary(results):
+    throughput = results['throughput']
+    print(f"images/s: {throughput['images_per_s']:.1f}  ({throughput['mb_per_s']:.1f} MB/s, "
+          f"{throughput['images']} images, {throughput['image_errors']} errors)")
+    print(f"{'opcode':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, summary in results['latency'].items():
+        if summary['count'] == 0:
+            continue
+        print(f"{name:<12}{summary['count']:>8}{summary['p50_ms']:>10.2f}"
+              f"{summary['p95_ms']:>10.2f}{summary['p99_ms']:>10.2f}")
+    server = results['server']
+    print(f"server boot: {server['boot_s']:.2f}s  rss idle/peak/end MB: "
+          f"{server['rss_idle_mb']} / {server['rss_peak_mb']} / {server['rss_end_mb']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='End-to-end benchmark for server.py')
+    parser.add_argument('--dataset', help='reuse a folder made by gen_dataset.py instead of generating one')
+    parser.add_argument('--work-dir', help='folder for generated data, server setting and logs (default: temp dir)')
+    parser.add_argument('--clips', type=int, default=10)
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--cams', type=int, default=3)
+    parser.add_argument('--sizes', default='640x360')
+    parser.add_argument('--formats', default='jpeg')
+    parser.add_argument('--tags', type=int, default=5)
+    parser.add_argument('--layout', choices=['grouped', 'alternating'], default='grouped')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--pattern', choices=PATTERNS + ['mixed'], default='mixed')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per client')
+    parser.add_argument('--think-ms', type=float, default=0.0, help='pause between frames')
+    parser.add_argument('--autosave', type=int, default=10, help='server autosave_rows, the server saves after this many changed rows')
+    parser.add_argument('--window', type=int, default=8, help='pipelined image requests for bulk pattern')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args(argv)
+    run(args)
+
+if __name__ == '__main__':
+    main()
@@ -3,90 +3,67 @@ import time
 import tkinter as tk
 from tkinter import ttk, messagebox
 from PIL import Image, ImageTk
-import socket
-import threading
-import struct
-import io
-import pandas as pd
-import os
-from io import StringIO
-import json
-
-default_setting = {
-        "host": "127.0.0.1", # socket bind ip address
-        "port": 52973, # socket bind port
-        "multiple_selection": False,
-        "always_save": True,
-    }
-
-class bcolors:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKCYAN = '\033[96m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
-
-def log_network(str):
-    print(f'[{bcolors.OKCYAN}SOCK{bcolors.ENDC}] {str}')
-
-def log_ok(str):
-    print(f'[{bcolors.OKGREEN} OK {bcolors.ENDC}] {str}')
-
-def log_error(str):
-    print(f'[{bcolors.FAIL}FAIL{bcolors.ENDC}] {str}')
-
-def log_info(str):
-    print(f'[{bcolors.OKBLUE}INFO{bcolors.ENDC}] {str}')
-
-def log_warn(str):
-    print(f'[{bcolors.WARNING}WARN{bcolors.ENDC}] {str}')
-
-class FrontendClient:
+
+from headless_client import HeadlessClient, decode_image, compile_query, pack_query_request, pack_progress_request, QUERY_NEXT, log_ok, log_error, log_info, log_warn
+from render_cache import RenderCache
+from tracing import traced
+
+class FrontendClient(HeadlessClient):
     def __init__(self,setting_path='client_setting.json'):
-        # define socket
-        self.sock = None
-        self.connected = False
-
-        # define vars
-        self.data_list = []
-        self.data_column_list = []
-
-        self.data_cnt = None
-        self.tag_cnt = None
-        self.img_cache = []
-        self.img_error_msg = []
-        self.labeling_status = []
-        
-        self.combined_entry_list_cnt = None
-        self.combined_clip_list_cnt = None
+        super().__init__()
+        self.root = None
         self.widget_order = []
+        self.combined_index = 0
+        # frame range of the clip last checked for changed images
+        self.validated_clip = None
+
+        # rendered images, Tk thread only. While frames change faster than
+        # render_settle_ms they are drawn with a fast filter, LANCZOS after
+        self.render_cache_mb = 256
+        self.render_settle_ms = 150
+        self.navigating = False
+        self.settle_job = None
+        # row -> (image, encoded bytes), so downscaled frames can be decoded
+        # at reduced size instead of from the full size image
+        self.img_data_dict = {}
+        # slider drags go to the latest value once per idle tick, frames
+        # passed on the way show a preview of scrub_preview_width pixels
+        self.slider_target = None
+        self.slider_job = None
+        self.scrub_preview_width = 320
+        # tag buttons per camera panel, they show a page of favorites and
+        # tags matching the filter box instead of one button per tag
+        self.tag_slots = 10
+        self.favorite_tags = []
+        self.favorite_tag_set = set()
+        self.tag_filter = ''
+        self.filter_match_list = []
+        self.visible_tag_list = []
+        self.tag_page = 0
+        # labeling progress of the shown clip, counted by the server. One
+        # request at a time, changes meanwhile ask again once it is answered
+        self.progress_pending = False
+        self.progress_stale = False
 
         # initialization (this is temporarily)
         self.load_setting_file(setting_path)
+        self.render_cache = RenderCache(int(self.render_cache_mb * 1e6))
         status = self.connect_to_server(self.host,self.port)
         if status == False: sys.exit(1)
 
         # request necessary data
-        # self.request_data_cnt()
-        self.request_csv_tag_info()
-        self.request_csv_data()
-        self.request_clip_data()
-        
-        # Lock until at least self.tag_cnt is available
-        time.sleep(0.5)
-        while (self.tag_cnt == None or self.data_cnt == None or self.combined_clip_list_cnt == None):
-            log_warn('Resend request for self.tag_cnt and self.data_cnt to be loaded.')
-            self.request_csv_tag_info()
-            self.request_csv_data()
-            time.sleep(0.5)
-        
-        log_ok(f'successfully loaded self.tag_cnt={self.tag_cnt} and self.data_cnt={self.data_cnt}')
-        
+        try:
+            self.load_dataset()
+        except (TimeoutError, RuntimeError, ConnectionError) as e:
+            log_error(f'Failed to load dataset: {e}')
+            self.report_error("Connection error", f"Failed to load dataset: {e}")
+            sys.exit(1)
+
         self.global_scale = 1.0  # Default scale factor
+        # favorites are named by alias in the setting file
+        self.favorite_tag_set = {i for i, alias in enumerate(self.alias_list) if alias in self.favorite_tags}
+        self.filter_match_list = list(range(0, self.tag_cnt))
+        self.update_visible_tags()
         # start UI
         self.create_ui()
 
@@ -97,69 +74,184 @@ class FrontendClient:
         # update ui
         self.update_ui()
 
+        if self.stats_interval > 0:
+            self.poll_stats()
+
         # enter tkinter loop
         self.start_client()
 
-    def load_setting_file(self, setting_path):
-        self.host = '127.0.0.1'
-        self.port = 52973
-        self.multiple_selection = False
-        self.always_save = True
-
-        self.img_index = 0
-    
-    def load_setting_file(self,setting_path):
+    def configure_setting(self, setting_data):
+        super().configure_setting(setting_data)
         try:
-            with open(setting_path, 'r') as setting_file:
-                setting_data = json.load(setting_file)
-                self.configure_setting(setting_data)
-                return
-         # Error handing
-        except FileNotFoundError:
-            log_error(f"'{setting_path}' not found.")
-            log_info(f"Writing default setting to '{setting_path}'.")
-            try:
-                with open(setting_path, 'w') as setting_file: # 'w' for write mode (overwrites existing file)
-                    json.dump(default_setting, setting_file, indent=4)
-                log_ok(f"Default setting written to {setting_path} successfully.")
-            except IOError as error:
-                log_error(f"An error occurred while writing to {setting_path}: {error}")
-        except json.JSONDecodeError:
-            log_error(f"Error: Invalid JSON format in '{setting_path}'.")
-        
-        log_error(f"Client stopped due to problem with settings.")
-        sys.exit(1)
-        return
-    
-    def configure_setting(self,setting_data):
+            self.render_cache_mb = float(setting_data["render_cache_mb"])
+        except KeyError:
+            self.render_cache_mb = 256
         try:
-            self.host = setting_data["host"]
+            self.render_settle_ms = int(setting_data["render_settle_ms"])
         except KeyError:
-            log_warn("Missing host in setting, using 127.0.0.1 as default")
-            self.host = "127.0.0.1"
+            self.render_settle_ms = 150
         try:
-            self.port = setting_data["port"]
+            self.scrub_preview_width = int(setting_data["scrub_preview_width"])
         except KeyError:
-            log_warn("Missing port in setting, using 52973 as default")
-            self.port = 52973
+            self.scrub_preview_width = 320
         try:
-            self.multiple_selection = setting_data["multiple_selection"]
+            self.tag_slots = max(int(setting_data["tag_slots"]), 1)
         except KeyError:
-            log_warn("Missing multiple_selection in setting, using false as default")
-            self.multiple_selection = False
-        # try:
-        #     self.always_save = setting_data["always_save"]
-        # except KeyError:
-        #     log_warn("Missing multiple_selection in setting, using false as default")
-        #     self.always_save = False
-        # auto save
+            self.tag_slots = 10
         try:
-            self.autosave = setting_data["autosave"]
-            if self.autosave == 0: self.autosave = 1
+            self.favorite_tags = list(setting_data["favorite_tags"])
         except KeyError:
-            log_warn("Missing autosave in setting, using 1 as default")
-            self.autosave = 1
-        
+            self.favorite_tags = []
+
+    def report_error(self, title, message):
+        messagebox.showwarning(title, message)
+
+    def on_stats(self, stats):
+        if self.root is not None:
+            self.root.after(0, self.update_stats_label)
+
+    def poll_stats(self):
+        if self.is_connected():
+            self.request_stats()
+            # other clients label this clip too
+            self.request_clip_progress()
+        self.root.after(int(self.stats_interval * 1000), self.poll_stats)
+
+    def update_stats_label(self):
+        stats = self.server_stats
+        if not stats:
+            return
+        text = f"clients {stats['clients']} | unsaved rows {stats['dirty_rows']}"
+        image_read_p50 = stats['image_read_ms']['p50']
+        if image_read_p50 is not None:
+            text += f" | read p50 {image_read_p50}ms"
+        for name, cache in stats['cache'].items():
+            if cache['hit_rate'] is not None:
+                text += f" | {name} hit {cache['hit_rate']*100:.0f}%"
+        save_mean = stats['save']['ms']['mean']
+        if save_mean is not None:
+            text += f" | save {save_mean:.0f}ms"
+        progress = stats.get('progress')
+        if progress and progress['frames']:
+            text += f" | labeled {progress['labeled_frames']}/{progress['frames']} frames"
+        last_save_time = stats.get('autosave', {}).get('last_save_time')
+        if last_save_time is not None:
+            text += f" | saved {time.strftime('%H:%M:%S', time.localtime(last_save_time))}"
+        self.stats_label.config(text=text)
+
+    def request_clip_progress(self):
+        if self.progress_pending:
+            self.progress_stale = True
+            return
+        if not self.clip_cnt or not self.is_connected():
+            return
+        clip_index = self.get_clip_of_frame(self.combined_index)
+        def on_result(result):
+            self.root.after(0, lambda: self.show_clip_progress(clip_index, result))
+        self.progress_pending = True
+        self.progress_stale = False
+        try:
+            self.send_with_waiter('progress', pack_progress_request(clip_index, clip_index), on_result)
+        except RuntimeError as e:
+            self.progress_pending = False
+            log_warn(f"Progress request failed: {e}")
+
+    def show_clip_progress(self, clip_index, result):
+        self.progress_pending = False
+        if isinstance(result, Exception):
+            log_warn(f"Progress request failed: {result}")
+        elif clip_index == self.get_clip_of_frame(self.combined_index):
+            frames, labeled_frames, rows, labeled_rows = result[0]
+            self.progress_label.config(
+                text=f"clip {clip_index+1}/{self.clip_cnt}: {labeled_frames}/{frames} frames labeled"
+            )
+        if self.progress_stale:
+            self.request_clip_progress()
+
+    def handle_image(self, index, img_data):
+        image = super().handle_image(index, img_data)
+        if image is not None and self.cache_images:
+            self.img_data_dict[index] = (image, img_data)
+        return image
+
+    def on_image(self, index):
+        # called from the socket thread, redraw on the Tk thread
+        if self.root is not None and index in self.get_combined_index_list():
+            self.root.after(0, self.init_frame)
+
+    def on_scaled_image(self, index, image):
+        # scaled images are only requested as scrub previews
+        if self.root is not None and image is not None:
+            self.root.after(0, lambda: self.store_preview(index, image))
+
+    def store_preview(self, index, image):
+        image.load()
+        self.render_cache.put((index, 'preview', None), image, image.size[0] * image.size[1] * 3)
+        if index in self.get_combined_index_list() and self.img_cache[index] is None:
+            self.init_frame()
+
+    def get_preview(self, img_index):
+        # low resolution stand-in while scrubbing, requested if missing
+        preview = self.render_cache.get((img_index, 'preview', None))
+        if preview is None and self.navigating and self.scrub_preview_width > 0:
+            self.request_scaled_image(img_index, self.scrub_preview_width, self.scrub_preview_width, droppable=True)
+        return preview
+
+    def on_validators(self, changed_list):
+        # changed images were dropped from img_cache, redraw to fetch them again
+        if self.root is None:
+            return
+        def discard():
+            for index in changed_list:
+                self.render_cache.discard_row(index)
+        self.root.after(0, discard)
+        if set(changed_list) & set(self.get_combined_index_list()):
+            self.root.after(0, self.init_frame)
+
+    def get_rendered_image(self, img_index, image):
+        # PhotoImage of image at global_scale, from render_cache when possible
+        scale = self.global_scale
+        if scale == 1.0:
+            key_list = [(img_index, scale, None)]
+        else:
+            key_list = [(img_index, scale, Image.Resampling.LANCZOS)]
+            if self.navigating:
+                key_list.append((img_index, scale, Image.Resampling.BILINEAR))
+        for key in key_list:
+            photo = self.render_cache.get(key)
+            if photo is not None:
+                return photo
+
+        key = key_list[-1]
+        if scale != 1.0:
+            scaled_width = int(image.size[0] * scale)
+            scaled_height = int(image.size[1] * scale)
+            entry = self.img_data_dict.get(img_index)
+            # only the bytes the cached image was opened from, not a stale pair
+            if scale < 1.0 and entry is not None and entry[0] is image:
+                image = decode_image(entry[1], scale)
+            if image.size != (scaled_width, scaled_height):
+                image = image.resize((scaled_width, scaled_height), key[2])
+        photo = ImageTk.PhotoImage(image)
+        self.render_cache.put(key, photo, image.size[0] * image.size[1] * 4)
+        return photo
+
+    def navigation_settled(self):
+        self.settle_job = None
+        # redraw what was shown with the fast filter or as a preview
+        if self.navigating:
+            self.navigating = False
+            self.init_frame()
+
+    def revalidate_clip_of_frame(self):
+        # ask the server once per entered clip whether any cached image changed
+        clip_range = self.get_clip_frame_range(self.combined_index)
+        if clip_range == self.validated_clip or not self.is_connected():
+            return
+        self.validated_clip = clip_range
+        self.request_validators(
+            self.get_frame_index_list(clip_range[0])[0], self.get_frame_index_list(clip_range[1]-1)[-1]
+        )
 
     def create_ui(self):
         log_info('Building GUI')
@@ -204,6 +296,22 @@ class FrontendClient:
         )
         self.status_label.pack(side=tk.LEFT, padx=5)
 
+        # labeling progress of the shown clip, filled by request_clip_progress
+        self.progress_label = ttk.Label(
+            self.status_bar,
+            text="",
+            anchor=tk.W
+        )
+        self.progress_label.pack(side=tk.LEFT, padx=5)
+
+        # server stats, filled by poll_stats
+        self.stats_label = ttk.Label(
+            self.status_bar,
+            text="",
+            anchor=tk.E
+        )
+        self.stats_label.pack(side=tk.RIGHT, padx=5)
+
         # self.scale_var = tk.IntVar()
 
         self.slider = tk.Scale(self.status_bar, from_=1, to=self.combined_entry_list_cnt, orient=tk.HORIZONTAL, command=self.on_slider_move)
@@ -236,8 +344,9 @@ class FrontendClient:
         self.scroll_canvas.bind("<Down>", self._on_scroll_down)
         # === MODIFIED SECTION ENDS HERE ===
         
-        # create list for all cameras
+        # panels of the cameras shown, the first entries of widget_pool
         self.widget_list = []
+        self.widget_pool = []
         
         self.combined_index=0
         
@@ -267,10 +376,52 @@ class FrontendClient:
         self.scale_up_btn = ttk.Button(self.control_frame, text="Scale +", command=self.scale_up)
         self.scale_up_btn.pack(side=tk.LEFT, padx=5)
 
+        # mass labeling, copies the current frame tags to other frames
+        self.range_mark = None
+        self.mark_btn = ttk.Button(self.control_frame, text="[M] Mark Range", command=self.mark_range)
+        self.mark_btn.pack(side=tk.LEFT, padx=(20, 5))
+
+        self.range_label = ttk.Label(self.control_frame, text="No mark")
+        self.range_label.pack(side=tk.LEFT, padx=5)
+
+        self.apply_range_btn = ttk.Button(self.control_frame, text="[R] Apply to Range", command=self.apply_frame_to_range)
+        self.apply_range_btn.pack(side=tk.LEFT, padx=5)
+
+        self.apply_clip_btn = ttk.Button(self.control_frame, text="[C] Apply to Clip", command=self.apply_frame_to_clip)
+        self.apply_clip_btn.pack(side=tk.LEFT, padx=5)
+
+        # jumps found by tag queries on the server
+        self.next_unlabeled_btn = ttk.Button(self.control_frame, text="[U] Next Unlabeled", command=self.goto_next_unlabeled)
+        self.next_unlabeled_btn.pack(side=tk.LEFT, padx=(20, 5))
+        self.next_match_btn = ttk.Button(self.control_frame, text="[N] Next Match in Clip", command=self.goto_next_match)
+        self.next_match_btn.pack(side=tk.LEFT, padx=5)
+
+        # tag filter, pages through the tags shown on the panels
+        self.tag_filter_var = tk.StringVar()
+        self.tag_filter_var.trace_add('write', self.on_tag_filter_change)
+        ttk.Label(self.control_frame, text="[/] Tags").pack(side=tk.LEFT, padx=(20, 5))
+        self.tag_filter_entry = ttk.Entry(self.control_frame, textvariable=self.tag_filter_var, width=16)
+        self.tag_filter_entry.pack(side=tk.LEFT, padx=5)
+        self.tag_filter_entry.bind('<Return>', lambda event: self.scroll_canvas.focus_set())
+        self.tag_filter_entry.bind('<Escape>', self.clear_tag_filter)
+        self.tag_prev_btn = ttk.Button(self.control_frame, text="<", width=2, command=lambda: self.change_tag_page(-1))
+        self.tag_prev_btn.pack(side=tk.LEFT)
+        self.tag_page_label = ttk.Label(self.control_frame, text="")
+        self.tag_page_label.pack(side=tk.LEFT, padx=5)
+        self.tag_next_btn = ttk.Button(self.control_frame, text=">", width=2, command=lambda: self.change_tag_page(1))
+        self.tag_next_btn.pack(side=tk.LEFT)
+        self.update_tag_page_label()
+
         self.root.bind('<Left>', self.keyboard_event)
         self.root.bind('<Right>', self.keyboard_event)
         self.root.bind('s', self.keyboard_event)
         self.root.bind('S', self.keyboard_event)
+        for key in ['m', 'M', 'r', 'R', 'c', 'C', 'u', 'U', 'n', 'N']:
+            self.root.bind(key, self.keyboard_event)
+        # tag hotkeys, numbered across the panels in their order, see handle_selection
+        for key_num in range(1, 10):
+            self.root.bind(str(key_num), self.keyboard_event)
+        self.root.bind('/', lambda event: self.tag_filter_entry.focus_set())
 
         # ADD THIS LINE:
         self.root.bind("<Button-1>", self._on_canvas_click)
@@ -327,78 +478,29 @@ class FrontendClient:
         """Set focus to canvas when clicked for keyboard scrolling"""
         self.scroll_canvas.focus_set()
     
-    def connect_to_server(self,host,port):
-        log_network(f'Connecting of {host}:{port}')
-        try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.settimeout(3.0)
-            self.sock.connect((host, port))
-            self.connected = True
-            threading.Thread(target=self.receive_data, daemon=True).start()
-            return True
-
-        except (ConnectionRefusedError,socket.timeout) as e:
-            log_error(f"Connection failed: {str(e)}")
-            messagebox.showwarning("Connection Error", 
-                                  f"Failed to connect to server at {host}:{port}\n{str(e)}")
-            return False
-            
-        except Exception as e:
-            self.connected = False
-            log_error(f"Unexpected connection error: {str(e)}")
-            messagebox.showerror("Connection Error", 
-                                f"Unexpected error: {str(e)}")
-            return False
-            
-    def is_connected(self):
-        if self.sock is None: self.connected = False
-        return self.connected and self.sock is not None
-    
-    def safe_sendall(self,data):
-        if not self.is_connected():
-            log_error("Cannot send data: not connected to server")
-            raise RuntimeError("Cannot send data: not connected to server")
-        try:
-            self.sock.sendall(data)
-        except (socket.error, OSError) as e:
-            log_error(f"Error sending data: {str(e)}")
-            self.connected = False
-            self.close_sock()
-            raise RuntimeError(f"Error sending data: {str(e)}")
-        except Exception as e:
-            log_error(f"Unexpected error sending data: {str(e)}")
-            self.connected = False
-            self.close_sock()
-            raise RuntimeError(f"Unexpected error sending data: {str(e)}")
-    
-    def close_sock(self):
-        if self.sock:
-            try:
-                self.sock.close()
-            except:
-                pass
-            self.sock = None
-        
-    def reconnect(self):
-        if self.is_connected():
-            log_info("Already connected, no need to reconnect")
-            return
-        self.close_sock()
-        self.connect_to_server(self.host, self.port)
-        if self.is_connected():
-            log_ok("Reconnection successful")
-    
     def get_combined_index_list(self):
-        return self.combined_entry_list[self.combined_index]
+        return self.get_frame_index_list(self.combined_index)
     
     def keyboard_event(self,event):
         log_info(f"key: {event}")
+        if event.widget is self.tag_filter_entry:
+            return
         if event.keysym == 'Left':
             self.prev_img_group()
         elif event.keysym == 'Right':
             self.next_img_group()
         elif event.keysym == 's' or event.keysym == 'S':
             self.request_save()
+        elif event.keysym == 'm' or event.keysym == 'M':
+            self.mark_range()
+        elif event.keysym == 'r' or event.keysym == 'R':
+            self.apply_frame_to_range()
+        elif event.keysym == 'c' or event.keysym == 'C':
+            self.apply_frame_to_clip()
+        elif event.keysym == 'u' or event.keysym == 'U':
+            self.goto_next_unlabeled()
+        elif event.keysym == 'n' or event.keysym == 'N':
+            self.goto_next_match()
         else:
             key_num = int(event.keysym)
             log_info(f"key_num: {key_num}")
@@ -410,6 +512,8 @@ class FrontendClient:
                     pass
                     
     def keyboard_event_false(self,event):
+        if event.widget is self.tag_filter_entry:
+            return
         if event.keysym == 'f' or event.keysym == 'F':
             self.handle_selection_false(-1)
             self.next_img_group()
@@ -417,39 +521,147 @@ class FrontendClient:
     def handle_selection_false(self,group_index):
         if group_index == -1:
             for img_index in self.get_combined_index_list():
-                for i in range(0,self.tag_cnt):
-                    self.data_list[img_index][i] = False
-                self.request_csv_change(img_index,img_index,self.data_list[img_index])
+                self.clear_tags(img_index)
         else:
             img_index = self.get_combined_index_list()[group_index]
-            for i in range(0,self.tag_cnt):
-                self.data_list[img_index][i] = False
-            self.request_csv_change(img_index,img_index,self.data_list[img_index])
-                
-        # self.request_csv_change(img_index,img_index,self.data_list[img_index])
+            self.clear_tags(img_index)
         self.update_ui()
     
     def handle_selection(self,key_num):
         key_num-=1
-        tag_index = key_num % self.tag_cnt
-        img_index = self.get_combined_index_list()[self.widget_order[int(key_num / self.tag_cnt)]]
-        # write to own csv
-        # local data_list write
+        order_index = int(key_num / self.tag_cnt)
+        # keys past the last panel
+        if order_index >= len(self.widget_order):
+            return
+        self.select_panel_tag(order_index, key_num % self.tag_cnt)
+
+    def select_panel_tag(self, order_index, tag_index):
+        img_index = self.get_combined_index_list()[self.widget_order[order_index]]
         log_info(f'selecting tag {tag_index}, alias {self.alias_list[tag_index]}')
-        # false tag
-        
-        # single selection
-        if self.multiple_selection==False:
-            self.data_list[img_index][tag_index] = True
-            for i in range(0,self.tag_cnt):
-                if i!=tag_index:
-                    self.data_list[img_index][i] = False
-        # multiple selection
+        self.select_tag(img_index, tag_index)
+        self.update_ui()
+
+    def get_hotkey(self, order_index, tag_index):
+        # digit selecting this tag on the panel at order_index, None past 9
+        key_num = tag_index+1+order_index*self.tag_cnt
+        return key_num if key_num <= 9 else None
+
+    def on_tag_filter_change(self, *args):
+        tag_filter = self.tag_filter_var.get().strip().lower()
+        # typing more narrows the last matches, anything else searches every alias
+        if tag_filter.startswith(self.tag_filter):
+            candidate_list = self.filter_match_list
         else:
-            self.data_list[img_index][tag_index] = not self.data_list[img_index][tag_index]
-        self.request_csv_change(img_index,img_index,self.data_list[img_index])
+            candidate_list = range(0, self.tag_cnt)
+        self.filter_match_list = [i for i in candidate_list if tag_filter in self.alias_list[i].lower()]
+        self.tag_filter = tag_filter
+        self.tag_page = 0
+        self.refresh_tag_panel()
+
+    def clear_tag_filter(self, event=None):
+        self.tag_filter_var.set('')
+        self.scroll_canvas.focus_set()
+
+    def toggle_favorite(self, tag_index):
+        if tag_index in self.favorite_tag_set:
+            self.favorite_tag_set.discard(tag_index)
+        else:
+            self.favorite_tag_set.add(tag_index)
+        log_info(f'favorite tags: {[self.alias_list[i] for i in sorted(self.favorite_tag_set)]}')
+        self.refresh_tag_panel()
+
+    def change_tag_page(self, step):
+        page_cnt = max(1, -(-len(self.visible_tag_list) // self.tag_slots))
+        page = min(max(self.tag_page + step, 0), page_cnt - 1)
+        if page != self.tag_page:
+            self.tag_page = page
+            self.refresh_tag_panel()
+
+    def update_visible_tags(self):
+        # favorites first, then the tags matching the filter
+        favorite_list = sorted(self.favorite_tag_set)
+        self.visible_tag_list = favorite_list + [i for i in self.filter_match_list if i not in self.favorite_tag_set]
+
+    def get_page_tag_list(self):
+        return self.visible_tag_list[self.tag_page*self.tag_slots:(self.tag_page+1)*self.tag_slots]
+
+    def update_tag_page_label(self):
+        begin = self.tag_page*self.tag_slots
+        end = min(begin + self.tag_slots, len(self.visible_tag_list))
+        self.tag_page_label.config(text=f'{begin+1 if end > begin else 0}-{end}/{len(self.visible_tag_list)}')
+
+    def refresh_tag_panel(self):
+        self.update_visible_tags()
+        self.update_tag_page_label()
+        for widget in self.widget_list:
+            widget.show_tags()
+        self.update_ui()
+
+    def mark_range(self):
+        self.range_mark = self.combined_index
+        self.range_label.config(text=f"Mark: {self.range_mark+1}")
+        log_info(f'Range mark at frame {self.range_mark}')
+
+    def apply_frame_to_range(self):
+        if self.range_mark is None:
+            messagebox.showinfo("Mass labeling", "Mark the first frame of the range with [M] first.")
+            return
+        frame_cnt = abs(self.combined_index - self.range_mark) + 1
+        if not messagebox.askyesno("Mass labeling",
+                f"Copy the tags of frame {self.combined_index+1} to frames "
+                f"{min(self.range_mark, self.combined_index)+1} to {max(self.range_mark, self.combined_index)+1} "
+                f"({frame_cnt} frames)?"):
+            return
+        self.apply_to_range(self.combined_index, self.range_mark, self.combined_index)
+        self.update_ui()
+
+    def apply_frame_to_clip(self, cam_offset=None):
+        clip_begin, clip_end = self.get_clip_frame_range(self.combined_index)
+        target = "all cameras" if cam_offset is None else f"camera {cam_offset+1}"
+        if not messagebox.askyesno("Mass labeling",
+                f"Copy the tags of frame {self.combined_index+1} ({target}) to the whole clip, "
+                f"frames {clip_begin+1} to {clip_end} ({clip_end-clip_begin} frames)?"):
+            return
+        self.apply_to_clip(self.combined_index, cam_offset)
         self.update_ui()
 
+    def goto_next_unlabeled(self):
+        # next frame with a camera still without tags, anywhere after this one
+        self.goto_next_query_match('unlabeled', 0, self.data_cnt - 1, 'unlabeled frame')
+
+    def goto_next_match(self):
+        # next frame of this clip with a tag matching the filter box, or a favorite without filter
+        tag_list = self.filter_match_list if self.tag_filter else sorted(self.favorite_tag_set)
+        if not tag_list:
+            messagebox.showinfo("Next match", "Type tags into the [/] Tags filter box or mark favorites first.")
+            return
+        clip_begin, clip_end = self.get_clip_frame_range(self.combined_index)
+        first_row = self.get_frame_index_list(clip_begin)[0]
+        last_row = self.get_frame_index_list(clip_end - 1)[-1]
+        expr = ('or',) + tuple(tag_list) if len(tag_list) > 1 else tag_list[0]
+        self.goto_next_query_match(expr, first_row, last_row, 'matching frame in this clip')
+
+    def goto_next_query_match(self, expr, index1, index2, description):
+        start = self.get_combined_index_list()[-1] + 1
+        if start > index2:
+            messagebox.showinfo("Next frame", f"No {description} after this one.")
+            return
+        def on_result(result):
+            self.root.after(0, lambda: self.show_query_match(result, description))
+        data = pack_query_request(QUERY_NEXT, index1, index2, start, compile_query(expr, self.alias_list))
+        try:
+            self.send_with_waiter('query', data, on_result)
+        except RuntimeError as e:
+            self.report_error("Connection error", f"{e}")
+
+    def show_query_match(self, result, description):
+        if isinstance(result, Exception):
+            self.report_error("Tag query failed", f"{result}")
+        elif not result:
+            messagebox.showinfo("Next frame", f"No {description} after this one.")
+        else:
+            self.goto_img_group(self.get_frame_of_row(result[0][0]))
+
     def prev_img_group(self):
         if self.combined_index > 0:
             self.goto_img_group(self.combined_index-1)
@@ -459,12 +671,27 @@ class FrontendClient:
             self.goto_img_group(self.combined_index+1)
 
     def on_slider_move(self,value):
-        self.goto_img_group(int(value)-1)
+        # a drag calls this for every value passed, keep only the latest
+        self.slider_target = int(value)-1
+        if self.slider_job is None:
+            self.slider_job = self.root.after_idle(self.apply_slider_move)
+
+    def apply_slider_move(self):
+        self.slider_job = None
+        if self.slider_target != self.combined_index:
+            self.goto_img_group(self.slider_target)
 
     # wrapper for goto frame, update both image and ui
     def goto_img_group(self,index):
         if index<self.combined_entry_list_cnt and index>=0:
             self.combined_index = index
+            # a second frame change within render_settle_ms means fast navigation
+            self.navigating = self.settle_job is not None
+            if self.settle_job is not None:
+                self.root.after_cancel(self.settle_job)
+            self.settle_job = self.root.after(self.render_settle_ms, self.navigation_settled)
+            # images of frames passed on the way are not needed any more
+            self.drop_stale_requests(self.get_combined_index_list())
             self.init_frame()
             self.update_ui()
         else:
@@ -473,28 +700,27 @@ class FrontendClient:
     def get_cam_cnt(self):
         return len(self.get_combined_index_list())
     
+    @traced('init_frame')
     def init_frame(self):
+        self.revalidate_clip_of_frame()
         if self.get_cam_cnt()!=len(self.widget_list):
-            log_info('Destroy frames due to mismatch')
-            for widget in self.widget_list:
-                widget.destroy_all()
-                self.widget_order = []
-            log_info(f'Create {self.get_cam_cnt()} frame')
-            self.widget_list = []
-            for i in range(0,self.get_cam_cnt()):
-                self.widget_order.append(i)
-            for i in self.widget_order:
-                self.widget_list.append(DisplayWidget(self.widget_frame,i,self))
+            # panels are pooled, a clip with fewer cameras only hides the rest
+            log_info(f'Show {self.get_cam_cnt()} frame')
+            for widget in self.widget_pool[self.get_cam_cnt():]:
+                widget.hide()
+            while len(self.widget_pool) < self.get_cam_cnt():
+                self.widget_pool.append(DisplayWidget(self.widget_frame,len(self.widget_pool),self))
+            self.widget_list = self.widget_pool[:self.get_cam_cnt()]
+            self.widget_order = list(range(0,self.get_cam_cnt()))
+            self.update_order()
         
         for widget in self.widget_list:
             widget.display_img()
     
+    @traced('update_order')
     def update_order(self):
-        for widget in self.widget_list:
-            widget.destroy_all()
-        self.widget_list = []
-        for i in self.widget_order:
-            self.widget_list.append(DisplayWidget(self.widget_frame,i,self))
+        for order_index, group_index in enumerate(self.widget_order):
+            self.widget_list[group_index].place(order_index)
         
         # === ADD THIS LINE ===
         # Trigger frame reconfigure to update scroll region
@@ -502,326 +728,20 @@ class FrontendClient:
         self._on_frame_configure(None)
         
     
+    @traced('update_ui')
     def update_ui(self):
         for widget in self.widget_list:
             widget.update_ui()
         
         # label
         self.status_label.config(text=f'{self.combined_index+1}/{self.combined_entry_list_cnt}')
+        # after a tag change or into another clip
+        self.request_clip_progress()
 
         # slider
         self.slider.set(self.combined_index+1)
         pass
     
-    def request_image(self, index):
-        log_network(f'Request image {index}')
-        try:
-            self.safe_sendall(b'\xff\x01')
-            self.safe_sendall(struct.pack('>I', index))
-        except RuntimeError as e:
-            messagebox.showwarning("Connection error", 
-                        f"{e}")
-
-    def request_all_image(self):
-        log_info(f'Request all image')
-        for i in range(0,self.data_cnt):
-            if self.img_cache[i] == None:
-                self.request_image(i)
-
-    def request_csv_tag_info(self):
-        log_network(f'Request csv tag')
-        try:
-            self.safe_sendall(b'\xff\x02')
-        except RuntimeError as e:
-            messagebox.showwarning("Connection error", 
-                        f"{e}")
-
-    def request_csv_change(self,index1,index2,write_list):
-        log_network(f'Request csv change')
-        log_network(f'List to send: {write_list}')
-        try:
-            self.safe_sendall(b'\xff\x03')
-            self.safe_sendall(struct.pack('>III', index1,index2, self.tag_cnt ))
-            for i in range(0,self.tag_cnt):
-                if write_list[i]:
-                    log_info(f'Sending True for tag {i} {self.alias_list[i]}')
-                    self.safe_sendall(b'\x01')
-                else:
-                    log_info(f'Sending False for tag {i} {self.alias_list[i]}')
-                    self.safe_sendall(b'\x00')
-            # autosave when writing
-            if(index1%self.autosave == 0 or index1 == self.data_cnt):
-                self.request_save()
-        except RuntimeError as e:
-            messagebox.showwarning("Connection error", 
-                        f"{e}")
-    
-    def request_save(self):
-        log_network(f'Request save')
-        try:
-            self.safe_sendall(b'\xff\x04')
-        except RuntimeError as e:
-            messagebox.showwarning("Connection error", 
-                        f"{e}")
-    
-    def request_clip_data(self):
-        log_network(f'Request clip data')
-        try:
-            self.safe_sendall(b'\xff\x05')
-        except RuntimeError as e:
-            messagebox.showwarning("Connection error", 
-                        f"{e}")
-    
-    def request_csv_data(self):
-        log_network(f'Request csv data')
-        try:
-            self.safe_sendall(b'\xff\x06')
-        except RuntimeError as e:
-            messagebox.showwarning("Connection error", 
-                        f"{e}")
-    
-    def safe_recv(self,size):
-        self.sock.settimeout(30.0)
-        data = bytearray()
-        while len(data) < size:
-            try:
-                packet = self.sock.recv(size - len(data))
-                if not packet:
-                    log_error("Socket connection broken")
-                data.extend(packet)
-            except socket.timeout:
-                log_error(f"Timeout, expected length: {size}, received: {len(data)}")
-                messagebox.showwarning("Connection error", 
-                        f"Timeout, expected length: {size}, received: {len(data)}")
-        return bytes(data)
-
-    def receive_data(self):
-        log_network(f'Connection established, listening for data')
-        try:
-            while True:
-                self.sock.settimeout(None)
-                init_char = self.sock.recv(1)
-                if not init_char: break
-                else:
-                    verifier = struct.unpack('B', init_char)[0]
-                    if verifier != 0xFF: 
-                        log_network(f"Bad byte of {verifier}, dropping byte")
-                        continue
-                
-                log_network("Header matched, reading socket message")
-                cmd = struct.unpack('B', self.safe_recv(1))[0]
-                # receive image
-                if cmd == 0x01: 
-                    self.receive_image()
-                # receive csv tag
-                elif cmd == 0x02:  
-                    self.receive_csv_tag()
-                # CSV change completed
-                elif cmd == 0x03:
-                    self.receive_csv_change_msg()
-                # save completed
-                elif cmd == 0x04:  
-                    self.receive_csv_save_msg()
-                # clip data
-                elif cmd == 0x05:  
-                    self.receive_clip_data()
-                # receive csv data
-                elif cmd == 0x06:  
-                    self.receive_csv_data()
-                else:
-                    log_warn(f"Unknown cmd byte {cmd}. Maybe check version?")
-                    
-        except ConnectionResetError:
-            log_error("Connection reset by server")
-            messagebox.showwarning("Connection error", 
-                        f"Connection reset by server")
-            self.connected = False
-        except socket.timeout:
-            log_error("Socket timeout, connection may be lost")
-            messagebox.showwarning("Connection error", 
-                        f"Socket timeout, connection may be lost")
-            self.connected = False
-        except Exception as e:
-            log_error(f"Unexpected error in receive_data: {str(e)}")
-            messagebox.showwarning("Connection error", 
-                        f"Unexpected error in receive_data: {str(e)}")
-            self.connected = False
-        finally:
-            if self.sock:
-                try:
-                    self.sock.close()
-                except:
-                    pass
-                self.sock = None
-    
-    def receive_image(self):
-        data = self.safe_recv(5)
-        status, index = struct.unpack('>BI', data)
-        # read data through chunk
-        if status == 0x00:
-            # unset failed state
-            self.img_error_msg[index] = None
-
-            data = self.safe_recv(4)
-            img_size = struct.unpack('>I', data)[0]
-            received = 0
-            img_data = b''
-            while received < img_size:
-                # 4kb per chunk
-                chunk = self.safe_recv(min(4096, img_size - received))
-                if not chunk:
-                    log_warn('Connection closed early')
-                img_data += chunk
-                received += len(chunk)
-            self.handle_image(index,img_data)
-            log_network(f"Received image {index}")
-        else:
-            log_warn(f"Server respond with error with image {index}")
-            data = self.safe_recv(4)
-            error_size = struct.unpack('>I', data)[0]
-            data = self.safe_recv(error_size)
-            error_msg = data.decode('utf-8')
-            log_warn(f"Error received: {error_msg}")
-            self.img_error_msg[index] = error_msg
-
-            if index in self.get_combined_index_list():
-                self.root.after(0,self.init_frame())
-            
-    def receive_csv_tag(self):
-        data = self.safe_recv(5)
-        status, self.tag_cnt = struct.unpack('>BI',data)
-        alias_list = []
-        for i in range(0,self.tag_cnt):
-            data =  self.safe_recv(4)
-            alias_size = struct.unpack('>I', data)[0]
-            alias_bytes =  self.safe_recv(alias_size)
-            alias = alias_bytes.decode('utf-8')
-            alias_list.append(alias)
-        log_network(f"Received {self.tag_cnt} csv tag with alias_list of {alias_list}")
-        self.handle_csv_tag(alias_list)
-    def receive_csv_change_msg(self):
-        data = self.safe_recv(1)
-        status = struct.unpack('>B',data)[0]
-        if status == 0x00:
-            log_ok(f"CSV change complete.")
-        else:
-            log_warn(f"CSV change failed!")
-            messagebox.showwarning("Server error", 
-                        f"Server failed to change CSV data. Check server console.")
-    def receive_csv_save_msg(self):
-        data = self.safe_recv(1)
-        status = struct.unpack('>B',data)[0]
-        if status == 0x00:
-            log_ok(f"Save complete.")
-        else:
-            log_warn(f"Save failed!")
-            messagebox.showwarning("Server error", 
-                        f"Server failed to save the csv file. Check server console.")
-    
-    def receive_clip_data(self):
-        data = self.safe_recv(1)
-        status = struct.unpack('>B',data)[0]
-        if status == 0x00:
-            log_network(f"Receiving clip data")
-            data = self.safe_recv(4)
-            self.clip_cnt = struct.unpack('>I', data)[0]
-            self.clip_list = []
-            for i in range(0,self.clip_cnt):
-                clip = {}
-                data = self.safe_recv(12)
-                clip['begin'],clip['end'],clip['cam'] = struct.unpack('>III', data)
-                self.clip_list.append(clip)
-            self.handle_clip_data()
-        else:
-            log_error(f'Error in receiving clip data')
-    
-    def receive_csv_data(self):
-        log_network("receiving csv data")
-        data = self.safe_recv(5)
-        status, csv_size = struct.unpack('>BI', data)
-        # read data through chunk
-        if status == 0x00:
-            received = 0
-            csv_bytes = b''
-            while received < csv_size:
-                # 4kb per chunk
-                chunk = self.safe_recv(min(4096, csv_size - received))
-                if not chunk:
-                    log_warn('Connection closed early')
-                csv_bytes += chunk
-                received += len(chunk)
-            self.handle_csv(csv_bytes)
-        else:
-            pass
-
-    def handle_image(self, index, img_data):
-        if not img_data:
-            log_warn("empty image data")
-            return
-        
-        image = Image.open(io.BytesIO(img_data))
-        
-        # image.thumbnail((796, 448))  # adjust size
-        # photo = ImageTk.PhotoImage(image)
-        
-        self.img_cache[index] = image
-
-        for i in range(0,len(self.get_combined_index_list())):
-            if index == self.get_combined_index_list()[i]:
-                self.root.after(0,self.init_frame())
-    
-    def handle_csv_tag(self,alias_list):
-        self.alias_list = alias_list
-    
-    def handle_csv(self,csv_bytes):
-        csv_str = csv_bytes.decode('utf-8')
-        csv_data = pd.read_csv(StringIO(csv_str))
-        self.data_list = csv_data.values.tolist()
-        self.data_column_list = csv_data.columns.tolist()
-
-        self.data_cnt = len(self.data_list)
-        self.img_cache = []
-        self.img_error_msg = []
-        self.labeling_status = []
-        for i in range(0,self.data_cnt):
-            self.img_cache.append(None)
-            self.img_error_msg.append(None)
-            self.labeling_status.append(False)
-        
-        log_info(f"CSV list received with size of {len(self.data_list)}")
-    
-    def handle_clip_data(self):
-        # self.clip_data = []
-        
-        # verify all clip cover all the images
-        for i in range(0,self.clip_cnt-1):
-            if self.clip_list[i]['end'] != self.clip_list[i+1]['begin']:
-                log_error(f'Broken clip data! clip {i} end {self.clip_list[i]['end']}, clip {i+1} begin {self.clip_list[i+1]['begin']}')
-        
-        self.combined_entry_list = []
-        self.combined_clip_list = []
-        
-        self.combined_entry_list_cnt = None
-        self.combined_clip_list_cnt = None
-        
-        for clip in self.clip_list:
-            combined_clip_begin_index = len(self.combined_entry_list)
-            
-            for i in range(clip['begin'],clip['end'],clip['cam']):
-                combined_entry = []
-                for j in range(i,i+clip['cam']):
-                    combined_entry.append(j)
-                self.combined_entry_list.append(combined_entry)
-                
-            combined_clip_end_index = len(self.combined_entry_list)
-            
-            for i in range(clip['begin'],clip['end'],clip['cam']):
-                combined_clip = (combined_clip_begin_index,combined_clip_end_index)
-                self.combined_clip_list.append(combined_clip)
-        
-        self.combined_entry_list_cnt = len(self.combined_entry_list)
-        self.combined_clip_list_cnt = len(self.combined_clip_list)
-    
     def change_widget_order(self,pos_index, dir):
         log_info("try to change order")
         if(dir == 1):
@@ -836,9 +756,8 @@ class FrontendClient:
                 temp = self.widget_order[pos_index-1]
                 self.widget_order[pos_index-1] = self.widget_order[pos_index]
                 self.widget_order[pos_index] = temp
+        # panels keep their camera and image, only their positions move
         self.update_order()
-        self.init_frame()
-        self.update_ui()
         log_info(f"order: {self.widget_order}")
         
             
@@ -847,39 +766,30 @@ class FrontendClient:
         self.root.mainloop()
     
 class DisplayWidget():
+    """Panel of one camera: image canvas, tag buttons and order controls.
+
+    Panels are pooled by FrontendClient and never destroyed. group_index
+    (the camera) is fixed, reordering only moves the panel to another
+    order_index with place().
+    """
     def __init__(self,widget_frame,group_index,outer):
         self.group_index = group_index
         log_info(f'Init {self.group_index}')
         self.init = True
         self.is_deleted = False
+        # grid position, None while hidden
+        self.order_index = None
+        # style last set on each tag button and the false button
+        self.style_list = []
         
         # Initialize with default dimensions - will be updated when image loads
         self.canvas_width = 796
         self.canvas_height = 448
-        
-        for i in range(0,len(outer.widget_order)):
-            if group_index == outer.widget_order[i]:
-                self.order_index = i
-                break
 
         self.outer = outer
         
-        # Calculate grid position for wrapping layout
-        try:
-            window_width = self.outer.scroll_canvas.winfo_width()
-            if window_width <= 1:
-                window_width = 1000
-        except:
-            window_width = 1000
-        
-        # Use current canvas width for initial layout calculation
-        widgets_per_row = max(1, window_width // (self.canvas_width + 24))  # 24 = padding
-        row = self.order_index // widgets_per_row
-        col = self.order_index % widgets_per_row
-        
         # UI stuff - image display frame
         self.img_frame = ttk.Frame(widget_frame)
-        self.img_frame.grid(row=row, column=col, padx=5, pady=5, sticky="nw")
         
         # Create canvas with initial size - will be reconfigured when image loads
         self.img_canvas = tk.Canvas(self.img_frame, width=self.canvas_width, height=self.canvas_height, bg="gray")
@@ -889,18 +799,22 @@ class DisplayWidget():
         self.label_frame = ttk.Frame(self.img_frame)
         self.label_frame.pack(side=tk.TOP, padx=5, pady=5)
         
+        # tag_slots buttons showing the current page of tags, slot_tag_list
+        # holds the tag of each. Commands read order_index when clicked, so
+        # place() only relabels. Right click marks a favorite
         self.labeling_button_list = []
-        for i in range (0,self.outer.tag_cnt):
+        self.slot_tag_list = []
+        for slot in range (0,self.outer.tag_slots):
             button = ttk.Button(
                 self.label_frame, 
-                text=f'[{i+1+self.order_index*self.outer.tag_cnt}] {self.outer.alias_list[i]}', 
-                command=lambda idx=i+1+self.order_index*self.outer.tag_cnt: self.outer.handle_selection(idx)
+                command=lambda slot=slot: self.select_slot(slot)
                 )
+            button.bind('<Button-3>', lambda event, slot=slot: self.outer.toggle_favorite(self.slot_tag_list[slot]))
             self.labeling_button_list.append(button)
-            self.labeling_button_list[i].pack(side=tk.LEFT, padx=5)
-            
-            log_info(f'bind key {str(i+1+self.order_index*self.outer.tag_cnt)}')
-            self.outer.root.bind(str(i+1+self.order_index*self.outer.tag_cnt), self.outer.keyboard_event)
+            self.slot_tag_list.append(None)
+            self.style_list.append(None)
+        # text last set on each slot
+        self.text_list = [None] * self.outer.tag_slots
             
         # false button
         self.false_button = ttk.Button(
@@ -908,7 +822,8 @@ class DisplayWidget():
             text='[F] False', 
             command=lambda idx=group_index: self.outer.handle_selection_false(idx)
             )
-        self.false_button.pack(side=tk.LEFT, padx=5)
+        self.false_button.grid(row=0, column=self.outer.tag_slots, padx=5)
+        self.style_list.append(None)
         
         self.outer.root.bind('F', self.outer.keyboard_event_false)
         self.outer.root.bind('f', self.outer.keyboard_event_false)
@@ -919,18 +834,90 @@ class DisplayWidget():
         self.order_left = ttk.Button(
             self.control_frame, 
             text='<<', 
-            command=lambda idx1=self.order_index, idx2=-1: self.outer.change_widget_order(idx1,idx2)
+            command=lambda: self.outer.change_widget_order(self.order_index,-1)
             )
         self.order_left.pack(side=tk.LEFT, padx=5)
         
         self.order_right = ttk.Button(
             self.control_frame, 
             text='>>', 
-            command=lambda idx1=self.order_index, idx2=1: self.outer.change_widget_order(idx1,idx2)
+            command=lambda: self.outer.change_widget_order(self.order_index,1)
             )
         self.order_right.pack(side=tk.LEFT, padx=5)
+
+        self.apply_clip_button = ttk.Button(
+            self.control_frame,
+            text='Apply to Clip',
+            command=lambda idx=group_index: self.outer.apply_frame_to_clip(idx)
+            )
+        self.apply_clip_button.pack(side=tk.LEFT, padx=5)
         self.init = False
+
+    def place(self, order_index):
+        # move to grid position order_index, relabel and rebind tag keys
+        if order_index == self.order_index:
+            return
+        self.order_index = order_index
+
+        # Calculate grid position for wrapping layout
+        try:
+            window_width = self.outer.scroll_canvas.winfo_width()
+            if window_width <= 1:
+                window_width = 1000
+        except:
+            window_width = 1000
+        
+        # Use current canvas width for layout calculation
+        widgets_per_row = max(1, window_width // (self.canvas_width + 24))  # 24 = padding
+        row = self.order_index // widgets_per_row
+        col = self.order_index % widgets_per_row
+        self.img_frame.grid(row=row, column=col, padx=5, pady=5, sticky="nw")
+        # hotkey numbers depend on the position
+        self.show_tags()
+
+    def hide(self):
+        if self.order_index is None:
+            return
+        self.img_frame.grid_remove()
+        self.order_index = None
+
+    def show_tags(self):
+        # put the current page of tags on the slots, Tk calls only for slots that changed
+        if self.order_index is None:
+            return
+        page_tag_list = self.outer.get_page_tag_list()
+        for slot, button in enumerate(self.labeling_button_list):
+            tag_index = page_tag_list[slot] if slot < len(page_tag_list) else None
+            if tag_index is None:
+                if self.slot_tag_list[slot] is not None:
+                    button.grid_remove()
+                self.slot_tag_list[slot] = None
+                continue
+            text = self.outer.alias_list[tag_index]
+            hotkey = self.outer.get_hotkey(self.order_index, tag_index)
+            if hotkey is not None:
+                text = f'[{hotkey}] {text}'
+            if tag_index in self.outer.favorite_tag_set:
+                text = f'* {text}'
+            if self.text_list[slot] != text:
+                self.text_list[slot] = text
+                button.config(text=text)
+            if self.slot_tag_list[slot] is None:
+                button.grid(row=0, column=slot, padx=5)
+            # the style for the tag now on the slot is set by update_ui
+            self.slot_tag_list[slot] = tag_index
+
+    def select_slot(self, slot):
+        if self.slot_tag_list[slot] is not None:
+            self.outer.select_panel_tag(self.order_index, self.slot_tag_list[slot])
+
+    def set_style(self, button_index, button, style):
+        # Tk calls only for buttons whose style changed
+        if self.style_list[button_index] != style:
+            self.style_list[button_index] = style
+            button.config(style=style)
         
+    @traced('display_img', lambda self: self.outer.tracer)
     def display_img(self):
         if self.is_deleted == True or self.init == True: 
             return
@@ -961,16 +948,24 @@ class DisplayWidget():
         elif self.outer.img_cache[img_index] == None:
             # no error, still waiting
             if self.outer.img_error_msg[img_index] == None:
-                log_info(f"Image {img_index} not found in cache, sending web request")
-                self.outer.request_image(img_index)
-                center_x = self.canvas_width // 2
-                center_y = self.canvas_height // 2
-                self.img_canvas.create_text(
-                center_x, center_y,  # Dynamic center position
-                text=f"Image {img_index+1} requested\nWaiting for server response.",
-                fill="white", font=("Arial", 12),
-                anchor="center", justify="center"
-                )
+                # while scrubbing only the preview, the full image once navigation settles
+                if not self.outer.navigating or self.outer.scrub_preview_width <= 0:
+                    log_info(f"Image {img_index} not found in cache, sending web request")
+                    self.outer.request_image(img_index, droppable=True)
+                preview = self.outer.get_preview(img_index)
+                if preview is not None:
+                    photo = ImageTk.PhotoImage(preview.resize((self.canvas_width, self.canvas_height), Image.Resampling.BILINEAR))
+                    self.img_canvas.image = photo
+                    self.img_canvas.create_image(0, 0, anchor="nw", image=photo)
+                else:
+                    center_x = self.canvas_width // 2
+                    center_y = self.canvas_height // 2
+                    self.img_canvas.create_text(
+                    center_x, center_y,  # Dynamic center position
+                    text=f"Image {img_index+1} requested\nWaiting for server response.",
+                    fill="white", font=("Arial", 12),
+                    anchor="center", justify="center"
+                    )
             # error, print error msg
             else:
                 error_msg = self.outer.img_error_msg[img_index]
@@ -993,13 +988,7 @@ class DisplayWidget():
             self._resize_canvas_for_image(image)
             
             # Apply global scaling to the image
-            if self.outer.global_scale != 1.0:
-                scaled_width = int(image.size[0] * self.outer.global_scale)
-                scaled_height = int(image.size[1] * self.outer.global_scale)
-                scaled_image = image.resize((scaled_width, scaled_height), Image.Resampling.LANCZOS)
-                photo = ImageTk.PhotoImage(scaled_image)
-            else:
-                photo = ImageTk.PhotoImage(image)
+            photo = self.outer.get_rendered_image(img_index, image)
                 
             self.img_canvas.image = photo
             self.img_canvas.delete("all")
@@ -1009,17 +998,16 @@ class DisplayWidget():
         if self.is_deleted == True or self.init == True: return
 
         img_index = self.outer.get_combined_index_list()[self.group_index]
-
-        # buttons
-        for i in range(0,self.outer.tag_cnt):
-            if self.outer.data_list[img_index][i]:
-                self.labeling_button_list[i].config(style='Blue.TButton')
-            else:
-                self.labeling_button_list[i].config(style='White.TButton')
-        if True in self.outer.data_list[img_index]:
-            self.false_button.config(style='White.TButton')
+        row = self.outer.data_list[img_index]
+
+        # only the tags on the slots, set_style skips the unchanged ones
+        for slot, tag_index in enumerate(self.slot_tag_list):
+            if tag_index is not None:
+                self.set_style(slot, self.labeling_button_list[slot], 'Blue.TButton' if row[tag_index] else 'White.TButton')
+        if True in row:
+            self.set_style(self.outer.tag_slots, self.false_button, 'White.TButton')
         else:
-            self.false_button.config(style='Blue.TButton')
+            self.set_style(self.outer.tag_slots, self.false_button, 'Blue.TButton')
 
         log_ok('UI status updated')
     
@@ -1042,36 +1030,6 @@ class DisplayWidget():
             # Update the scroll region since widget size changed
             self.outer.widget_frame.update_idletasks()
             self.outer._on_frame_configure(None)
-        
-    def destroy_all(self):
-        self.is_deleted = True
-
-
-        # 解绑所有键盘事件
-        try:
-            for i in range(0, self.outer.tag_cnt):
-                self.outer.root.unbind(str(i+1+self.group_index*self.outer.tag_cnt))
-            self.outer.root.unbind('F')
-            self.outer.root.unbind('f')
-        except:
-            pass
-
-        self.order_left.destroy()
-        self.order_right.destroy()
-        self.control_frame.destroy()
-
-        for button in self.labeling_button_list:
-            button.destroy()
-        self.false_button.destroy()
-        self.label_frame.destroy()
-        
-        # 销毁画布和框架
-        self.img_canvas.destroy()
-        self.img_frame.destroy()
-        
-        # 清空引用列表
-        self.labeling_button_list = []
-    
 
 if __name__ == "__main__":
       # Main window
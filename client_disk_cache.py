@@ -0,0 +1,136 @@
+"""
+Persistent, size bounded image cache for the client.
+
+Images are stored as files named by the hash of (server id, row path,
+version) in one folder, with index.json mapping keys to file, size and
+last access. The version comes from the server (request 0xFF 0x0B), so a
+replaced image gets a new key and the stale file simply ages out. The
+least recently used files are removed once the folder exceeds its budget.
+"""
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+
+INDEX_NAME = 'index.json'
+
+class DiskCache:
+    def __init__(self, cache_dir, budget_mb=2048, log_warn=print):
+        self.cache_dir = cache_dir
+        self.budget_bytes = int(budget_mb * 1e6)
+        self.log_warn = log_warn
+        self.lock = threading.Lock()
+        # key -> [file name, size, last access time]
+        self.entry_dict = {}
+        self.used_bytes = 0
+        self.dirty = False
+        self.hit_cnt = 0
+        self.miss_cnt = 0
+        self.unsaved_put_cnt = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.load_index()
+        atexit.register(self.save_index)
+
+    @staticmethod
+    def make_key(server_id, path, version):
+        return f'{server_id}\0{path}\0{version}'
+
+    def load_index(self):
+        index_path = os.path.join(self.cache_dir, INDEX_NAME)
+        try:
+            with open(index_path, 'r') as index_file:
+                entry_dict = json.load(index_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.log_warn(f"Disk cache index {index_path} unreadable, starting empty: {e}")
+            return
+        # drop entries whose file went missing
+        for key, entry in entry_dict.items():
+            if os.path.exists(os.path.join(self.cache_dir, entry[0])):
+                self.entry_dict[key] = entry
+                self.used_bytes += entry[1]
+
+    def save_index(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self.entry_dict)
+            self.dirty = False
+        index_path = os.path.join(self.cache_dir, INDEX_NAME)
+        try:
+            with open(index_path + '.tmp', 'w') as index_file:
+                index_file.write(data)
+            os.replace(index_path + '.tmp', index_path)
+        except OSError as e:
+            self.log_warn(f"Disk cache index {index_path} not saved: {e}")
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entry_dict.get(key)
+            if entry is None:
+                self.miss_cnt += 1
+                return None
+            entry[2] = time.time()
+            self.dirty = True
+        try:
+            with open(os.path.join(self.cache_dir, entry[0]), 'rb') as blob_file:
+                data = blob_file.read()
+        except OSError:
+            self.remove(key)
+            self.miss_cnt += 1
+            return None
+        self.hit_cnt += 1
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.budget_bytes:
+            return
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.img'
+        try:
+            with open(os.path.join(self.cache_dir, name + '.tmp'), 'wb') as blob_file:
+                blob_file.write(data)
+            os.replace(os.path.join(self.cache_dir, name + '.tmp'), os.path.join(self.cache_dir, name))
+        except OSError as e:
+            self.log_warn(f"Disk cache write failed: {e}")
+            return
+        with self.lock:
+            old = self.entry_dict.pop(key, None)
+            if old is not None:
+                self.used_bytes -= old[1]
+            self.entry_dict[key] = [name, len(data), time.time()]
+            self.used_bytes += len(data)
+            self.dirty = True
+            evict_list = []
+            if self.used_bytes > self.budget_bytes:
+                # evict down to 90% so the sort does not run on every put
+                for old_key, entry in sorted(self.entry_dict.items(), key=lambda item: item[1][2]):
+                    if self.used_bytes <= self.budget_bytes * 0.9:
+                        break
+                    evict_list.append(entry[0])
+                    self.used_bytes -= entry[1]
+                    del self.entry_dict[old_key]
+        for evict_name in evict_list:
+            try:
+                os.remove(os.path.join(self.cache_dir, evict_name))
+            except OSError:
+                pass
+        # keep a crash from losing more than a few hundred entries
+        self.unsaved_put_cnt += 1
+        if self.unsaved_put_cnt >= 200:
+            self.unsaved_put_cnt = 0
+            self.save_index()
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entry_dict.pop(key, None)
+            if entry is None:
+                return
+            self.used_bytes -= entry[1]
+            self.dirty = True
+        try:
+            os.remove(os.path.join(self.cache_dir, entry[0]))
+        except OSError:
+            pass
@@ -0,0 +1,53 @@
+"""
+Frame index of the clip data, for HeadlessClient.
+
+A frame shows the rows of one instant of a clip, one per camera, so frame
+f of a clip is rows begin + f*cam to begin + f*cam + cam - 1. FrameIndex
+keeps only the first row, camera count and first frame of every clip and
+finds the clip of a frame or row by binary search, so memory and startup
+grow with the number of clips, not rows.
+"""
+import bisect
+
+class FrameIndex:
+    def __init__(self, clip_list):
+        # clip_list: [{'begin', 'end', 'cam'}] as the server sends it
+        self.clip_begin_list = [clip['begin'] for clip in clip_list]
+        self.clip_cam_list = [clip['cam'] for clip in clip_list]
+        # first frame of every clip, then the frame count
+        self.clip_frame_begin_list = [0]
+        for clip in clip_list:
+            self.clip_frame_begin_list.append(
+                self.clip_frame_begin_list[-1] + len(range(clip['begin'], clip['end'], clip['cam']))
+            )
+        self.frame_cnt = self.clip_frame_begin_list[-1]
+
+    def __len__(self):
+        return self.frame_cnt
+
+    def get_clip(self, frame):
+        # clips without frames share their first frame with the next clip, the last one wins
+        if frame < 0 or frame >= self.frame_cnt:
+            raise IndexError(f"frame {frame} out of {self.frame_cnt}")
+        return bisect.bisect_right(self.clip_frame_begin_list, frame) - 1
+
+    def get_rows(self, frame):
+        # row of every camera of this frame
+        clip_index = self.get_clip(frame)
+        cam = self.clip_cam_list[clip_index]
+        row = self.clip_begin_list[clip_index] + (frame - self.clip_frame_begin_list[clip_index]) * cam
+        return list(range(row, row + cam))
+
+    def get_clip_range(self, frame):
+        # (first frame, last frame + 1) of the clip holding this frame
+        clip_index = self.get_clip(frame)
+        return self.clip_frame_begin_list[clip_index], self.clip_frame_begin_list[clip_index+1]
+
+    def get_clip_of_row(self, row):
+        return max(bisect.bisect_right(self.clip_begin_list, row) - 1, 0)
+
+    def get_frame(self, row):
+        # the frame showing this row, rows past the last frame of their clip map to it
+        clip_index = self.get_clip_of_row(row)
+        frame_begin, frame_end = self.clip_frame_begin_list[clip_index], self.clip_frame_begin_list[clip_index+1]
+        return min(frame_begin + (row - self.clip_begin_list[clip_index]) // self.clip_cam_list[clip_index], frame_end - 1)
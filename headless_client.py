@@ -0,0 +1,1630 @@
+"""
+Headless client for the Fast Image Tagging Tool server.
+
+HeadlessClient holds the socket protocol and dataset state that client.py
+uses, without any Tk code, so the server can be driven from scripts, batch
+jobs and load tests. client.py builds its UI on top of this class.
+AsyncHeadlessClient exposes the same operations to asyncio code.
+
+Example:
+    client = HeadlessClient('127.0.0.1', 52973)
+    client.connect_to_server()
+    client.load_dataset()
+    image = client.fetch_image(0)
+    client.set_tags(0, 99, [True, False, False])
+    client.save()
+    client.close()
+"""
+import asyncio
+import io
+import json
+import math
+import socket
+import struct
+import sys
+import threading
+from collections import OrderedDict
+from io import StringIO
+
+import pandas as pd
+from PIL import Image
+
+from client_disk_cache import DiskCache
+from frame_index import FrameIndex
+from tracing import Tracer
+
+default_setting = {
+        "host": "127.0.0.1", # socket bind ip address
+        "port": 52973, # socket bind port
+        "dataset": "", # dataset to open on a server with dataset_dir, empty for the server's default
+        "multiple_selection": False,
+        "stats_interval": 2, # seconds between server stats requests for the status bar, 0 to disable
+        "disk_cache_dir": "image_cache", # keep received images on disk across sessions, empty to disable
+        "disk_cache_mb": 2048, # disk budget of disk_cache_dir
+        "render_cache_mb": 256, # memory for rendered (scaled) images in the Tk client
+        "render_settle_ms": 150, # frames changing faster than this are drawn with a fast filter first
+        "image_request_window": 16, # images requested at once, per interactive and background class, 0 for no limit
+        "scrub_preview_width": 320, # size of the low resolution preview shown while dragging the slider, 0 to disable
+        "tagged_requests": True, # wrap requests in 0xFF 0x0A so the server may answer images out of order
+        "trace_path": "", # write a Chrome trace of responses and drawing to this file on exit, empty to disable
+        "profile_opcode": -1, # run cProfile around every response with this opcode, -1 to disable
+        "profile_path": "", # cProfile output, default profile_<opcode>.prof
+    }
+
+# request classes of the priority envelope (0xFF 0x0F), see server_scheduler.py
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = ['interactive', 'prefetch', 'bulk']
+
+RESPONSE_NAMES = {
+    0x01: 'image',
+    0x02: 'csv_tag',
+    0x03: 'csv_change',
+    0x04: 'save',
+    0x05: 'clip',
+    0x06: 'csv',
+    0x07: 'csv_bulk_change',
+    0x08: 'stats',
+    0x09: 'scaled_image',
+    0x0A: 'tagged',
+    0x0B: 'row_version',
+    0x0C: 'conditional_image',
+    0x0D: 'validators',
+    0x0E: 'cancel',
+    0x10: 'datasets',
+    0x11: 'select_dataset',
+    0x12: 'query',
+    0x13: 'progress',
+}
+
+class bcolors:
+    HEADER = '\033[95m'
+    OKBLUE = '\033[94m'
+    OKCYAN = '\033[96m'
+    OKGREEN = '\033[92m'
+    WARNING = '\033[93m'
+    FAIL = '\033[91m'
+    ENDC = '\033[0m'
+    BOLD = '\033[1m'
+    UNDERLINE = '\033[4m'
+
+def log_network(str):
+    print(f'[{bcolors.OKCYAN}SOCK{bcolors.ENDC}] {str}')
+
+def log_ok(str):
+    print(f'[{bcolors.OKGREEN} OK {bcolors.ENDC}] {str}')
+
+def log_error(str):
+    print(f'[{bcolors.FAIL}FAIL{bcolors.ENDC}] {str}')
+
+def log_info(str):
+    print(f'[{bcolors.OKBLUE}INFO{bcolors.ENDC}] {str}')
+
+def log_warn(str):
+    print(f'[{bcolors.WARNING}WARN{bcolors.ENDC}] {str}')
+
+# request encoding, see README "Socket Protocol"
+def pack_image_request(index):
+    return b'\xff\x01' + struct.pack('>I', index)
+
+def pack_scaled_image_request(index, max_width, max_height, image_format='JPEG', quality=85):
+    format_index = ['JPEG', 'PNG', 'WEBP'].index(image_format)
+    return b'\xff\x09' + struct.pack('>IHHBB', index, max_width, max_height, format_index, quality)
+
+def pack_row_version_request(index1, index2):
+    return b'\xff\x0b' + struct.pack('>II', index1, index2)
+
+def pack_conditional_image_request(index, etag):
+    return b'\xff\x0c' + struct.pack('>IQ', index, etag)
+
+def pack_validator_request(index1=0, index2=0, clip_index=None):
+    # rows index1..index2 inclusive, or every row of clip clip_index
+    if clip_index is not None:
+        return b'\xff\x0d' + struct.pack('>BII', 1, clip_index, 0)
+    return b'\xff\x0d' + struct.pack('>BII', 0, index1, index2)
+
+def decode_image(img_data, scale=1.0):
+    # below scale 1, JPEG is decoded by libjpeg at the smallest 1/2, 1/4 or
+    # 1/8 reduction still at least as large as the target, other formats in full
+    image = Image.open(io.BytesIO(img_data))
+    if scale < 1.0 and image.format == 'JPEG':
+        target = (max(1, math.ceil(image.size[0] * scale)), max(1, math.ceil(image.size[1] * scale)))
+        image.draft(image.mode, target)
+    image.load()
+    return image
+
+def pack_cancel_request(req_id_list=None, index1=0, index2=0):
+    # tagged requests by id, or every tagged image request of rows index1..index2
+    if req_id_list is not None:
+        return b'\xff\x0e' + struct.pack(f'>BI{len(req_id_list)}I', 0, len(req_id_list), *req_id_list)
+    return b'\xff\x0e' + struct.pack('>BII', 1, index1, index2)
+
+# tag query modes and program ops, see server_index.py
+QUERY_NEXT = 0
+QUERY_PREV = 1
+QUERY_LIST = 2
+
+def compile_query(expr, alias_list=()):
+    # postfix program of a nested expression: a tag index or alias, 'unlabeled',
+    # ('not', e), ('and', e1, e2, ...) or ('or', e1, e2, ...)
+    if isinstance(expr, tuple):
+        op, operand_list = expr[0].lower(), expr[1:]
+        if op == 'not' and len(operand_list) == 1:
+            return compile_query(operand_list[0], alias_list) + b'\x02'
+        if op in ('and', 'or') and operand_list:
+            program = compile_query(operand_list[0], alias_list)
+            for operand in operand_list[1:]:
+                program += compile_query(operand, alias_list) + (b'\x03' if op == 'and' else b'\x04')
+            return program
+        raise ValueError(f"Bad query expression {expr}")
+    if expr == 'unlabeled':
+        return b'\x01'
+    if isinstance(expr, str):
+        if expr not in alias_list:
+            raise ValueError(f"No tag with alias {expr}")
+        expr = list(alias_list).index(expr)
+    return b'\x00' + struct.pack('>H', expr)
+
+def pack_query_request(mode, index1, index2, start, program):
+    return b'\xff\x12' + struct.pack('>BIIIH', mode, index1, index2, start, len(program)) + program
+
+def pack_progress_request(clip1, clip2):
+    return b'\xff\x13' + struct.pack('>II', clip1, clip2)
+
+def pack_select_dataset_request(name):
+    name_bytes = name.encode('utf-8')
+    return b'\xff\x11' + struct.pack('>H', len(name_bytes)) + name_bytes
+
+def pack_csv_change_request(index1, index2, write_list):
+    return b'\xff\x03' + struct.pack('>III', index1, index2, len(write_list)) + bytes(
+        1 if tag else 0 for tag in write_list
+    )
+
+def pack_csv_bulk_change_request(segment_list, tag_cnt):
+    # segment: (index1, index2, stride, write_list), rows index1..index2 inclusive
+    data = b'\xff\x07' + struct.pack('>II', len(segment_list), tag_cnt)
+    for index1, index2, stride, write_list in segment_list:
+        data += struct.pack('>III', index1, index2, stride) + bytes(
+            1 if tag else 0 for tag in write_list[0:tag_cnt]
+        )
+    return data
+
+class HeadlessClient:
+    def __init__(self, host='127.0.0.1', port=52973, multiple_selection=False, cache_images=True,
+                 dataset=''):
+        self.host = host
+        self.port = port
+        # selected by load_dataset, empty for the server's default
+        self.dataset_name = dataset
+        # what the server has selected for this connection
+        self.selected_dataset = None
+        self.multiple_selection = multiple_selection
+        # keep received images in img_cache, turn off for load tests
+        self.cache_images = cache_images
+
+        # define socket
+        self.sock = None
+        self.connected = False
+        self.send_lock = threading.Lock()
+
+        # define vars
+        self.data_list = []
+        self.data_column_list = []
+
+        self.data_cnt = None
+        self.tag_cnt = None
+        self.alias_list = []
+        self.img_cache = []
+        self.img_error_msg = []
+
+        self.clip_cnt = None
+        self.clip_list = []
+        # frames of the clips, see frame_index.py
+        self.frame_index = FrameIndex([])
+        self.combined_entry_list_cnt = None
+
+        # last reply of the stats request, see server_metrics.py
+        self.server_stats = None
+        self.stats_interval = 2
+
+        # disabled until configure_setting enables it
+        self.tracer = Tracer()
+        self.disk_cache = None
+
+        # per row path and content version from the server, keys of disk_cache
+        self.server_id = None
+        self.row_path_list = []
+        self.row_version_list = []
+        # clips whose versions arrived, and the image requests waiting for them
+        self.version_lock = threading.Lock()
+        self.version_clip_set = set()
+        self.version_wait_dict = {}
+
+        # callbacks waiting for a response, key -> list of callbacks
+        # keys: ('image', index), 'csv_tag', 'csv_change', 'csv_bulk_change', 'save', 'clip', 'csv', 'stats',
+        # 'datasets', 'select_dataset', 'query', 'progress'
+        self.waiter_lock = threading.Lock()
+        self.waiter_dict = {}
+
+        # tagged requests, req_id -> (key, callback) of the request that sent it
+        self.tagged_requests = True
+        self.next_req_id = 0
+        self.req_waiter_dict = {}
+        # req_id of the tagged response being dispatched, receiving thread only
+        self.response_req_id = None
+
+        # request_image / request_scaled_image wait here per priority class,
+        # key -> (data, droppable). Up to image_request_window interactive
+        # and as many prefetch and bulk requests are in flight, so bulk never
+        # holds back the frame on screen. Droppable requests are for it,
+        # drop_stale_requests removes them once the user moved on, queued
+        # ones before sending, sent ones with a cancel request
+        self.image_request_window = 16
+        self.request_queue_lock = threading.Lock()
+        # key -> [req_id, droppable, priority], req_id None until sent or when untagged
+        self.inflight_request_dict = {}
+        self.queued_request_list = [OrderedDict() for _ in PRIORITY_NAMES]
+        self.dropped_request_cnt = 0
+        self.cancelled_request_cnt = 0
+
+    def load_setting_file(self,setting_path):
+        try:
+            with open(setting_path, 'r') as setting_file:
+                setting_data = json.load(setting_file)
+                self.configure_setting(setting_data)
+                return
+         # Error handing
+        except FileNotFoundError:
+            log_error(f"'{setting_path}' not found.")
+            log_info(f"Writing default setting to '{setting_path}'.")
+            try:
+                with open(setting_path, 'w') as setting_file: # 'w' for write mode (overwrites existing file)
+                    json.dump(default_setting, setting_file, indent=4)
+                log_ok(f"Default setting written to {setting_path} successfully.")
+            except IOError as error:
+                log_error(f"An error occurred while writing to {setting_path}: {error}")
+        except json.JSONDecodeError:
+            log_error(f"Error: Invalid JSON format in '{setting_path}'.")
+
+        log_error(f"Client stopped due to problem with settings.")
+        sys.exit(1)
+        return
+
+    def configure_setting(self,setting_data):
+        try:
+            self.host = setting_data["host"]
+        except KeyError:
+            log_warn("Missing host in setting, using 127.0.0.1 as default")
+            self.host = "127.0.0.1"
+        try:
+            self.port = setting_data["port"]
+        except KeyError:
+            log_warn("Missing port in setting, using 52973 as default")
+            self.port = 52973
+        try:
+            self.dataset_name = setting_data["dataset"]
+        except KeyError:
+            self.dataset_name = ""
+        try:
+            self.multiple_selection = setting_data["multiple_selection"]
+        except KeyError:
+            log_warn("Missing multiple_selection in setting, using false as default")
+            self.multiple_selection = False
+        # the server saves on its own now, see autosave_rows in server_setting.json
+        if "autosave" in setting_data:
+            log_warn("autosave is a server setting now (autosave_rows, autosave_age_s, autosave_idle_s), ignoring it")
+        try:
+            self.stats_interval = setting_data["stats_interval"]
+        except KeyError:
+            self.stats_interval = 2
+        try:
+            self.image_request_window = int(setting_data["image_request_window"])
+        except KeyError:
+            self.image_request_window = 16
+        try:
+            self.tagged_requests = bool(setting_data["tagged_requests"])
+        except KeyError:
+            self.tagged_requests = True
+        # persistent image cache
+        try:
+            disk_cache_dir = setting_data["disk_cache_dir"]
+        except KeyError:
+            disk_cache_dir = "image_cache"
+        try:
+            disk_cache_mb = float(setting_data["disk_cache_mb"])
+        except KeyError:
+            disk_cache_mb = 2048
+        if disk_cache_dir:
+            try:
+                self.disk_cache = DiskCache(disk_cache_dir, disk_cache_mb, log_warn)
+                log_info(f"Disk cache in {disk_cache_dir} holds {len(self.disk_cache.entry_dict)} images")
+            except OSError as e:
+                log_warn(f"Disk cache in {disk_cache_dir} disabled: {e}")
+        # tracing and profiling
+        try:
+            trace_path = setting_data["trace_path"]
+        except KeyError:
+            trace_path = ""
+        try:
+            profile_opcode = int(setting_data["profile_opcode"])
+        except KeyError:
+            profile_opcode = -1
+        try:
+            profile_path = setting_data["profile_path"]
+        except KeyError:
+            profile_path = ""
+        if trace_path or profile_opcode >= 0:
+            self.tracer = Tracer(trace_path, profile_opcode, profile_path, 'client')
+            log_info(f"Tracing enabled, trace: '{trace_path}', profiled opcode: {profile_opcode}")
+
+    # hooks, overridden by the Tk frontend
+
+    def report_error(self, title, message):
+        log_warn(f"{title}: {message}")
+
+    def on_image(self, index):
+        # called from the receiving thread once image index is cached or failed
+        pass
+
+    def on_stats(self, stats):
+        # called from the receiving thread with every stats reply
+        pass
+
+    def on_scaled_image(self, index, image):
+        # called from the receiving thread with every scaled image
+        pass
+
+    def on_validators(self, changed_list):
+        # called from the receiving thread with the rows whose image changed
+        pass
+
+    # connection
+
+    def connect_to_server(self,host=None,port=None):
+        host = self.host if host is None else host
+        port = self.port if port is None else port
+        log_network(f'Connecting of {host}:{port}')
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.settimeout(3.0)
+            self.sock.connect((host, port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connected = True
+            self.selected_dataset = None
+            threading.Thread(target=self.receive_data, daemon=True).start()
+            return True
+
+        except (ConnectionRefusedError,socket.timeout) as e:
+            log_error(f"Connection failed: {str(e)}")
+            self.report_error("Connection Error",
+                              f"Failed to connect to server at {host}:{port}\n{str(e)}")
+            return False
+
+        except Exception as e:
+            self.connected = False
+            log_error(f"Unexpected connection error: {str(e)}")
+            self.report_error("Connection Error",
+                              f"Unexpected error: {str(e)}")
+            return False
+
+    def is_connected(self):
+        if self.sock is None: self.connected = False
+        return self.connected and self.sock is not None
+
+    def safe_sendall(self,data):
+        if not self.is_connected():
+            log_error("Cannot send data: not connected to server")
+            raise RuntimeError("Cannot send data: not connected to server")
+        try:
+            self.sock.sendall(data)
+        except (socket.error, OSError) as e:
+            log_error(f"Error sending data: {str(e)}")
+            self.connected = False
+            self.close_sock()
+            raise RuntimeError(f"Error sending data: {str(e)}")
+        except Exception as e:
+            log_error(f"Unexpected error sending data: {str(e)}")
+            self.connected = False
+            self.close_sock()
+            raise RuntimeError(f"Unexpected error sending data: {str(e)}")
+
+    def close_sock(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except:
+                pass
+            self.sock = None
+
+    def close(self):
+        self.connected = False
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.close_sock()
+
+    def reconnect(self):
+        if self.is_connected():
+            log_info("Already connected, no need to reconnect")
+            return
+        self.close_sock()
+        self.connect_to_server(self.host, self.port)
+        if self.is_connected():
+            log_ok("Reconnection successful")
+
+    # response waiters
+
+    def send_with_waiter(self, key, data, callback=None, priority=PRIORITY_INTERACTIVE):
+        # register before sending so a fast response cannot be missed.
+        # acks without an index (csv_change, save) and scaled images of one
+        # index are matched in send order, so every such request gets a
+        # waiter, even a no-op one
+        if callback is None and (key in ('csv_change', 'csv_bulk_change', 'save') or key[0] == 'scaled_image'):
+            callback = lambda result: None
+        with self.send_lock:
+            req_id = None
+            if self.tagged_requests:
+                req_id = self.next_req_id
+                self.next_req_id = (req_id + 1) & 0xFFFFFFFF
+                if priority == PRIORITY_INTERACTIVE:
+                    data = b'\xff\x0a' + struct.pack('>I', req_id) + data
+                else:
+                    data = b'\xff\x0f' + struct.pack('>BI', priority, req_id) + data
+            if callback is not None:
+                self.add_waiter(key, callback)
+                if req_id is not None:
+                    with self.waiter_lock:
+                        self.req_waiter_dict[req_id] = (key, callback)
+            try:
+                self.safe_sendall(data)
+            except RuntimeError:
+                if callback is not None:
+                    self.remove_waiter(key, callback)
+                    with self.waiter_lock:
+                        self.req_waiter_dict.pop(req_id, None)
+                raise
+        return req_id
+
+    def add_waiter(self, key, callback):
+        with self.waiter_lock:
+            self.waiter_dict.setdefault(key, []).append(callback)
+
+    def remove_waiter(self, key, callback):
+        with self.waiter_lock:
+            callback_list = self.waiter_dict.get(key)
+            if callback_list and callback in callback_list:
+                callback_list.remove(callback)
+                if not callback_list:
+                    del self.waiter_dict[key]
+
+    def resolve_waiter(self, key, result, first_only=False):
+        self.finish_request(key)
+        with self.waiter_lock:
+            callback_list = self.waiter_dict.get(key)
+            # a tagged response belongs to exactly one request
+            req_entry = None
+            if self.response_req_id is not None:
+                req_entry = self.req_waiter_dict.pop(self.response_req_id, None)
+            if req_entry is not None and req_entry[0] == key:
+                if not callback_list or req_entry[1] not in callback_list:
+                    # that request already timed out
+                    return
+                callbacks = [req_entry[1]]
+                callback_list.remove(req_entry[1])
+                if not callback_list:
+                    del self.waiter_dict[key]
+            elif not callback_list:
+                return
+            elif first_only:
+                callbacks = [callback_list.pop(0)]
+                if not callback_list:
+                    del self.waiter_dict[key]
+            else:
+                callbacks = self.waiter_dict.pop(key)
+        for callback in callbacks:
+            callback(result)
+
+    def fail_all_waiters(self, error):
+        with self.waiter_lock:
+            waiter_dict = self.waiter_dict
+            self.waiter_dict = {}
+            self.req_waiter_dict = {}
+        with self.request_queue_lock:
+            self.inflight_request_dict.clear()
+            for queue in self.queued_request_list:
+                queue.clear()
+        for callback_list in waiter_dict.values():
+            for callback in callback_list:
+                callback(error)
+
+    def wait_for(self, key, data, timeout):
+        done = threading.Event()
+        result_list = []
+        def callback(result):
+            result_list.append(result)
+            done.set()
+        self.send_with_waiter(key, data, callback)
+        if not done.wait(timeout):
+            self.remove_waiter(key, callback)
+            raise TimeoutError(f"No response for {key} within {timeout}s")
+        if isinstance(result_list[0], Exception):
+            raise result_list[0]
+        return result_list[0]
+
+    # synchronous API, raises RuntimeError / TimeoutError / ConnectionError
+
+    def load_dataset(self, timeout=10.0, retry=3):
+        # tag names, partial csv and clip data, everything needed before tagging
+        if self.dataset_name and self.dataset_name != self.selected_dataset:
+            self.select_dataset(self.dataset_name, timeout)
+        for attempt in range(0, retry):
+            try:
+                self.wait_for('csv_tag', b'\xff\x02', timeout)
+                self.wait_for('csv', b'\xff\x06', timeout)
+                self.wait_for('clip', b'\xff\x05', timeout)
+                log_ok(f'successfully loaded self.tag_cnt={self.tag_cnt} and self.data_cnt={self.data_cnt}')
+                return
+            except TimeoutError:
+                log_warn(f'Resend request for dataset to be loaded ({attempt+1}/{retry}).')
+        raise TimeoutError('Dataset could not be loaded from server')
+
+    def fetch_row_versions(self, index, timeout=10.0):
+        # paths and versions of the clip holding row index, the disk cache keys.
+        # Asked for once per clip
+        if self.disk_cache is None or not self.data_cnt:
+            return
+        clip_index, index1, index2 = self.get_version_range(index)
+        with self.version_lock:
+            if clip_index in self.version_clip_set:
+                return
+        self.wait_for('row_version', pack_row_version_request(index1, index2), timeout)
+        with self.version_lock:
+            self.version_clip_set.add(clip_index)
+
+    def query_rows(self, expr, index1=0, index2=None, timeout=10.0):
+        # [(first, last)] runs of the rows index1..index2 matching expr, see compile_query
+        if index2 is None:
+            index2 = self.data_cnt - 1
+        program = compile_query(expr, self.alias_list)
+        return self.wait_for('query', pack_query_request(QUERY_LIST, index1, index2, index1, program), timeout)
+
+    def find_row(self, expr, start, index1=0, index2=None, backward=False, timeout=10.0):
+        # the first row from start on (the last up to start if backward) in index1..index2
+        # matching expr, None if there is none
+        if index2 is None:
+            index2 = self.data_cnt - 1
+        program = compile_query(expr, self.alias_list)
+        run_list = self.wait_for('query', pack_query_request(
+            QUERY_PREV if backward else QUERY_NEXT, index1, index2, start, program
+        ), timeout)
+        return run_list[0][0] if run_list else None
+
+    def fetch_progress(self, clip1=0, clip2=None, timeout=10.0):
+        # [(frames, labeled frames, rows, labeled rows)] of clips clip1..clip2 inclusive,
+        # totals of the dataset are in fetch_stats()['progress']
+        if clip2 is None:
+            clip2 = self.clip_cnt - 1
+        return self.wait_for('progress', pack_progress_request(clip1, clip2), timeout)
+
+    def list_datasets(self, timeout=10.0):
+        # [{'name', 'loaded', 'rows', 'clients', 'default'}] of every dataset the server offers
+        return self.wait_for('datasets', b'\xff\x10', timeout)
+
+    def select_dataset(self, name, timeout=60.0):
+        # the server may parse the dataset first, hence the longer timeout.
+        # Requests still in flight belong to the previous dataset
+        if self.data_cnt:
+            self.cancel_range(0, self.data_cnt - 1)
+        try:
+            self.wait_for('select_dataset', pack_select_dataset_request(name), timeout)
+        except RuntimeError:
+            log_info(f"Datasets on the server: {[entry['name'] for entry in self.list_datasets()]}")
+            raise
+        self.dataset_name = self.selected_dataset = name
+        log_ok(f'Selected dataset {name}')
+
+    def fetch_image(self, index, timeout=30.0, revalidate=False):
+        # revalidate asks the server whether a local copy is still current
+        # instead of trusting it, the image is only sent again if it changed
+        self.fetch_row_versions(index, timeout)
+        if revalidate and self.has_local_image(index):
+            return self.wait_for(
+                ('image', index), pack_conditional_image_request(index, self.row_version_list[index]), timeout
+            )
+        if self.cache_images and self.img_cache[index] is not None:
+            return self.img_cache[index]
+        image = self.load_from_disk_cache(index)
+        if image is not None:
+            return image
+        return self.wait_for(('image', index), pack_image_request(index), timeout)
+
+    def fetch_scaled_image(self, index, max_width, max_height, image_format='JPEG', quality=85, timeout=30.0):
+        # image resized on the server to fit max_width x max_height, never cached
+        return self.wait_for(
+            ('scaled_image', index), pack_scaled_image_request(index, max_width, max_height, image_format, quality), timeout
+        )
+
+    def revalidate_rows(self, index1, index2, timeout=30.0):
+        # rows index1..index2 inclusive, returns the rows whose image changed
+        return self.wait_for('validators', pack_validator_request(index1, index2), timeout)
+
+    def revalidate_clip(self, clip_index, timeout=30.0):
+        return self.wait_for('validators', pack_validator_request(clip_index=clip_index), timeout)
+
+    def fetch_images(self, index_list, window=8, timeout=30.0, priority=PRIORITY_INTERACTIVE):
+        # pipelined fetch with up to window requests in flight.
+        # returns {index: image}, failed images map to their RuntimeError
+        result_dict = {}
+        slot = threading.Semaphore(window)
+        all_done = threading.Event()
+        index_list = list(index_list)
+        remaining = [len(index_list)]
+        result_lock = threading.Lock()
+        if not index_list:
+            return result_dict
+
+        def store(index, result):
+            with result_lock:
+                result_dict[index] = result
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    all_done.set()
+
+        def make_callback(index):
+            def callback(result):
+                store(index, result)
+                slot.release()
+            return callback
+
+        for index in index_list:
+            if self.cache_images and self.img_cache[index] is not None:
+                store(index, self.img_cache[index])
+                continue
+            self.fetch_row_versions(index, timeout)
+            image = self.load_from_disk_cache(index)
+            if image is not None:
+                store(index, image)
+                continue
+            if not slot.acquire(timeout=timeout):
+                raise TimeoutError(f"No image response within {timeout}s")
+            self.send_with_waiter(('image', index), pack_image_request(index), make_callback(index), priority)
+        if not all_done.wait(timeout):
+            raise TimeoutError(f"No image response within {timeout}s")
+        return result_dict
+
+    def set_tags(self, index1, index2, tag_list, timeout=30.0):
+        # set rows index1..index2 (inclusive) to tag_list and wait for the server
+        for index in range(index1, index2 + 1):
+            self.data_list[index] = list(tag_list)
+        return self.wait_for('csv_change', pack_csv_change_request(index1, index2, tag_list), timeout)
+
+    def set_tags_bulk(self, tag_dict, timeout=30.0):
+        # {row index: tag_list}, all requests are pipelined then acked together
+        done = threading.Event()
+        error_list = []
+        remaining = [len(tag_dict)]
+        count_lock = threading.Lock()
+        if not tag_dict:
+            return
+        def callback(result):
+            with count_lock:
+                if isinstance(result, Exception):
+                    error_list.append(result)
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    done.set()
+        for index, tag_list in tag_dict.items():
+            self.data_list[index] = list(tag_list)
+            self.send_with_waiter('csv_change', pack_csv_change_request(index, index, tag_list), callback)
+        if not done.wait(timeout):
+            raise TimeoutError(f"Bulk tag change not acknowledged within {timeout}s")
+        if error_list:
+            raise error_list[0]
+
+    def set_tags_segments(self, segment_list, timeout=60.0):
+        # one bulk change on the server, saved by its autosave policy. Returns the number of rows written
+        self.apply_segments_locally(segment_list)
+        return self.wait_for('csv_bulk_change', pack_csv_bulk_change_request(segment_list, self.tag_cnt), timeout)
+
+    def save(self, timeout=60.0):
+        return self.wait_for('save', b'\xff\x04', timeout)
+
+    def fetch_stats(self, timeout=10.0):
+        return self.wait_for('stats', b'\xff\x08', timeout)
+
+    # mass labeling
+
+    def get_clip_frame_range(self, combined_index):
+        # (first frame, last frame + 1) of the clip holding this frame
+        return self.frame_index.get_clip_range(combined_index)
+
+    def build_frame_segments(self, combined_index, frame_begin, frame_end, cam_offset=None):
+        # copy the tags of every camera in frame combined_index to the same camera
+        # in frames frame_begin..frame_end-1, or only camera cam_offset if given.
+        # one strided segment per camera per clip covered
+        source_list = self.get_frame_index_list(combined_index)
+        if cam_offset is None:
+            offset_list = range(0, len(source_list))
+        else:
+            offset_list = [cam_offset]
+
+        segment_list = []
+        frame = frame_begin
+        while frame < frame_end:
+            clip_frame_end = min(self.get_clip_frame_range(frame)[1], frame_end)
+            first_list = self.get_frame_index_list(frame)
+            last_list = self.get_frame_index_list(clip_frame_end - 1)
+            for offset in offset_list:
+                # clips with fewer cameras do not have this camera
+                if offset >= len(first_list) or offset >= len(last_list):
+                    continue
+                write_list = self.data_list[source_list[offset]][0:self.tag_cnt]
+                segment_list.append((first_list[offset], last_list[offset], len(first_list), write_list))
+            frame = clip_frame_end
+        return segment_list
+
+    def apply_segments_locally(self, segment_list):
+        for index1, index2, stride, write_list in segment_list:
+            for index in range(index1, index2 + 1, stride):
+                self.data_list[index][0:self.tag_cnt] = write_list
+
+    def apply_to_clip(self, combined_index, cam_offset=None):
+        clip_begin, clip_end = self.get_clip_frame_range(combined_index)
+        return self.apply_to_range(combined_index, clip_begin, clip_end - 1, cam_offset)
+
+    def apply_to_range(self, combined_index, frame1, frame2, cam_offset=None):
+        # frame1..frame2 inclusive, in either order
+        frame_begin, frame_end = min(frame1, frame2), max(frame1, frame2) + 1
+        segment_list = self.build_frame_segments(combined_index, frame_begin, frame_end, cam_offset)
+        self.request_csv_bulk_change(segment_list)
+        return segment_list
+
+    # state changes used by the frontend
+
+    def select_tag(self, img_index, tag_index):
+        # single selection
+        if self.multiple_selection==False:
+            self.data_list[img_index][tag_index] = True
+            for i in range(0,self.tag_cnt):
+                if i!=tag_index:
+                    self.data_list[img_index][i] = False
+        # multiple selection
+        else:
+            self.data_list[img_index][tag_index] = not self.data_list[img_index][tag_index]
+        self.request_csv_change(img_index,img_index,self.data_list[img_index])
+
+    def clear_tags(self, img_index):
+        for i in range(0,self.tag_cnt):
+            self.data_list[img_index][i] = False
+        self.request_csv_change(img_index,img_index,self.data_list[img_index])
+
+    def get_frame_index_list(self, combined_index):
+        return self.frame_index.get_rows(combined_index)
+
+    def get_clip_of_frame(self, combined_index):
+        return self.frame_index.get_clip(combined_index)
+
+    def get_frame_of_row(self, row):
+        # the frame showing this row, rows past the last frame map to it
+        return self.frame_index.get_frame(row)
+
+    # fire and forget requests, errors go to report_error
+
+    def try_send(self, key, data):
+        try:
+            self.send_with_waiter(key, data)
+            return True
+        except RuntimeError as e:
+            self.report_error("Connection error", f"{e}")
+            return False
+
+    def queue_request(self, key, data, droppable, priority):
+        with self.request_queue_lock:
+            if key in self.inflight_request_dict:
+                return
+            for queued_priority, queue in enumerate(self.queued_request_list):
+                entry = queue.get(key)
+                if entry is not None:
+                    if queued_priority <= priority and (entry[1] or not droppable):
+                        return
+                    # asked for again with a higher class, or now needed beyond the screen
+                    del queue[key]
+                    priority = min(priority, queued_priority)
+                    droppable = droppable and entry[1]
+                    break
+            queue = self.queued_request_list[priority]
+            queue[key] = (data, droppable)
+            if priority == PRIORITY_INTERACTIVE:
+                # the frame shown last goes first
+                queue.move_to_end(key, last=False)
+        self.pump_requests()
+
+    def pump_requests(self):
+        while True:
+            with self.request_queue_lock:
+                interactive_cnt = sum(1 for inflight in self.inflight_request_dict.values()
+                                      if inflight[2] == PRIORITY_INTERACTIVE)
+                # interactive requests have their own window, bulk never holds them back
+                cnt_list = [interactive_cnt, len(self.inflight_request_dict) - interactive_cnt]
+                priority = None
+                for i, queue in enumerate(self.queued_request_list):
+                    if queue and (self.image_request_window <= 0 or
+                                  cnt_list[i != PRIORITY_INTERACTIVE] < self.image_request_window):
+                        priority = i
+                        break
+                if priority is None:
+                    return
+                key, (data, droppable) = self.queued_request_list[priority].popitem(last=False)
+                # in the table before sending, the response may come first
+                inflight = [None, droppable, priority]
+                self.inflight_request_dict[key] = inflight
+            try:
+                inflight[0] = self.send_with_waiter(key, data, priority=priority)
+            except RuntimeError as e:
+                with self.request_queue_lock:
+                    self.inflight_request_dict.pop(key, None)
+                self.report_error("Connection error", f"{e}")
+                return
+
+    def finish_request(self, key):
+        # every image and scaled image response resolves its key, sent or failed
+        with self.request_queue_lock:
+            if self.inflight_request_dict.pop(key, None) is None:
+                return
+        self.pump_requests()
+
+    def drop_stale_requests(self, keep_index_list):
+        # droppable requests for rows outside keep_index_list: queued ones are
+        # dropped, sent ones cancelled unless the server already started them
+        keep_set = set(keep_index_list)
+        stale_cnt = 0
+        with self.request_queue_lock:
+            for queue in self.queued_request_list:
+                stale_list = [key for key, (_, droppable) in queue.items() if droppable and key[1] not in keep_set]
+                for key in stale_list:
+                    del queue[key]
+                stale_cnt += len(stale_list)
+            self.dropped_request_cnt += stale_cnt
+            req_id_list = [inflight[0] for key, inflight in self.inflight_request_dict.items()
+                           if inflight[1] and inflight[0] is not None and key[1] not in keep_set]
+        if stale_cnt:
+            log_info(f'Dropped {stale_cnt} queued requests for frames no longer shown')
+        if req_id_list:
+            log_network(f'Cancel {len(req_id_list)} requests')
+            self.try_send('cancel', pack_cancel_request(req_id_list))
+        return stale_cnt
+
+    def cancel_range(self, index1, index2):
+        # every queued and sent image request of rows index1..index2, e.g. to stop "Load All Image"
+        stale_cnt = 0
+        with self.request_queue_lock:
+            for queue in self.queued_request_list:
+                stale_list = [key for key in queue if index1 <= key[1] <= index2]
+                for key in stale_list:
+                    del queue[key]
+                stale_cnt += len(stale_list)
+            self.dropped_request_cnt += stale_cnt
+        log_network(f'Cancel requests from index {index1} to {index2}')
+        self.try_send('cancel', pack_cancel_request(index1=index1, index2=index2))
+        return stale_cnt
+
+    def request_image(self, index, droppable=False, priority=PRIORITY_INTERACTIVE):
+        if self.wait_for_row_versions(index, droppable, priority):
+            return
+        if self.load_from_disk_cache(index) is not None:
+            return
+        log_network(f'Request image {index}')
+        self.queue_request(('image', index), pack_image_request(index), droppable, priority)
+
+    def wait_for_row_versions(self, index, droppable, priority):
+        # True when the image request has to wait for the versions of its clip,
+        # it is made again once they arrived so a copy on disk needs no request
+        if self.disk_cache is None or not self.data_cnt:
+            return False
+        clip_index, index1, index2 = self.get_version_range(index)
+        with self.version_lock:
+            if clip_index in self.version_clip_set:
+                return False
+            wait_list = self.version_wait_dict.get(clip_index)
+            if wait_list is not None:
+                wait_list.append((index, droppable, priority))
+                return True
+            self.version_wait_dict[clip_index] = [(index, droppable, priority)]
+
+        def callback(result):
+            # on error the images are simply fetched from the server
+            with self.version_lock:
+                self.version_clip_set.add(clip_index)
+                wait_list = self.version_wait_dict.pop(clip_index, [])
+            for wait_index, wait_droppable, wait_priority in wait_list:
+                self.request_image(wait_index, wait_droppable, wait_priority)
+
+        log_network(f'Request versions from index {index1} to {index2}')
+        try:
+            self.send_with_waiter('row_version', pack_row_version_request(index1, index2), callback)
+        except RuntimeError as e:
+            self.report_error("Connection error", f"{e}")
+            callback(e)
+        return True
+
+    def request_scaled_image(self, index, max_width, max_height, image_format='JPEG', quality=85,
+                             droppable=False, priority=PRIORITY_INTERACTIVE):
+        log_network(f'Request image {index} scaled to {max_width}x{max_height}')
+        self.queue_request(('scaled_image', index),
+                           pack_scaled_image_request(index, max_width, max_height, image_format, quality),
+                           droppable, priority)
+
+    def request_validators(self, index1, index2):
+        log_network(f'Request validators from index {index1} to {index2}')
+        self.try_send('validators', pack_validator_request(index1, index2))
+
+    def request_all_image(self):
+        log_info(f'Request all image')
+        for i in range(0,self.data_cnt):
+            if self.img_cache[i] == None:
+                self.request_image(i, priority=PRIORITY_BULK)
+
+    def request_csv_tag_info(self):
+        log_network(f'Request csv tag')
+        self.try_send('csv_tag', b'\xff\x02')
+
+    def request_csv_change(self,index1,index2,write_list):
+        log_network(f'Request csv change')
+        log_network(f'List to send: {write_list}')
+        # saved by the server's autosave policy
+        self.try_send('csv_change', pack_csv_change_request(index1, index2, write_list[0:self.tag_cnt]))
+
+    def request_csv_bulk_change(self, segment_list):
+        if not segment_list:
+            return
+        log_network(f'Request bulk csv change with {len(segment_list)} segments')
+        self.apply_segments_locally(segment_list)
+        self.try_send('csv_bulk_change', pack_csv_bulk_change_request(segment_list, self.tag_cnt))
+
+    def request_save(self):
+        log_network(f'Request save')
+        self.try_send('save', b'\xff\x04')
+
+    def request_stats(self):
+        log_network(f'Request server stats')
+        self.try_send('stats', b'\xff\x08')
+
+    def request_clip_data(self):
+        log_network(f'Request clip data')
+        self.try_send('clip', b'\xff\x05')
+
+    def request_csv_data(self):
+        log_network(f'Request csv data')
+        self.try_send('csv', b'\xff\x06')
+
+    # receiving
+
+    def safe_recv(self,size):
+        self.sock.settimeout(30.0)
+        data = bytearray()
+        while len(data) < size:
+            try:
+                packet = self.sock.recv(size - len(data))
+                if not packet:
+                    log_error("Socket connection broken")
+                    raise ConnectionResetError("Socket connection broken")
+                data.extend(packet)
+            except socket.timeout:
+                log_error(f"Timeout, expected length: {size}, received: {len(data)}")
+                self.report_error("Connection error",
+                        f"Timeout, expected length: {size}, received: {len(data)}")
+        return bytes(data)
+
+    def receive_data(self):
+        log_network(f'Connection established, listening for data')
+        try:
+            while True:
+                self.sock.settimeout(None)
+                init_char = self.sock.recv(1)
+                if not init_char: break
+                else:
+                    verifier = struct.unpack('B', init_char)[0]
+                    if verifier != 0xFF:
+                        log_network(f"Bad byte of {verifier}, dropping byte")
+                        continue
+
+                log_network("Header matched, reading socket message")
+                cmd = struct.unpack('B', self.safe_recv(1))[0]
+                if cmd == 0x0A:
+                    # tagged response, a normal frame follows the request id
+                    req_id, verifier, cmd = struct.unpack('>IBB', self.safe_recv(6))
+                    if verifier != 0xFF:
+                        log_network(f"Bad byte of {verifier} in tagged response {req_id}, dropping response")
+                        continue
+                    self.response_req_id = req_id
+                try:
+                    with self.tracer.span(f'receive_{RESPONSE_NAMES.get(cmd, "unknown")}', 'client', cmd=cmd), \
+                            self.tracer.profile(cmd):
+                        self.dispatch_response(cmd)
+                finally:
+                    if self.response_req_id is not None:
+                        with self.waiter_lock:
+                            self.req_waiter_dict.pop(self.response_req_id, None)
+                        self.response_req_id = None
+
+        except ConnectionResetError:
+            if self.connected:
+                log_error("Connection reset by server")
+                self.report_error("Connection error",
+                            f"Connection reset by server")
+            self.connected = False
+        except socket.timeout:
+            log_error("Socket timeout, connection may be lost")
+            self.report_error("Connection error",
+                        f"Socket timeout, connection may be lost")
+            self.connected = False
+        except Exception as e:
+            if self.connected:
+                log_error(f"Unexpected error in receive_data: {str(e)}")
+                self.report_error("Connection error",
+                            f"Unexpected error in receive_data: {str(e)}")
+            self.connected = False
+        finally:
+            self.connected = False
+            if self.sock:
+                try:
+                    self.sock.close()
+                except:
+                    pass
+                self.sock = None
+            self.fail_all_waiters(ConnectionError("Connection to server closed"))
+
+    def dispatch_response(self, cmd):
+        # receive image
+        if cmd == 0x01:
+            self.receive_image()
+        # receive csv tag
+        elif cmd == 0x02:
+            self.receive_csv_tag()
+        # CSV change completed
+        elif cmd == 0x03:
+            self.receive_csv_change_msg()
+        # save completed
+        elif cmd == 0x04:
+            self.receive_csv_save_msg()
+        # clip data
+        elif cmd == 0x05:
+            self.receive_clip_data()
+        # receive csv data
+        elif cmd == 0x06:
+            self.receive_csv_data()
+        # bulk CSV change completed
+        elif cmd == 0x07:
+            self.receive_csv_bulk_change_msg()
+        # server stats
+        elif cmd == 0x08:
+            self.receive_stats()
+        # scaled image
+        elif cmd == 0x09:
+            self.receive_scaled_image()
+        # row paths and versions
+        elif cmd == 0x0B:
+            self.receive_row_version()
+        # conditional image
+        elif cmd == 0x0C:
+            self.receive_conditional_image()
+        # validators
+        elif cmd == 0x0D:
+            self.receive_validators()
+        # requests skipped by a cancel
+        elif cmd == 0x0E:
+            self.receive_cancel()
+        # dataset list
+        elif cmd == 0x10:
+            self.receive_dataset_list()
+        # dataset selected
+        elif cmd == 0x11:
+            self.receive_select_dataset()
+        # rows matching a tag query
+        elif cmd == 0x12:
+            self.receive_query()
+        # labeling progress of clips
+        elif cmd == 0x13:
+            self.receive_progress()
+        else:
+            log_warn(f"Unknown cmd byte {cmd}. Maybe check version?")
+
+    def receive_image(self):
+        data = self.safe_recv(5)
+        status, index = struct.unpack('>BI', data)
+        if status == 0x00:
+            data = self.safe_recv(4)
+            img_size = struct.unpack('>I', data)[0]
+            img_data = self.safe_recv(img_size)
+            # unset failed state
+            if index < len(self.img_error_msg):
+                self.img_error_msg[index] = None
+            log_network(f"Received image {index}")
+            image = self.handle_image(index,img_data)
+            disk_cache_key = self.get_disk_cache_key(index)
+            if disk_cache_key is not None:
+                self.disk_cache.put(disk_cache_key, img_data)
+            self.resolve_waiter(('image', index), image)
+        else:
+            log_warn(f"Server respond with error with image {index}")
+            data = self.safe_recv(4)
+            error_size = struct.unpack('>I', data)[0]
+            data = self.safe_recv(error_size)
+            error_msg = data.decode('utf-8')
+            log_warn(f"Error received: {error_msg}")
+            if index < len(self.img_error_msg):
+                self.img_error_msg[index] = error_msg
+            self.resolve_waiter(('image', index), RuntimeError(f"Image {index}: {error_msg}"))
+            self.on_image(index)
+
+    def receive_scaled_image(self):
+        status, index, size = struct.unpack('>BII', self.safe_recv(9))
+        data = self.safe_recv(size)
+        if status == 0x00:
+            log_network(f"Received scaled image {index}")
+            image = Image.open(io.BytesIO(data)) if data else None
+            self.on_scaled_image(index, image)
+            self.resolve_waiter(('scaled_image', index), image, first_only=True)
+        else:
+            error_msg = data.decode('utf-8')
+            log_warn(f"Server respond with error with scaled image {index}: {error_msg}")
+            self.resolve_waiter(('scaled_image', index), RuntimeError(f"Image {index}: {error_msg}"), first_only=True)
+
+    def receive_row_version(self):
+        status, index1, row_cnt, id_size = struct.unpack('>BIIH', self.safe_recv(11))
+        server_id = self.safe_recv(id_size).decode('utf-8')
+        if status != 0x00:
+            self.resolve_waiter('row_version', RuntimeError('Server failed to send row versions'), first_only=True)
+            return
+        if len(self.row_version_list) != self.data_cnt or self.server_id != server_id:
+            self.row_path_list = [None] * self.data_cnt
+            self.row_version_list = [0] * self.data_cnt
+        self.server_id = server_id
+        for index in range(index1, index1 + row_cnt):
+            path_size = struct.unpack('>H', self.safe_recv(2))[0]
+            path, version = struct.unpack(f'>{path_size}sQ', self.safe_recv(path_size + 8))
+            if index < self.data_cnt:
+                self.row_path_list[index] = path.decode('utf-8')
+                self.row_version_list[index] = version
+        log_network(f"Received versions of {row_cnt} rows")
+        self.resolve_waiter('row_version', row_cnt, first_only=True)
+
+    def receive_conditional_image(self):
+        status, index, etag = struct.unpack('>BIQ', self.safe_recv(13))
+        if status == 0x00:
+            # changed, a normal image response follows
+            if index < len(self.row_version_list):
+                self.row_version_list[index] = etag
+            verifier, cmd = struct.unpack('BB', self.safe_recv(2))
+            if verifier != 0xFF or cmd != 0x01:
+                raise ConnectionError(f"Expected image response after conditional image {index}")
+            self.receive_image()
+        elif status == 0x02:
+            log_network(f"Image {index} not modified")
+            if self.cache_images and self.img_cache[index] is not None:
+                image = self.img_cache[index]
+            else:
+                image = self.load_from_disk_cache(index)
+            if image is None:
+                image = RuntimeError(f"Image {index} not modified but no local copy left")
+            self.resolve_waiter(('image', index), image)
+        else:
+            self.resolve_waiter(('image', index), RuntimeError(f"Image {index}: bad conditional request or read error on the server"))
+
+    def receive_validators(self):
+        status, index1, row_cnt = struct.unpack('>BII', self.safe_recv(9))
+        if status != 0x00:
+            self.resolve_waiter('validators', RuntimeError('Server failed to send validators'))
+            return
+        data = self.safe_recv(row_cnt * 24)
+        if len(self.row_version_list) != self.data_cnt:
+            self.row_path_list = [None] * self.data_cnt
+            self.row_version_list = [0] * self.data_cnt
+        changed_list = []
+        for i in range(0, row_cnt):
+            index = index1 + i
+            size, mtime_ns, etag = struct.unpack_from('>QQQ', data, i * 24)
+            if index >= self.data_cnt or self.row_version_list[index] == etag:
+                continue
+            old_etag = self.row_version_list[index]
+            self.row_version_list[index] = etag
+            # a row seen for the first time has nothing stale to drop
+            if old_etag:
+                changed_list.append(index)
+                if index < len(self.img_cache):
+                    self.img_cache[index] = None
+        if changed_list:
+            log_info(f"{len(changed_list)} images changed on the server")
+            self.on_validators(changed_list)
+        self.resolve_waiter('validators', changed_list)
+
+    def receive_cancel(self):
+        status, req_cnt = struct.unpack('>BI', self.safe_recv(5))
+        req_id_list = struct.unpack(f'>{req_cnt}I', self.safe_recv(4 * req_cnt))
+        log_network(f"{req_cnt} requests cancelled")
+        self.cancelled_request_cnt += req_cnt
+        for req_id in req_id_list:
+            # these requests never get a response, release what waits for them
+            with self.request_queue_lock:
+                key_list = [key for key, inflight in self.inflight_request_dict.items() if inflight[0] == req_id]
+            for key in key_list:
+                self.finish_request(key)
+            with self.waiter_lock:
+                req_entry = self.req_waiter_dict.pop(req_id, None)
+            if req_entry is not None:
+                self.remove_waiter(*req_entry)
+                req_entry[1](RuntimeError(f"Request {req_entry[0]} cancelled"))
+        self.resolve_waiter('cancel', list(req_id_list))
+
+    def receive_dataset_list(self):
+        data = self.safe_recv(5)
+        status, list_size = struct.unpack('>BI', data)
+        list_bytes = self.safe_recv(list_size)
+        if status == 0x00:
+            self.resolve_waiter('datasets', json.loads(list_bytes.decode('utf-8')))
+        else:
+            self.resolve_waiter('datasets', RuntimeError('Server failed to list datasets'))
+
+    def receive_query(self):
+        status, match_cnt, run_cnt = struct.unpack('>BII', self.safe_recv(9))
+        run_bytes = self.safe_recv(8 * run_cnt) if run_cnt else b''
+        if status == 0x00:
+            run_list = [struct.unpack('>II', run_bytes[i:i+8]) for i in range(0, len(run_bytes), 8)]
+            self.resolve_waiter('query', run_list, first_only=True)
+        else:
+            self.resolve_waiter('query', RuntimeError('Server rejected the tag query'), first_only=True)
+
+    def receive_progress(self):
+        status, clip_cnt = struct.unpack('>BI', self.safe_recv(5))
+        progress_bytes = self.safe_recv(16 * clip_cnt) if clip_cnt else b''
+        if status == 0x00:
+            progress_list = [struct.unpack('>IIII', progress_bytes[i:i+16]) for i in range(0, len(progress_bytes), 16)]
+            self.resolve_waiter('progress', progress_list, first_only=True)
+        else:
+            self.resolve_waiter('progress', RuntimeError('Server rejected the progress request'), first_only=True)
+
+    def receive_select_dataset(self):
+        status = struct.unpack('B', self.safe_recv(1))[0]
+        if status == 0x00:
+            self.resolve_waiter('select_dataset', True)
+        elif status == 0x01:
+            self.resolve_waiter('select_dataset', RuntimeError('Server has no such dataset'))
+        else:
+            self.resolve_waiter('select_dataset', RuntimeError('Server failed to load the dataset'))
+
+    def receive_csv_tag(self):
+        data = self.safe_recv(5)
+        status, self.tag_cnt = struct.unpack('>BI',data)
+        alias_list = []
+        for i in range(0,self.tag_cnt):
+            data =  self.safe_recv(4)
+            alias_size = struct.unpack('>I', data)[0]
+            alias_bytes =  self.safe_recv(alias_size)
+            alias = alias_bytes.decode('utf-8')
+            alias_list.append(alias)
+        log_network(f"Received {self.tag_cnt} csv tag with alias_list of {alias_list}")
+        self.handle_csv_tag(alias_list)
+        self.resolve_waiter('csv_tag', alias_list)
+
+    def receive_csv_change_msg(self):
+        data = self.safe_recv(1)
+        status = struct.unpack('>B',data)[0]
+        if status == 0x00:
+            log_ok(f"CSV change complete.")
+            self.resolve_waiter('csv_change', True, first_only=True)
+        else:
+            log_warn(f"CSV change failed!")
+            self.report_error("Server error",
+                        f"Server failed to change CSV data. Check server console.")
+            self.resolve_waiter('csv_change', RuntimeError("Server failed to change CSV data"), first_only=True)
+
+    def receive_csv_bulk_change_msg(self):
+        data = self.safe_recv(5)
+        status, row_cnt = struct.unpack('>BI',data)
+        if status == 0x00:
+            log_ok(f"Bulk CSV change of {row_cnt} rows complete.")
+            self.resolve_waiter('csv_bulk_change', row_cnt, first_only=True)
+        else:
+            log_warn(f"Bulk CSV change failed!")
+            self.report_error("Server error",
+                        f"Server failed to change CSV data. Check server console.")
+            self.resolve_waiter('csv_bulk_change', RuntimeError("Server failed to change CSV data"), first_only=True)
+
+    def receive_csv_save_msg(self):
+        data = self.safe_recv(1)
+        status = struct.unpack('>B',data)[0]
+        if status == 0x00:
+            log_ok(f"Save complete.")
+            self.resolve_waiter('save', True, first_only=True)
+        else:
+            log_warn(f"Save failed!")
+            self.report_error("Server error",
+                        f"Server failed to save the csv file. Check server console.")
+            self.resolve_waiter('save', False, first_only=True)
+
+    def receive_clip_data(self):
+        data = self.safe_recv(1)
+        status = struct.unpack('>B',data)[0]
+        if status == 0x00:
+            log_network(f"Receiving clip data")
+            data = self.safe_recv(4)
+            self.clip_cnt = struct.unpack('>I', data)[0]
+            self.clip_list = []
+            for i in range(0,self.clip_cnt):
+                clip = {}
+                data = self.safe_recv(12)
+                clip['begin'],clip['end'],clip['cam'] = struct.unpack('>III', data)
+                self.clip_list.append(clip)
+            self.handle_clip_data()
+            self.resolve_waiter('clip', self.clip_list)
+        else:
+            log_error(f'Error in receiving clip data')
+            self.resolve_waiter('clip', RuntimeError('Server failed to send clip data'))
+
+    def receive_csv_data(self):
+        log_network("receiving csv data")
+        data = self.safe_recv(5)
+        status, csv_size = struct.unpack('>BI', data)
+        if status == 0x00:
+            csv_bytes = self.safe_recv(csv_size)
+            self.handle_csv(csv_bytes)
+            self.resolve_waiter('csv', self.data_cnt)
+        else:
+            self.resolve_waiter('csv', RuntimeError('Server failed to send CSV data'))
+
+    def receive_stats(self):
+        data = self.safe_recv(5)
+        status, stats_size = struct.unpack('>BI', data)
+        stats_bytes = self.safe_recv(stats_size)
+        if status == 0x00:
+            self.server_stats = json.loads(stats_bytes.decode('utf-8'))
+            self.on_stats(self.server_stats)
+            self.resolve_waiter('stats', self.server_stats)
+        else:
+            self.resolve_waiter('stats', RuntimeError('Server failed to send stats'))
+
+    def has_local_image(self, index):
+        # a copy in memory or on disk that a conditional request can validate
+        if index >= len(self.row_version_list) or not self.row_version_list[index]:
+            return False
+        if self.cache_images and self.img_cache[index] is not None:
+            return True
+        disk_cache_key = self.get_disk_cache_key(index)
+        return disk_cache_key is not None and disk_cache_key in self.disk_cache.entry_dict
+
+    def get_disk_cache_key(self, index):
+        # None when the disk cache is off or the server gave no version for the row,
+        # validators alone carry no path
+        if self.disk_cache is None or index >= len(self.row_version_list) or not self.row_version_list[index]:
+            return None
+        if self.row_path_list[index] is None:
+            return None
+        return DiskCache.make_key(self.server_id, self.row_path_list[index], self.row_version_list[index])
+
+    def load_from_disk_cache(self, index):
+        disk_cache_key = self.get_disk_cache_key(index)
+        if disk_cache_key is None:
+            return None
+        img_data = self.disk_cache.get(disk_cache_key)
+        if img_data is None:
+            return None
+        if index < len(self.img_error_msg):
+            self.img_error_msg[index] = None
+        return self.handle_image(index, img_data)
+
+    def handle_image(self, index, img_data):
+        if not img_data:
+            log_warn("empty image data")
+            return None
+
+        image = Image.open(io.BytesIO(img_data))
+
+        if self.cache_images:
+            self.img_cache[index] = image
+        self.on_image(index)
+        return image
+
+    def handle_csv_tag(self,alias_list):
+        self.alias_list = alias_list
+
+    def handle_csv(self,csv_bytes):
+        csv_str = csv_bytes.decode('utf-8')
+        csv_data = pd.read_csv(StringIO(csv_str))
+        self.data_list = csv_data.values.tolist()
+        self.data_column_list = csv_data.columns.tolist()
+
+        self.data_cnt = len(self.data_list)
+        self.img_cache = []
+        self.img_error_msg = []
+        for i in range(0,self.data_cnt):
+            self.img_cache.append(None)
+            self.img_error_msg.append(None)
+
+        log_info(f"CSV list received with size of {len(self.data_list)}")
+
+    def handle_clip_data(self):
+        # verify all clip cover all the images
+        for i in range(0,self.clip_cnt-1):
+            if self.clip_list[i]['end'] != self.clip_list[i+1]['begin']:
+                log_error(f"Broken clip data! clip {i} end {self.clip_list[i]['end']}, clip {i+1} begin {self.clip_list[i+1]['begin']}")
+
+        self.frame_index = FrameIndex(self.clip_list)
+        self.combined_entry_list_cnt = len(self.frame_index)
+        # versions are asked for again per clip of the loaded dataset
+        with self.version_lock:
+            self.version_clip_set = set()
+            self.version_wait_dict = {}
+
+    def get_version_range(self, index):
+        # (clip, first row, last row) whose versions are fetched with row index's,
+        # the last clip takes the rows after it, one range without clips
+        if not self.clip_cnt:
+            return -1, 0, self.data_cnt - 1
+        clip_index = self.frame_index.get_clip_of_row(index)
+        index1 = self.clip_list[clip_index]['begin'] if clip_index else 0
+        if clip_index + 1 < self.clip_cnt:
+            return clip_index, index1, self.clip_list[clip_index+1]['begin'] - 1
+        return clip_index, index1, self.data_cnt - 1
+
+class AsyncHeadlessClient:
+    """
+    asyncio wrapper around HeadlessClient. Responses still arrive on the
+    HeadlessClient receiving thread and are handed to the event loop.
+
+    Example:
+        async with AsyncHeadlessClient('127.0.0.1', 52973) as client:
+            await client.load_dataset()
+            image_dict = await client.fetch_images(range(0, 30))
+            await client.set_tags_bulk({i: [True, False] for i in range(0, 30)})
+            await client.save()
+    """
+    def __init__(self, host='127.0.0.1', port=52973, **kwargs):
+        self.client = HeadlessClient(host, port, **kwargs)
+        # one versions request per clip even with concurrent fetches
+        self.row_version_lock = asyncio.Lock()
+
+    def __getattr__(self, name):
+        # dataset state (data_list, tag_cnt, frame_index, ...) lives on the client
+        return getattr(self.client, name)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(None, self.client.connect_to_server):
+            raise ConnectionError(f"Failed to connect to server at {self.client.host}:{self.client.port}")
+
+    async def close(self):
+        self.client.close()
+
+    async def request(self, key, data, timeout):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        def set_result(result):
+            if future.done():
+                return
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        def callback(result):
+            loop.call_soon_threadsafe(set_result, result)
+        self.client.send_with_waiter(key, data, callback)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.client.remove_waiter(key, callback)
+            raise TimeoutError(f"No response for {key} within {timeout}s")
+
+    async def list_datasets(self, timeout=10.0):
+        return await self.request('datasets', b'\xff\x10', timeout)
+
+    async def select_dataset(self, name, timeout=60.0):
+        if self.client.data_cnt:
+            self.client.cancel_range(0, self.client.data_cnt - 1)
+        await self.request('select_dataset', pack_select_dataset_request(name), timeout)
+        self.client.dataset_name = self.client.selected_dataset = name
+
+    async def query_rows(self, expr, index1=0, index2=None, timeout=10.0):
+        if index2 is None:
+            index2 = self.client.data_cnt - 1
+        program = compile_query(expr, self.client.alias_list)
+        return await self.request('query', pack_query_request(QUERY_LIST, index1, index2, index1, program), timeout)
+
+    async def find_row(self, expr, start, index1=0, index2=None, backward=False, timeout=10.0):
+        if index2 is None:
+            index2 = self.client.data_cnt - 1
+        program = compile_query(expr, self.client.alias_list)
+        run_list = await self.request('query', pack_query_request(
+            QUERY_PREV if backward else QUERY_NEXT, index1, index2, start, program
+        ), timeout)
+        return run_list[0][0] if run_list else None
+
+    async def fetch_progress(self, clip1=0, clip2=None, timeout=10.0):
+        if clip2 is None:
+            clip2 = self.client.clip_cnt - 1
+        return await self.request('progress', pack_progress_request(clip1, clip2), timeout)
+
+    async def load_dataset(self, timeout=10.0):
+        if self.client.dataset_name and self.client.dataset_name != self.client.selected_dataset:
+            await self.select_dataset(self.client.dataset_name, timeout)
+        await self.request('csv_tag', b'\xff\x02', timeout)
+        await self.request('csv', b'\xff\x06', timeout)
+        await self.request('clip', b'\xff\x05', timeout)
+
+    async def fetch_row_versions(self, index, timeout=10.0):
+        if self.client.disk_cache is None or not self.client.data_cnt:
+            return
+        clip_index, index1, index2 = self.client.get_version_range(index)
+        async with self.row_version_lock:
+            if clip_index in self.client.version_clip_set:
+                return
+            await self.request('row_version', pack_row_version_request(index1, index2), timeout)
+            with self.client.version_lock:
+                self.client.version_clip_set.add(clip_index)
+
+    async def fetch_image(self, index, timeout=30.0):
+        if self.client.cache_images and self.client.img_cache[index] is not None:
+            return self.client.img_cache[index]
+        await self.fetch_row_versions(index, timeout)
+        if self.client.get_disk_cache_key(index) is not None:
+            # file read and decode off the event loop
+            loop = asyncio.get_running_loop()
+            image = await loop.run_in_executor(None, self.client.load_from_disk_cache, index)
+            if image is not None:
+                return image
+        return await self.request(('image', index), pack_image_request(index), timeout)
+
+    async def revalidate_rows(self, index1, index2, timeout=30.0):
+        return await self.request('validators', pack_validator_request(index1, index2), timeout)
+
+    async def revalidate_clip(self, clip_index, timeout=30.0):
+        return await self.request('validators', pack_validator_request(clip_index=clip_index), timeout)
+
+    async def fetch_scaled_image(self, index, max_width, max_height, image_format='JPEG', quality=85, timeout=30.0):
+        return await self.request(
+            ('scaled_image', index), pack_scaled_image_request(index, max_width, max_height, image_format, quality), timeout
+        )
+
+    async def fetch_images(self, index_list, window=8, timeout=30.0):
+        # returns {index: image}, failed images map to their RuntimeError
+        slot = asyncio.Semaphore(window)
+        async def fetch(index):
+            async with slot:
+                try:
+                    return index, await self.fetch_image(index, timeout)
+                except RuntimeError as e:
+                    return index, e
+        return dict(await asyncio.gather(*(fetch(index) for index in index_list)))
+
+    async def set_tags(self, index1, index2, tag_list, timeout=30.0):
+        for index in range(index1, index2 + 1):
+            self.client.data_list[index] = list(tag_list)
+        return await self.request('csv_change', pack_csv_change_request(index1, index2, tag_list), timeout)
+
+    async def set_tags_bulk(self, tag_dict, timeout=30.0):
+        pending = []
+        for index, tag_list in tag_dict.items():
+            self.client.data_list[index] = list(tag_list)
+            pending.append(self.request('csv_change', pack_csv_change_request(index, index, tag_list), timeout))
+        await asyncio.gather(*pending)
+
+    async def set_tags_segments(self, segment_list, timeout=60.0):
+        self.client.apply_segments_locally(segment_list)
+        return await self.request(
+            'csv_bulk_change', pack_csv_bulk_change_request(segment_list, self.client.tag_cnt), timeout
+        )
+
+    async def save(self, timeout=60.0):
+        return await self.request('save', b'\xff\x04', timeout)
+
+    async def fetch_stats(self, timeout=10.0):
+        return await self.request('stats', b'\xff\x08', timeout)
@@ -0,0 +1,134 @@
+"""
+Image pack: the dataset's image files bundled into a few large shard files.
+
+Packing removes the open/stat per frame that dominates send_image on
+network filesystems. Images are written in the order the server serves
+them (after reorder_csv_to_alternating_pattern), so clip playback reads
+the shards sequentially. pack_index.bin maps each file_path to its shard,
+offset and length; the server looks paths up there and falls back to the
+loose file for anything not packed.
+
+Index layout (big endian):
+    magic b'FITPACK1', shard_cnt(4), entry_cnt(4)
+    per shard: name_size(2) name
+    per entry: path_size(2) path shard(2) offset(8) length(4) mtime_ns(8)
+
+Example:
+    python image_pack.py --setting server_setting.json --out pack
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+
+INDEX_NAME = 'pack_index.bin'
+INDEX_MAGIC = b'FITPACK1'
+ENTRY_STRUCT = struct.Struct('>HQIq')
+
+def write_pack(path_list, out_dir, shard_bytes=4 << 30, log=print):
+    # path_list in serving order, duplicates are stored once
+    os.makedirs(out_dir, exist_ok=True)
+    shard_name_list = []
+    entry_dict = {}
+    shard_file = None
+    shard_size = 0
+    try:
+        for path in path_list:
+            if path in entry_dict:
+                continue
+            stat = os.stat(path)
+            if shard_file is None or (shard_size and shard_size + stat.st_size > shard_bytes):
+                if shard_file is not None:
+                    shard_file.close()
+                shard_name_list.append(f'pack_{len(shard_name_list):05d}.bin')
+                shard_file = open(os.path.join(out_dir, shard_name_list[-1]), 'wb')
+                shard_size = 0
+            with open(path, 'rb') as image_file:
+                data = image_file.read()
+            shard_file.write(data)
+            entry_dict[path] = (len(shard_name_list) - 1, shard_size, len(data), stat.st_mtime_ns)
+            shard_size += len(data)
+    finally:
+        if shard_file is not None:
+            shard_file.close()
+
+    # the index goes last and through a rename, a half written pack has no index
+    index_path = os.path.join(out_dir, INDEX_NAME)
+    with open(index_path + '.tmp', 'wb') as index_file:
+        index_file.write(INDEX_MAGIC + struct.pack('>II', len(shard_name_list), len(entry_dict)))
+        for name in shard_name_list:
+            name_bytes = name.encode('utf-8')
+            index_file.write(struct.pack('>H', len(name_bytes)) + name_bytes)
+        for path, entry in entry_dict.items():
+            path_bytes = path.encode('utf-8')
+            index_file.write(struct.pack('>H', len(path_bytes)) + path_bytes + ENTRY_STRUCT.pack(*entry))
+    os.replace(index_path + '.tmp', index_path)
+    log(f'Packed {len(entry_dict)} images into {len(shard_name_list)} shards in {out_dir}')
+    return len(entry_dict)
+
+class PackReader:
+    """Read-only view of a pack, every shard is memory mapped."""
+    def __init__(self, pack_dir):
+        with open(os.path.join(pack_dir, INDEX_NAME), 'rb') as index_file:
+            data = index_file.read()
+        if data[0:8] != INDEX_MAGIC:
+            raise ValueError(f'{pack_dir} is not an image pack')
+        shard_cnt, entry_cnt = struct.unpack_from('>II', data, 8)
+        position = 16
+
+        self.file_list = []
+        self.mmap_list = []
+        for i in range(0, shard_cnt):
+            name_size = struct.unpack_from('>H', data, position)[0]
+            name = data[position+2:position+2+name_size].decode('utf-8')
+            position += 2 + name_size
+            shard_file = open(os.path.join(pack_dir, name), 'rb')
+            self.file_list.append(shard_file)
+            self.mmap_list.append(mmap.mmap(shard_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+        # path -> (shard, offset, length, mtime_ns)
+        self.entry_dict = {}
+        for i in range(0, entry_cnt):
+            path_size = struct.unpack_from('>H', data, position)[0]
+            path = data[position+2:position+2+path_size].decode('utf-8')
+            position += 2 + path_size
+            self.entry_dict[path] = ENTRY_STRUCT.unpack_from(data, position)
+            position += ENTRY_STRUCT.size
+
+    def lookup(self, path):
+        return self.entry_dict.get(path)
+
+    def view(self, entry):
+        # zero copy slice of the mapped shard
+        shard, offset, length, _ = entry
+        return memoryview(self.mmap_list[shard])[offset:offset+length]
+
+    def warm(self, entry):
+        shard, offset, length, _ = entry
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            # madvise needs a page aligned start
+            start = offset - offset % mmap.PAGESIZE
+            self.mmap_list[shard].madvise(mmap.MADV_WILLNEED, start, offset + length - start)
+        return length
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pack the images of a dataset into shard files.')
+    parser.add_argument('--setting', default='server_setting.json', help='server setting file naming the dataset')
+    parser.add_argument('--out', default='pack', help='output folder, set it as pack_dir in the server setting')
+    parser.add_argument('--shard-mb', type=int, default=4096, help='maximum shard size')
+    args = parser.parse_args(argv)
+
+    # reuse the server's loading so the pack order is exactly the serving order
+    from server import BackendServer, log_ok
+    server = BackendServer(args.setting)
+    server.build_csv()
+    path_list = [row[server.data_entry_file_path] for row in server.data_list]
+    try:
+        write_pack(path_list, args.out, args.shard_mb << 20, log_ok)
+    except OSError as e:
+        print(f'Packing failed: {e}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
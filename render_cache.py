@@ -0,0 +1,46 @@
+"""
+Cache of rendered images for the Tk client.
+
+Keys are (row, scale, resampling filter), values are whatever the caller
+renders, usually an ImageTk.PhotoImage. Scrub previews are stored as
+(row, 'preview', None). Each entry carries its cost in
+bytes and the least recently used entries are dropped beyond the budget.
+"""
+from collections import OrderedDict
+
+class RenderCache:
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        # key -> (value, cost)
+        self.entry_dict = OrderedDict()
+        self.hit_cnt = 0
+        self.miss_cnt = 0
+
+    def get(self, key):
+        entry = self.entry_dict.get(key)
+        if entry is None:
+            self.miss_cnt += 1
+            return None
+        self.entry_dict.move_to_end(key)
+        self.hit_cnt += 1
+        return entry[0]
+
+    def put(self, key, value, cost):
+        if cost > self.budget_bytes:
+            return
+        self.pop(key)
+        self.entry_dict[key] = (value, cost)
+        self.used_bytes += cost
+        while self.used_bytes > self.budget_bytes:
+            _, (_, evicted_cost) = self.entry_dict.popitem(last=False)
+            self.used_bytes -= evicted_cost
+
+    def pop(self, key):
+        entry = self.entry_dict.pop(key, None)
+        if entry is not None:
+            self.used_bytes -= entry[1]
+
+    def discard_row(self, row):
+        for key in [key for key in self.entry_dict if key[0] == row]:
+            self.pop(key)
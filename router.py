@@ -0,0 +1,650 @@
+"""
+Router of a sharded deployment, see server_shards.py.
+
+    python router.py [server_setting.json]
+
+Reads the same setting file as server.py. Starts shard_cnt BackendServer
+processes on localhost from shard_base_port on (or uses the shards in
+shard_list), splits the clips between them and listens on host:port,
+speaking the normal protocol to clients:
+
+    image, scaled image, conditional image    shard owning the row
+    tag change, bulk tag change               split by shard
+    row versions, validators of a range       split, replies joined
+    validators of a clip                      shard owning the clip
+    tag query                                 split, replies joined
+    clip progress                             split by clip, replies joined
+    cancel, stats                             every shard, replies joined
+    save                                      every shard, parts joined
+    everything else                           shard 0
+
+Parts the shards autosave are joined in the background as well.
+
+Every client gets its own connection to each shard. Tagged responses of
+the shards are relayed as they arrive; untagged ones are collected by the
+client thread, which answers untagged requests in order. Requests split
+over several shards are sent untagged and answered by the router, inside
+the client's envelope when the request had one.
+"""
+import atexit
+import bisect
+import json
+import os
+import queue
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from server import BackendServer, safe_sendall, log_ok, log_info, log_warn, log_error, log_network
+from server_shards import get_part_path, merge_parts
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# argument bytes after 0xFF cmd of the requests with a fixed size
+REQUEST_SIZE_DICT = {
+    0x01: 4, 0x02: 0, 0x04: 0, 0x05: 0, 0x06: 0, 0x08: 0,
+    0x09: 10, 0x0B: 8, 0x0C: 12, 0x0D: 9, 0x10: 0, 0x13: 8,
+}
+
+def recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        packet = sock.recv(size - len(data))
+        if not packet:
+            raise ConnectionResetError("Socket connection broken")
+        data.extend(packet)
+    return bytes(data)
+
+def read_request(sock):
+    # (envelope, cmd, body) of the next request, body starting at its 0xFF.
+    # envelope is b'' for untagged requests
+    envelope = b''
+    cmd = recv_exact(sock, 2)[1]
+    if cmd == 0x0A:
+        envelope = b'\xff\x0a' + recv_exact(sock, 4)
+        cmd = recv_exact(sock, 2)[1]
+    elif cmd == 0x0F:
+        envelope = b'\xff\x0f' + recv_exact(sock, 5)
+        cmd = recv_exact(sock, 2)[1]
+    if cmd in REQUEST_SIZE_DICT:
+        args = recv_exact(sock, REQUEST_SIZE_DICT[cmd])
+    elif cmd == 0x03:
+        args = recv_exact(sock, 12)
+        args += recv_exact(sock, struct.unpack('>I', args[8:12])[0])
+    elif cmd == 0x07:
+        args = recv_exact(sock, 8)
+        segment_cnt, tag_cnt = struct.unpack('>II', args)
+        args += recv_exact(sock, segment_cnt * (12 + tag_cnt))
+    elif cmd == 0x0E:
+        args = recv_exact(sock, 5)
+        mode, value = struct.unpack('>BI', args)
+        args += recv_exact(sock, 4 * value if mode == 0 else 4)
+    elif cmd == 0x11:
+        args = recv_exact(sock, 2)
+        args += recv_exact(sock, struct.unpack('>H', args)[0])
+    elif cmd == 0x12:
+        args = recv_exact(sock, 15)
+        args += recv_exact(sock, struct.unpack('>H', args[13:15])[0])
+    else:
+        raise ConnectionError(f"Unknown cmd byte {cmd}, cannot route")
+    return envelope, cmd, b'\xff' + bytes([cmd]) + args
+
+def read_response(sock):
+    # the next response frame, starting at its 0xFF
+    head = recv_exact(sock, 2)
+    if head[0] != 0xFF:
+        raise ConnectionError(f"Bad byte of {head[0]} from shard")
+    cmd = head[1]
+    if cmd == 0x0A:
+        return head + recv_exact(sock, 4) + read_response(sock)
+    if cmd in (0x01, 0x09):
+        data = recv_exact(sock, 9)
+        return head + data + recv_exact(sock, struct.unpack('>I', data[5:9])[0])
+    if cmd == 0x02:
+        data = bytearray(recv_exact(sock, 5))
+        for i in range(0, struct.unpack('>I', data[1:5])[0]):
+            size = recv_exact(sock, 4)
+            data += size + recv_exact(sock, struct.unpack('>I', size)[0])
+        return head + bytes(data)
+    if cmd in (0x03, 0x04, 0x11):
+        return head + recv_exact(sock, 1)
+    if cmd == 0x05:
+        data = recv_exact(sock, 1)
+        if data[0] != 0x00:
+            return head + data
+        size = recv_exact(sock, 4)
+        return head + data + size + recv_exact(sock, 12 * struct.unpack('>I', size)[0])
+    if cmd in (0x06, 0x08, 0x10):
+        data = recv_exact(sock, 5)
+        if cmd == 0x06 and data[0] != 0x00:
+            return head + data
+        return head + data + recv_exact(sock, struct.unpack('>I', data[1:5])[0])
+    if cmd == 0x07:
+        return head + recv_exact(sock, 5)
+    if cmd == 0x0B:
+        data = bytearray(recv_exact(sock, 11))
+        _, _, row_cnt, id_size = struct.unpack('>BIIH', data)
+        data += recv_exact(sock, id_size)
+        for i in range(0, row_cnt):
+            size = recv_exact(sock, 2)
+            data += size + recv_exact(sock, struct.unpack('>H', size)[0] + 8)
+        return head + bytes(data)
+    if cmd == 0x0C:
+        data = recv_exact(sock, 13)
+        # a changed image is followed by a normal image response
+        return head + data + (read_response(sock) if data[0] == 0x00 else b'')
+    if cmd == 0x0D:
+        data = recv_exact(sock, 9)
+        return head + data + recv_exact(sock, 24 * struct.unpack('>I', data[5:9])[0])
+    if cmd == 0x0E:
+        data = recv_exact(sock, 5)
+        return head + data + recv_exact(sock, 4 * struct.unpack('>I', data[1:5])[0])
+    if cmd == 0x12:
+        data = recv_exact(sock, 9)
+        return head + data + recv_exact(sock, 8 * struct.unpack('>I', data[5:9])[0])
+    if cmd == 0x13:
+        data = recv_exact(sock, 5)
+        return head + data + recv_exact(sock, 16 * struct.unpack('>I', data[1:5])[0])
+    raise ConnectionError(f"Unknown response cmd byte {cmd} from shard")
+
+def join_progress(progress_list):
+    # the progress totals of the shards, each covering its own clips
+    progress = {
+        'clips': [progress_list[0]['clips'][0], progress_list[-1]['clips'][1]],
+        'tag_rows': [sum(tag_rows) for tag_rows in zip(*[entry['tag_rows'] for entry in progress_list])],
+        'cams': {},
+    }
+    for key in ('rows', 'labeled_rows', 'frames', 'labeled_frames'):
+        progress[key] = sum(entry[key] for entry in progress_list)
+    for entry in progress_list:
+        for name, (labeled_rows, rows) in entry['cams'].items():
+            total = progress['cams'].setdefault(name, [0, 0])
+            total[0] += labeled_rows
+            total[1] += rows
+    return progress
+
+class RouterSession:
+    """One client and its connection to every shard."""
+    def __init__(self, router, conn):
+        self.router = router
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.closed = False
+        self.upstream_list = []
+        # untagged responses per shard, None once the shard connection is gone
+        self.queue_list = []
+        for host, port in router.shard_addr_list:
+            upstream = socket.create_connection((host, port))
+            upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.upstream_list.append(upstream)
+            self.queue_list.append(queue.Queue())
+        for shard in range(0, len(self.upstream_list)):
+            threading.Thread(target=self.relay, args=(shard,), daemon=True).start()
+
+    def relay(self, shard):
+        try:
+            while True:
+                frame = read_response(self.upstream_list[shard])
+                if frame[1] == 0x0A:
+                    self.send_client(frame)
+                else:
+                    self.queue_list[shard].put(frame)
+        except (OSError, ConnectionError) as e:
+            if not self.closed:
+                log_warn(f"Connection to shard {shard} lost: {e}")
+                # the client notices on its next read
+                try:
+                    self.conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        finally:
+            self.queue_list[shard].put(None)
+
+    def send_client(self, data):
+        with self.send_lock:
+            safe_sendall(self.conn, data)
+
+    def reply(self, envelope, frame):
+        # router made responses answer tagged requests in a tagged envelope
+        if envelope:
+            frame = b'\xff\x0a' + envelope[-4:] + frame
+        self.send_client(frame)
+
+    def wait(self, shard):
+        try:
+            frame = self.queue_list[shard].get(timeout=self.router.response_timeout)
+        except queue.Empty:
+            raise ConnectionError(f"No response from shard {shard}")
+        if frame is None:
+            raise ConnectionError(f"Connection to shard {shard} closed")
+        return frame
+
+    def forward(self, shard, envelope, body):
+        # the whole request belongs to one shard, tagged responses come back through relay
+        self.router.forwarded_list[shard] += 1
+        self.upstream_list[shard].sendall(envelope + body)
+        if not envelope:
+            self.send_client(self.wait(shard))
+
+    def ask_all(self, body_dict):
+        # shard -> body, sent untagged to all shards first, then {shard: response}
+        self.router.split_cnt += 1
+        for shard, body in body_dict.items():
+            self.upstream_list[shard].sendall(body)
+        return {shard: self.wait(shard) for shard in body_dict}
+
+    def run(self):
+        try:
+            while True:
+                envelope, cmd, body = read_request(self.conn)
+                self.handle(envelope, cmd, body)
+        except (OSError, ConnectionError) as e:
+            log_network(f"Client session ended: {e}")
+        finally:
+            self.closed = True
+            for upstream in self.upstream_list:
+                upstream.close()
+            self.conn.close()
+
+    def handle(self, envelope, cmd, body):
+        router = self.router
+        if cmd in (0x01, 0x09, 0x0C):
+            self.forward(router.get_owner(struct.unpack('>I', body[2:6])[0]), envelope, body)
+        elif cmd == 0x03:
+            self.handle_csv_change(envelope, body)
+        elif cmd == 0x07:
+            self.handle_csv_bulk_change(envelope, body)
+        elif cmd == 0x04:
+            response_dict = self.ask_all({shard: body for shard in router.shard_range()})
+            saved = all(frame[2] == 0x00 for frame in response_dict.values()) and self.join_parts()
+            self.reply(envelope, b'\xff\x04' + (b'\x00' if saved else b'\x01'))
+        elif cmd == 0x08:
+            self.handle_stats(envelope, body)
+        elif cmd == 0x0B:
+            index1, index2 = struct.unpack('>II', body[2:10])
+            self.handle_row_split(envelope, body, index1, index2, 11, lambda i1, i2: b'\xff\x0b' + struct.pack('>II', i1, i2))
+        elif cmd == 0x0D:
+            mode, value1, value2 = struct.unpack('>BII', body[2:11])
+            if mode == 1:
+                self.forward(router.get_clip_owner(value1), envelope, body)
+            else:
+                self.handle_row_split(envelope, body, value1, value2, 9,
+                                      lambda i1, i2: b'\xff\x0d' + struct.pack('>BII', 0, i1, i2))
+        elif cmd == 0x12:
+            self.handle_query(envelope, body)
+        elif cmd == 0x13:
+            self.handle_progress(envelope, body)
+        elif cmd == 0x0E:
+            response_dict = self.ask_all({shard: body for shard in router.shard_range()})
+            req_id_bytes = b''.join(frame[7:] for frame in response_dict.values())
+            self.reply(envelope, b'\xff\x0e\x00' + struct.pack('>I', len(req_id_bytes) // 4) + req_id_bytes)
+        else:
+            # tag names, clip data and partial csv are the same on every shard
+            self.forward(0, envelope, body)
+
+    def handle_csv_change(self, envelope, body):
+        index1, index2, tag_cnt = struct.unpack('>III', body[2:14])
+        part_list = self.router.split_rows(index1, index2)
+        if len(part_list) <= 1:
+            # also lets the owner answer out of bound requests as usual
+            self.forward(part_list[0][0] if part_list else self.router.get_owner(index1), envelope, body)
+            return
+        response_dict = self.ask_all({
+            shard: b'\xff\x03' + struct.pack('>III', first, last, tag_cnt) + body[14:]
+            for shard, first, last in part_list
+        })
+        changed = all(frame[2] == 0x00 for frame in response_dict.values())
+        self.reply(envelope, b'\xff\x03' + (b'\x00' if changed else b'\x01'))
+
+    def handle_csv_bulk_change(self, envelope, body):
+        segment_cnt, tag_cnt = struct.unpack('>II', body[2:10])
+        segment_dict = {}
+        offset = 10
+        for i in range(0, segment_cnt):
+            index1, index2, stride = struct.unpack('>III', body[offset:offset + 12])
+            tag_bytes = body[offset + 12:offset + 12 + tag_cnt]
+            offset += 12 + tag_cnt
+            # the same check a single server makes before writing anything
+            if index1 > index2 or index2 >= self.router.row_cnt or stride < 1:
+                log_error(f"Segment {index1} to {index2} stride {stride} out of bound")
+                self.reply(envelope, b'\xff\x07\x01' + struct.pack('>I', 0))
+                return
+            for shard, first, last in self.router.split_rows(index1, index2, stride):
+                segment_dict.setdefault(shard, []).append(struct.pack('>III', first, last, stride) + tag_bytes)
+        if not segment_dict:
+            segment_dict[0] = []
+        response_dict = self.ask_all({
+            shard: b'\xff\x07' + struct.pack('>II', len(segment_list), tag_cnt) + b''.join(segment_list)
+            for shard, segment_list in segment_dict.items()
+        })
+        status = 0x01 if any(frame[2] != 0x00 for frame in response_dict.values()) else 0x00
+        row_cnt = sum(struct.unpack('>I', frame[3:7])[0] for frame in response_dict.values())
+        # the joiner picks up the parts once the shards autosave them
+        self.reply(envelope, b'\xff\x07' + bytes([status]) + struct.pack('>I', row_cnt))
+
+    def handle_row_split(self, envelope, body, index1, index2, header_size, make_body):
+        # row versions and validators: one reply of the whole range, from the parts of every shard
+        part_list = self.router.split_rows(index1, index2)
+        if index1 > index2 or index2 >= self.router.row_cnt or len(part_list) <= 1:
+            self.forward(part_list[0][0] if part_list else 0, envelope, body)
+            return
+        response_dict = self.ask_all({shard: make_body(first, last) for shard, first, last in part_list})
+        frame_list = [response_dict[shard] for shard, _, _ in part_list]
+        for frame in frame_list:
+            if frame[2] != 0x00:
+                self.reply(envelope, frame)
+                return
+        # status, index1, row count and for row versions the server id, rows after that
+        head = frame_list[0][:header_size + 2]
+        if body[1] == 0x0B:
+            id_size = struct.unpack('>H', head[11:13])[0]
+            head = frame_list[0][:header_size + 2 + id_size]
+        row_bytes = b''.join(frame[len(head):] for frame in frame_list)
+        head = head[:7] + struct.pack('>I', index2 - index1 + 1) + head[11:]
+        self.reply(envelope, head + row_bytes)
+
+    def handle_query(self, envelope, body):
+        # each shard indexes the tags of its own rows, the parts of the range are joined
+        mode, index1, index2, start = struct.unpack('>BIII', body[2:15])
+        part_list = self.router.split_rows(index1, index2)
+        if index1 > index2 or index2 >= self.router.row_cnt or len(part_list) <= 1:
+            self.forward(part_list[0][0] if part_list else 0, envelope, body)
+            return
+        response_dict = self.ask_all({
+            shard: b'\xff\x12' + struct.pack('>BIII', mode, first, last, start) + body[15:]
+            for shard, first, last in part_list
+        })
+        match_cnt = 0
+        run_list = []
+        for shard, _, _ in part_list:
+            frame = response_dict[shard]
+            if frame[2] != 0x00:
+                self.reply(envelope, frame)
+                return
+            match_cnt += struct.unpack('>I', frame[3:7])[0]
+            for i in range(11, len(frame), 8):
+                first, last = struct.unpack('>II', frame[i:i+8])
+                if run_list and run_list[-1][1] + 1 == first:
+                    # a run across the shard boundary
+                    run_list[-1] = (run_list[-1][0], last)
+                else:
+                    run_list.append((first, last))
+        if mode != 2 and run_list:
+            # the first match of the shards after start, or the last one before it
+            row = run_list[-1][1] if mode == 1 else run_list[0][0]
+            run_list = [(row, row)]
+            match_cnt = 1
+        self.reply(envelope, b'\xff\x12\x00' + struct.pack('>II', match_cnt, len(run_list)) + b''.join(
+            struct.pack('>II', first, last) for first, last in run_list
+        ))
+
+    def handle_progress(self, envelope, body):
+        # each shard counts the changes of its own clips only
+        clip1, clip2 = struct.unpack('>II', body[2:10])
+        part_list = self.router.split_clips(clip1, clip2)
+        if clip2 >= self.router.range_list[-1][1] or len(part_list) <= 1:
+            self.forward(part_list[0][0] if part_list else 0, envelope, body)
+            return
+        response_dict = self.ask_all({
+            shard: b'\xff\x13' + struct.pack('>II', first, last) for shard, first, last in part_list
+        })
+        frame_list = [response_dict[shard] for shard, _, _ in part_list]
+        for frame in frame_list:
+            if frame[2] != 0x00:
+                self.reply(envelope, frame)
+                return
+        self.reply(envelope, b'\xff\x13\x00' + struct.pack('>I', clip2 - clip1 + 1) + b''.join(
+            frame[7:] for frame in frame_list
+        ))
+
+    def handle_stats(self, envelope, body):
+        response_dict = self.ask_all({shard: body for shard in self.router.shard_range()})
+        shard_stats_list = []
+        for shard in self.router.shard_range():
+            frame = response_dict[shard]
+            shard_stats_list.append(json.loads(frame[7:].decode('utf-8')) if frame[2] == 0x00 else None)
+        # shard 0 fills the fields the status bar reads
+        stats = dict(shard_stats_list[0] or {})
+        stats['clients'] = self.router.client_cnt
+        stats['dirty_rows'] = sum(shard_stats['dirty_rows'] for shard_stats in shard_stats_list if shard_stats)
+        if 'autosave' in stats:
+            stats['autosave'] = dict(stats['autosave'], dirty_rows=stats['dirty_rows'])
+            if self.router.join_saves:
+                # what clients see saved is the joined file
+                stats['autosave']['last_save_time'] = self.router.last_join_time
+        progress_list = [shard_stats['progress'] for shard_stats in shard_stats_list if shard_stats and 'progress' in shard_stats]
+        if progress_list:
+            stats['progress'] = join_progress(progress_list)
+        stats['shards'] = shard_stats_list
+        stats['router'] = {
+            'forwarded': list(self.router.forwarded_list),
+            'split': self.router.split_cnt,
+            'row_ranges': [list(entry[2:]) for entry in self.router.range_list],
+        }
+        stats_bytes = json.dumps(stats).encode('utf-8')
+        self.reply(envelope, b'\xff\x08\x00' + struct.pack('>I', len(stats_bytes)) + stats_bytes)
+
+    def join_parts(self):
+        # one csv like an unsharded server writes, from the part file of every shard
+        if not self.router.join_saves:
+            return True
+        save_path = self.router.setting.csv_save_path
+        shard_cnt = len(self.upstream_list)
+        # a shard that never saved has no part yet
+        missing_list = [shard for shard in range(0, shard_cnt)
+                        if not os.path.exists(get_part_path(save_path, shard, shard_cnt))]
+        if missing_list:
+            response_dict = self.ask_all({shard: b'\xff\x04' for shard in missing_list})
+            if any(frame[2] != 0x00 for frame in response_dict.values()):
+                return False
+        return self.router.merge_parts()
+
+class Router:
+    def __init__(self, setting_path='server_setting.json'):
+        self.setting_path = setting_path
+        # parses and checks the settings, the server itself is never started
+        self.setting = BackendServer(setting_path)
+        if not self.setting.csv_path:
+            log_error("router.py shards the csv_dir dataset, csv_dir is empty")
+            sys.exit(1)
+        self.response_timeout = 300.0
+        self.shard_proc_list = []
+        self.join_lock = threading.Lock()
+        self.last_join_time = None
+        self.client_cnt = 0
+        self.split_cnt = 0
+        if self.setting.shard_list:
+            # part files stay on the shards' machines
+            self.join_saves = False
+            self.shard_addr_list = []
+            for address in self.setting.shard_list:
+                host, port = address.rsplit(':', 1)
+                self.shard_addr_list.append((host, int(port)))
+        else:
+            self.join_saves = True
+            base_port = self.setting.shard_base_port or self.setting.port + 1
+            self.shard_addr_list = [('127.0.0.1', base_port + i) for i in range(0, self.setting.shard_cnt)]
+        self.forwarded_list = [0] * len(self.shard_addr_list)
+
+    def start_shards(self):
+        with open(self.setting_path, 'r') as setting_file:
+            setting_data = json.load(setting_file)
+        shard_dir = tempfile.mkdtemp(prefix='fitt_shards_')
+        shard_cnt = len(self.shard_addr_list)
+        for shard, (host, port) in enumerate(self.shard_addr_list):
+            shard_setting = dict(setting_data, host=host, port=port, shard_index=shard, shard_cnt=shard_cnt,
+                                 shard_list=[], dataset_dir="")
+            for key in ('stats_dump_path', 'trace_path'):
+                path = shard_setting.get(key)
+                if path:
+                    path_noext, ext = os.path.splitext(path)
+                    shard_setting[key] = f"{path_noext}.shard{shard}{ext}"
+            shard_setting_path = os.path.join(shard_dir, f'shard{shard}_setting.json')
+            with open(shard_setting_path, 'w') as setting_file:
+                json.dump(shard_setting, setting_file, indent=4)
+            log_file = open(os.path.join(shard_dir, f'shard{shard}.log'), 'w')
+            self.shard_proc_list.append(subprocess.Popen(
+                [sys.executable, os.path.join(ROOT_DIR, 'server.py'), shard_setting_path],
+                stdout=log_file, stderr=subprocess.STDOUT,
+            ))
+        atexit.register(self.stop_shards)
+        log_info(f"Started {shard_cnt} shards, logs in {shard_dir}")
+        for shard, (host, port) in enumerate(self.shard_addr_list):
+            self.wait_for_shard(shard, host, port)
+
+    def wait_for_shard(self, shard, host, port, timeout=300.0):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.shard_proc_list and self.shard_proc_list[shard].poll() is not None:
+                log_error(f"Shard {shard} exited, see its log")
+                sys.exit(1)
+            try:
+                socket.create_connection((host, port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        log_error(f"Shard {shard} at {host}:{port} did not start listening in time")
+        sys.exit(1)
+
+    def stop_shards(self):
+        for proc in self.shard_proc_list:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in self.shard_proc_list:
+            try:
+                proc.wait(5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    def load_clip_ranges(self):
+        # every shard reports the range it owns in its stats, checked to cover the dataset in order
+        self.range_list = []
+        for shard, address in enumerate(self.shard_addr_list):
+            with socket.create_connection(address) as sock:
+                sock.sendall(b'\xff\x08')
+                frame = read_response(sock)
+            shard_stats = json.loads(frame[7:].decode('utf-8')).get('shard')
+            if shard_stats is None or shard_stats['index'] != shard or shard_stats['cnt'] != len(self.shard_addr_list):
+                log_error(f"{address[0]}:{address[1]} is not shard {shard} of {len(self.shard_addr_list)}")
+                sys.exit(1)
+            clip_begin, clip_end = shard_stats['clips']
+            row_begin, row_end = shard_stats['rows']
+            if row_begin != (self.range_list[-1][3] if self.range_list else 0):
+                log_error(f"Shard {shard} starts at row {row_begin}, shards were started on different data")
+                sys.exit(1)
+            self.range_list.append((clip_begin, clip_end, row_begin, row_end))
+        self.row_end_list = [entry[3] for entry in self.range_list]
+        self.row_cnt = self.row_end_list[-1]
+        for shard, (clip_begin, clip_end, row_begin, row_end) in enumerate(self.range_list):
+            log_info(f"Shard {shard}: clips {clip_begin} to {clip_end - 1}, rows {row_begin} to {row_end - 1}")
+
+    def shard_range(self):
+        return range(0, len(self.shard_addr_list))
+
+    def get_owner(self, index):
+        return min(bisect.bisect_right(self.row_end_list, index), len(self.row_end_list) - 1)
+
+    def get_clip_owner(self, clip_index):
+        for shard, (clip_begin, clip_end, _, _) in enumerate(self.range_list):
+            if clip_begin <= clip_index < clip_end:
+                return shard
+        return 0
+
+    def split_clips(self, clip1, clip2):
+        # [(shard, first, last)] of clips clip1..clip2 each shard owns
+        part_list = []
+        for shard, (clip_begin, clip_end, _, _) in enumerate(self.range_list):
+            first, last = max(clip1, clip_begin), min(clip2, clip_end - 1)
+            if first <= last:
+                part_list.append((shard, first, last))
+        return part_list
+
+    def split_rows(self, index1, index2, stride=1):
+        # [(shard, first, last)] of rows index1, index1+stride, ... index2 each shard owns
+        part_list = []
+        for shard, (_, _, row_begin, row_end) in enumerate(self.range_list):
+            first = max(index1, row_begin)
+            if first > index1:
+                # next row of the stride inside this shard
+                first = index1 + -(-(first - index1) // stride) * stride
+            last = min(index2, row_end - 1)
+            if first <= last:
+                part_list.append((shard, first, first + (last - first) // stride * stride))
+        return part_list
+
+    def handle_client(self, conn, addr):
+        self.client_cnt += 1
+        try:
+            session = RouterSession(self, conn)
+        except OSError as e:
+            log_error(f"Cannot reach the shards for {addr}: {e}")
+            conn.close()
+            self.client_cnt -= 1
+            return
+        try:
+            session.run()
+        finally:
+            self.client_cnt -= 1
+            log_network(f"Client {addr} disconnected")
+
+    def merge_parts(self):
+        save_path = self.setting.csv_save_path
+        with self.join_lock:
+            try:
+                merge_parts(save_path, len(self.shard_addr_list))
+            except OSError as e:
+                log_error(f"Joining shard saves into {save_path} failed: {e}")
+                return False
+            self.last_join_time = time.time()
+        log_ok(f"Shard saves joined into {save_path}")
+        return True
+
+    def get_part_mtime_list(self):
+        # None while a shard has not saved yet
+        save_path = self.setting.csv_save_path
+        shard_cnt = len(self.shard_addr_list)
+        try:
+            return [os.path.getmtime(get_part_path(save_path, shard, shard_cnt)) for shard in range(0, shard_cnt)]
+        except OSError:
+            return None
+
+    def run_joiner(self):
+        # the shards autosave their parts, join them again once one changed
+        joined_mtime_list = self.get_part_mtime_list()
+        while True:
+            time.sleep(self.setting.autosave_policy.get_tick() * 2)
+            part_mtime_list = self.get_part_mtime_list()
+            if part_mtime_list is not None and part_mtime_list != joined_mtime_list:
+                joined_mtime_list = part_mtime_list
+                self.merge_parts()
+
+    def start(self):
+        # exit through atexit on SIGTERM too, so the shards are stopped
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        if self.join_saves:
+            self.start_shards()
+        else:
+            for shard, (host, port) in enumerate(self.shard_addr_list):
+                self.wait_for_shard(shard, host, port)
+        self.load_clip_ranges()
+        if self.join_saves and self.setting.autosave_policy.enabled():
+            threading.Thread(target=self.run_joiner, name='joiner', daemon=True).start()
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind((self.setting.host, self.setting.port))
+            s.listen()
+            log_network(f"Router listening on {self.setting.host}:{self.setting.port}")
+            while True:
+                conn, addr = s.accept()
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                log_network(f"Connected by {addr}")
+                threading.Thread(target=self.handle_client, args=(conn, addr), daemon=True).start()
+
+if __name__ == "__main__":
+    router = Router(sys.argv[1] if len(sys.argv) > 1 else 'server_setting.json')
+    router.start()
@@ -1,18 +1,65 @@
+import copy
+import hashlib
 import socket
 import threading
 import json
 import os
 import struct
 import sys
+import time
+import numpy as np
 import pandas as pd
 
+from server_metrics import ServerMetrics, MetricsDumper, CountingConnection, OPCODE_NAMES
+from tracing import Tracer
+from server_transcode import TranscodePool, FORMAT_LIST
+from server_dispatch import ResponseWriter, PendingTable, SendLock, TAGGED_OPCODE, CANCEL_OPCODE, PRIORITY_OPCODE
+from server_scheduler import PriorityScheduler, PRIORITY_INTERACTIVE, PRIORITY_NAMES
+from server_cache import ImageCache, ReadAheadWarmer
+from image_pack import PackReader, INDEX_NAME
+from server_datasets import DatasetRegistry, LIST_DATASETS_OPCODE, SELECT_DATASET_OPCODE
+from server_shards import split_clip_list, get_part_path
+from server_save import SaveWriter, AutosavePolicy, Autosaver, write_file_atomic
+from server_index import TagIndex, QUERY_OPCODE
+from server_progress import LabelProgress, PROGRESS_OPCODE
+
 default_setting = {
         "host": "0.0.0.0", # socket bind ip address
         "port": 52973, # socket bind port
-        "csv_dir": "data", # csv data dir for now. Will support folder in the future.
+        "csv_dir": "data", # csv file served to clients that do not pick a dataset, empty to only serve dataset_dir
+        "dataset_dir": "", # folder of dataset csv files clients can pick from, empty to serve only csv_dir
+        "dataset_memory_mb": 4096, # parsed datasets kept loaded, idle ones beyond this are saved and unloaded
+        "dataset_idle_s": 300, # seconds without clients before a dataset's unsaved changes are saved
+        "autosave_rows": 100, # save once this many rows changed since the last save, 0 to disable
+        "autosave_age_s": 60, # save once the oldest unsaved change is this old, 0 to disable
+        "autosave_idle_s": 5, # save once no change came for this long, 0 to disable
         "csv_save_dir": "data", # csv data save folder
         "meta_path": "meta.csv", # tag file location
         "save_to_same_file": False, # whether to save to the same file as source csv. ignore csv_save_dir if set to True.
+        "stats_dump_path": "", # append a JSON line of server metrics to this file, empty to disable
+        "stats_dump_interval": 10, # seconds between metrics dumps
+        "trace_path": "", # write a Chrome trace of every request to this file on exit, empty to disable
+        "profile_opcode": -1, # run cProfile around every request with this opcode, -1 to disable
+        "profile_path": "", # cProfile output, default profile_<opcode>.prof
+        "io_threads": 8, # threads serving tagged image requests for all clients
+        "max_pending_requests": 64, # tagged image requests per client on the I/O pool, further ones wait their turn
+        "starvation_ms": 500, # a prefetch or bulk image request waiting longer than this is served next
+        "bulk_share": 0.2, # share of the sent bytes bulk requests get while interactive ones wait
+        "pack_dir": "", # folder written by image_pack.py, images missing from the pack are read as loose files
+        "pack_serve": "mmap", # send packed images from a memory map ("mmap") or with the sendfile syscall ("sendfile")
+        "validator_hash": False, # image validators hash the file content instead of using size and mtime
+        "validator_ttl": 2, # seconds an image's size and mtime are trusted before it is checked again
+        "image_cache_mb": 0, # keep recently sent image files in memory, 0 to disable
+        "readahead": "off", # warm rows ahead of clients: "off", "cache" (into image cache) or "fadvise" (OS page cache)
+        "readahead_rows": 256, # rows read ahead of the last row each client requested
+        "readahead_mb_per_s": 50, # read-ahead bandwidth cap, 0 for no cap
+        "transcode_workers": 0, # processes for scaled image requests, 0 to transcode in the client thread
+        "transcode_queue_depth": 0, # transcodes in flight before requests wait, 0 for twice the workers
+        "transcode_transport": "shm", # how workers hand back results, "shm" or "file"
+        "shard_cnt": 1, # servers router.py splits the clips between, see server_shards.py
+        "shard_index": -1, # clip range this server owns as one of shard_cnt shards, -1 when not a shard
+        "shard_list": [], # "host:port" of shards started by hand, empty for router.py to start shard_cnt local ones
+        "shard_base_port": 0, # port of the first shard router.py starts, 0 for port + 1
         
         # "multi_cam": False # WIP
     }
@@ -69,6 +116,13 @@ def close_sock(sock):
             pass
         sock = None
 
+def safe_sendfile(conn,file,offset,count):
+    try:
+        conn.sendfile(file, offset, count)
+    except (socket.error, OSError) as e:
+        log_error(f"Error sending file: {str(e)}")
+        close_sock(conn)
+
 def safe_sendall(conn,data):
     try:
         conn.sendall(data)
@@ -117,13 +171,44 @@ class BackendServer:
             log_warn("Missing port in setting, using 52973 as default")
             self.port = 52973
         
-        # get input csv dir/path
+        # folder of datasets clients pick from, optional
+        try:
+            self.dataset_dir = setting_data["dataset_dir"]
+        except KeyError:
+            self.dataset_dir = ""
+        try:
+            self.dataset_memory_mb = float(setting_data["dataset_memory_mb"])
+        except KeyError:
+            self.dataset_memory_mb = 4096.0
+        try:
+            self.dataset_idle_s = max(float(setting_data["dataset_idle_s"]), 1.0)
+        except KeyError:
+            self.dataset_idle_s = 300.0
+        try:
+            autosave_rows = max(int(setting_data["autosave_rows"]), 0)
+        except KeyError:
+            autosave_rows = 100
+        try:
+            autosave_age_s = max(float(setting_data["autosave_age_s"]), 0.0)
+        except KeyError:
+            autosave_age_s = 60.0
+        try:
+            autosave_idle_s = max(float(setting_data["autosave_idle_s"]), 0.0)
+        except KeyError:
+            autosave_idle_s = 5.0
+        self.autosave_policy = AutosavePolicy(autosave_rows, autosave_age_s, autosave_idle_s)
+
+        # get input csv dir/path, may be empty when dataset_dir is set
         try:
             self.csv_dir = setting_data["csv_dir"] # placeholder as folder
             self.csv_path = setting_data["csv_dir"] # input csv file
         except KeyError:
+            self.csv_dir = self.csv_path = ""
+        if not self.csv_path and not self.dataset_dir:
             log_error("Missing csv_dir!")
             sys.exit(1)
+        # build_csv reads rows from here, the saved copy when a dataset is reloaded
+        self.csv_read_path = self.csv_path
 
         # get tag csv path
         try:
@@ -144,6 +229,142 @@ class BackendServer:
             log_warn("Missing save_to_same_file in setting, using False as default")
             self.save_to_same_file = False
         
+        # periodic metrics dump, optional
+        try:
+            self.stats_dump_path = setting_data["stats_dump_path"]
+        except KeyError:
+            self.stats_dump_path = ""
+        try:
+            self.stats_dump_interval = float(setting_data["stats_dump_interval"])
+        except KeyError:
+            self.stats_dump_interval = 10.0
+
+        # tracing and profiling, optional
+        try:
+            self.trace_path = setting_data["trace_path"]
+        except KeyError:
+            self.trace_path = ""
+        try:
+            self.profile_opcode = int(setting_data["profile_opcode"])
+        except KeyError:
+            self.profile_opcode = -1
+        try:
+            self.profile_path = setting_data["profile_path"]
+        except KeyError:
+            self.profile_path = ""
+        self.tracer = Tracer(self.trace_path, self.profile_opcode, self.profile_path, 'server')
+        if self.trace_path:
+            log_info(f"Tracing requests to {self.trace_path}")
+        if self.profile_opcode >= 0:
+            log_info(f"Profiling opcode {self.profile_opcode:#04x} to {self.tracer.profile_path}")
+
+        # out of order request handling
+        try:
+            self.io_threads = max(1, int(setting_data["io_threads"]))
+        except KeyError:
+            self.io_threads = 8
+        try:
+            self.max_pending_requests = max(1, int(setting_data["max_pending_requests"]))
+        except KeyError:
+            self.max_pending_requests = 64
+        try:
+            self.starvation_ms = float(setting_data["starvation_ms"])
+        except KeyError:
+            self.starvation_ms = 500
+        try:
+            self.bulk_share = min(1.0, max(0.0, float(setting_data["bulk_share"])))
+        except KeyError:
+            self.bulk_share = 0.2
+
+        # image pack, optional
+        try:
+            self.pack_dir = setting_data["pack_dir"]
+        except KeyError:
+            self.pack_dir = ""
+        try:
+            self.pack_serve = str(setting_data["pack_serve"]).strip().lower()
+        except KeyError:
+            self.pack_serve = "mmap"
+        if self.pack_serve not in ('mmap', 'sendfile'):
+            log_warn(f"Unknown pack_serve {self.pack_serve}, using mmap")
+            self.pack_serve = "mmap"
+
+        # image validators
+        try:
+            validator_hash_str = str(setting_data["validator_hash"]).strip().lower()
+            self.validator_hash = validator_hash_str == 'true' or validator_hash_str == '1'
+        except KeyError:
+            self.validator_hash = False
+        try:
+            self.validator_ttl = float(setting_data["validator_ttl"])
+        except KeyError:
+            self.validator_ttl = 2.0
+
+        # image cache and read-ahead, optional
+        try:
+            self.image_cache_mb = float(setting_data["image_cache_mb"])
+        except KeyError:
+            self.image_cache_mb = 0
+        try:
+            self.readahead = str(setting_data["readahead"]).strip().lower()
+        except KeyError:
+            self.readahead = "off"
+        if self.readahead not in ('off', 'cache', 'fadvise'):
+            log_warn(f"Unknown readahead {self.readahead}, read-ahead disabled")
+            self.readahead = "off"
+        if self.readahead == 'cache' and self.image_cache_mb <= 0:
+            log_warn("readahead is cache but image_cache_mb is 0, using fadvise instead")
+            self.readahead = "fadvise"
+        if self.readahead == 'fadvise' and not hasattr(os, 'posix_fadvise'):
+            log_warn("posix_fadvise is not available on this platform, read-ahead disabled")
+            self.readahead = "off"
+        try:
+            self.readahead_rows = int(setting_data["readahead_rows"])
+        except KeyError:
+            self.readahead_rows = 256
+        try:
+            self.readahead_mb_per_s = float(setting_data["readahead_mb_per_s"])
+        except KeyError:
+            self.readahead_mb_per_s = 50
+
+        # transcoding pool, optional
+        try:
+            self.transcode_workers = int(setting_data["transcode_workers"])
+        except KeyError:
+            self.transcode_workers = 0
+        try:
+            self.transcode_queue_depth = int(setting_data["transcode_queue_depth"])
+        except KeyError:
+            self.transcode_queue_depth = 0
+        try:
+            self.transcode_transport = setting_data["transcode_transport"]
+            if self.transcode_transport not in ('shm', 'file'):
+                log_warn(f"Unknown transcode_transport {self.transcode_transport}, using shm")
+                self.transcode_transport = 'shm'
+        except KeyError:
+            self.transcode_transport = 'shm'
+
+        # clip range sharding, optional
+        try:
+            self.shard_cnt = max(int(setting_data["shard_cnt"]), 1)
+        except KeyError:
+            self.shard_cnt = 1
+        try:
+            self.shard_index = int(setting_data["shard_index"])
+        except KeyError:
+            self.shard_index = -1
+        if self.shard_index >= self.shard_cnt:
+            log_error(f"shard_index {self.shard_index} is not below shard_cnt {self.shard_cnt}")
+            sys.exit(1)
+        try:
+            self.shard_list = list(setting_data["shard_list"])
+        except KeyError:
+            self.shard_list = []
+        try:
+            self.shard_base_port = int(setting_data["shard_base_port"])
+        except KeyError:
+            self.shard_base_port = 0
+
         # check if multicam support
         # try: 
         #     self.multi_cam = setting_data["multi_cam"]
@@ -155,23 +376,29 @@ class BackendServer:
         if self.save_to_same_file == False:
             try:
                 self.csv_save_dir = setting_data["csv_save_dir"]
-                # get input csv file name
-                csv_filename = os.path.basename(self.csv_path)
-                csv_filename_noext, _ =os.path.splitext(csv_filename)
-                self.csv_save_path = f"{self.csv_save_dir}/{csv_filename_noext}__labelled__.csv"
-
             except KeyError:
                 log_error("Missing csv_save_dir!")
                 sys.exit()
-        else:
-            self.csv_save_path = self.csv_path
-            self.csv_save_dir = os.path.dirname(self.csv_path) or '.'
+        self.configure_save_path()
                     
         write_status = self.is_writeable()
         if write_status == False:
             log_error('Error: Closing server due to cannot write to specified output file')
             sys.exit()
             
+    def configure_save_path(self):
+        if self.save_to_same_file == False:
+            # get input csv file name
+            csv_filename = os.path.basename(self.csv_path)
+            csv_filename_noext, _ =os.path.splitext(csv_filename)
+            self.csv_save_path = f"{self.csv_save_dir}/{csv_filename_noext}__labelled__.csv"
+        else:
+            self.csv_save_path = self.csv_path
+            self.csv_save_dir = os.path.dirname(self.csv_path) or '.'
+        if self.shard_index >= 0:
+            # router.py joins the parts of all shards into the csv_save_path above
+            self.csv_save_path = get_part_path(self.csv_save_path, self.shard_index, self.shard_cnt)
+
     def is_writeable(self):
         # create if does not exist
         if os.path.exists(self.csv_save_dir)==False:
@@ -203,7 +430,7 @@ class BackendServer:
 
     def build_csv(self):
         # handle data csv
-        self.data_csv = pd.read_csv(self.csv_path)
+        self.data_csv = pd.read_csv(self.csv_read_path)
         log_ok(f"Data CSV loaded with size of {len(self.data_csv)}")
         
         self.data_column_list = self.data_csv.columns.tolist()
@@ -243,6 +470,11 @@ class BackendServer:
         
         # get camera cnt - this will now work with the reordered data
         self.get_data_clip_list()
+
+        # tag bitmaps and progress counters, kept up to date by update_tag_bulk
+        state_array_list = self.get_tag_state_array_list()
+        self.build_tag_index(state_array_list)
+        self.build_progress(state_array_list)
     
     def get_meta_entry_code(self):
         # get meta code entry
@@ -370,6 +602,8 @@ class BackendServer:
         self.get_clip_id_entry()
         if self.data_entry_clip == -1:
             log_warn("No clip_id found in data column!")
+            self.data_entry_cam = -1
+            self.clip_cnt = 0
             return
         
         log_ok(f"clip_id is at {self.data_entry_clip}")
@@ -457,22 +691,199 @@ class BackendServer:
         # log_ok(f'{cam_cnt} found and verified')
         return cam_cnt
         
-    def save_csv(self):
-        df = pd.DataFrame(self.data_list, columns=self.data_column_list)
+    def save_csv(self, timeout=None):
+        # blocks until the rows are on disk, see server_save.py
+        return self.save_writer.save(timeout)
+
+    def write_csv(self):
+        # runs on the save writer thread
+        start_time = time.perf_counter()
+        with self.data_lock:
+            # rows are changed in place, copy them so the snapshot stays consistent
+            row_list = [list(row) for row in self.data_list[self.row_begin:self.row_end]]
+            saved_rows = self.dirty_rows
+            self.dirty_rows = set()
+            first_dirty_time = self.first_dirty_time
+            self.first_dirty_time = None
 
+        success = False
         if self.is_writeable() == True:
-            df.to_csv(f"{self.csv_save_path}", index=False)
+            try:
+                with self.tracer.span('save_csv', 'io', rows=len(row_list)):
+                    df = pd.DataFrame(row_list, columns=self.data_column_list)
+                    write_file_atomic(self.csv_save_path, lambda out_file: df.to_csv(out_file, index=False))
+                success = True
+            except OSError as e:
+                log_error(f'Error: writing {self.csv_save_path} failed with error {e}')
+        if success:
             log_ok(f"File saved to: {self.csv_save_path}")
+            self.last_save_time = time.time()
+            self.last_save_failed_time = None
+            self.metrics.record_save((time.perf_counter() - start_time) * 1000, True)
             return True
         else:
+            with self.data_lock:
+                self.dirty_rows |= saved_rows
+                # the changes since keep counting from the oldest unsaved one
+                if saved_rows and first_dirty_time is not None:
+                    self.first_dirty_time = first_dirty_time
+            self.last_save_failed_time = time.monotonic()
+            self.metrics.record_save((time.perf_counter() - start_time) * 1000, False)
             log_warn('You break something and now the server cannot write to the specified output file.')
             log_warn('The server will not stop, but you probably want to resolve this if you don\'t want to lose your work.')
             log_warn('Retry saving once you resolved the problem.')
             return False
+
+    def get_stats(self):
+        stats = self.metrics.snapshot(dirty_rows=len(self.dirty_rows))
+        if self.image_cache is not None:
+            stats['image_cache'] = {
+                'entries': len(self.image_cache.entry_dict),
+                'used_mb': self.image_cache.used_bytes / 1e6,
+                'budget_mb': self.image_cache.budget_bytes / 1e6,
+            }
+        stats['scheduler'] = self.scheduler.snapshot()
+        stats['save_writer'] = self.save_writer.snapshot()
+        with self.data_lock:
+            stats['progress'] = self.progress.snapshot()
+        # of this dataset, 'save' counts the saves of every dataset
+        stats['autosave'] = {
+            'dirty_rows': len(self.dirty_rows),
+            'oldest_change_s': time.monotonic() - self.first_dirty_time if self.first_dirty_time is not None else None,
+            'last_save_time': self.last_save_time,
+            'max_rows': self.autosave_policy.max_rows,
+            'max_age_s': self.autosave_policy.max_age_s,
+            'idle_s': self.autosave_policy.idle_s,
+        }
+        stats['datasets'] = self.registry.snapshot()
+        if self.shard_index >= 0:
+            stats['shard'] = {
+                'index': self.shard_index,
+                'cnt': self.shard_cnt,
+                'clips': [self.clip_begin, self.clip_end],
+                'rows': [self.row_begin, self.row_end],
+            }
+        if self.warmer is not None:
+            stats['readahead'] = {
+                'mode': self.warmer.mode,
+                'rows': self.warmer.warmed_cnt,
+                'mb': self.warmer.warmed_bytes / 1e6,
+            }
+        return stats
             
     
-    def start(self):
+    def open_dataset(self, name, csv_path, read_path=None):
+        # a view of this server bound to another csv, sharing settings, metrics,
+        # scheduler and transcode pool. Parsed by load_dataset
+        dataset = copy.copy(self)
+        dataset.csv_path = csv_path
+        dataset.csv_read_path = read_path or csv_path
+        dataset.configure_save_path()
+        if self.pack_dir:
+            dataset.pack_dir = os.path.join(self.pack_dir, name)
+        dataset.init_dataset_state()
+        return dataset
+
+    def load_dataset(self):
+        self.load_time = time.time()
         self.build_csv()
+        # names this dataset on this machine in client disk caches
+        self.server_id = hashlib.sha1(
+            f'{socket.gethostname()}:{os.path.abspath(self.csv_path)}'.encode('utf-8')
+        ).hexdigest()[0:16]
+        # (size, mtime_ns, etag, checked time) per row, see get_row_validator
+        self.row_validator_list = [None] * self.data_cnt
+        # rows this server saves, the clip range of its shard
+        self.clip_begin, self.clip_end, self.row_begin, self.row_end = 0, self.clip_cnt, 0, self.data_cnt
+        if self.shard_index >= 0:
+            self.clip_begin, self.clip_end, self.row_begin, self.row_end = \
+                split_clip_list(self.data_clip_list, self.shard_cnt, self.data_cnt)[self.shard_index]
+            log_info(f"Shard {self.shard_index} of {self.shard_cnt}: clips {self.clip_begin} to {self.clip_end - 1}, "
+                     f"rows {self.row_begin} to {self.row_end - 1}")
+            # the router adds up the progress of every shard
+            self.progress.set_clip_range(self.clip_begin, self.clip_end)
+        if self.pack_dir and os.path.exists(os.path.join(self.pack_dir, INDEX_NAME)):
+            try:
+                self.image_pack = PackReader(self.pack_dir)
+                log_ok(f"Serving {len(self.image_pack.entry_dict)} packed images from {self.pack_dir} ({self.pack_serve})")
+            except (OSError, ValueError) as e:
+                log_warn(f"Cannot open image pack {self.pack_dir}: {e}, serving loose files")
+        elif self.pack_dir:
+            log_warn(f"No image pack in {self.pack_dir}, serving loose files")
+        if self.image_cache_mb > 0:
+            self.image_cache = ImageCache(int(self.image_cache_mb * 1e6))
+        if self.readahead != 'off':
+            log_info(f"Reading {self.readahead_rows} rows ahead of clients into {self.readahead}")
+            self.warmer = ReadAheadWarmer(self, self.readahead, self.readahead_rows, self.readahead_mb_per_s, log_warn)
+            self.warmer.start()
+        self.memory_bytes = self.estimate_memory_bytes()
+
+    def unload_dataset(self):
+        # requests still running keep their rows until they finish
+        self.save_writer.stop()
+        if self.warmer is not None:
+            self.warmer.stop()
+
+    def get_tag_state_array_list(self):
+        # a row has a tag when its cell is True or 1, like the client reads it
+        return [
+            np.array([row[entry] for row in self.data_list], dtype=object) == True
+            for entry in self.data_tag_entry_list
+        ]
+
+    def build_tag_index(self, state_array_list):
+        self.tag_index = TagIndex(state_array_list, self.data_cnt)
+        log_info(f"Tag index of {self.tag_cnt} tags built, {self.tag_index.get_memory_bytes() / 1e6:.1f} MB")
+
+    def build_progress(self, state_array_list):
+        row_cam_array, cam_name_list = None, None
+        if self.data_entry_cam != -1:
+            row_cam_array, cam_name_list = pd.factorize(pd.Series([row[self.data_entry_cam] for row in self.data_list]))
+            cam_name_list = [str(name) for name in cam_name_list]
+            # rows without a camera name
+            if (row_cam_array < 0).any():
+                row_cam_array[row_cam_array < 0] = len(cam_name_list)
+                cam_name_list.append('')
+        self.progress = LabelProgress(state_array_list, self.data_clip_list, row_cam_array, cam_name_list, self.data_cnt)
+        log_info(f"Progress of {self.clip_cnt} clips counted, {self.progress.total_labeled_frames} of "
+                 f"{self.progress.total_frames} frames labeled")
+
+    def estimate_memory_bytes(self):
+        # the DataFrame plus data_list, whose rows share the DataFrame's strings
+        # but box every number and add a list per row, the tag index and progress counters
+        return int(self.data_csv.memory_usage(deep=True).sum()) + \
+            self.data_cnt * (56 + 32 * len(self.data_column_list)) + \
+            self.tag_index.get_memory_bytes() + self.progress.get_memory_bytes()
+
+    def get_memory_bytes(self):
+        size = self.memory_bytes
+        if self.image_cache is not None:
+            size += self.image_cache.used_bytes
+        return size
+
+    def start(self):
+        self.scheduler = PriorityScheduler(self.io_threads, self.starvation_ms, self.bulk_share)
+        self.registry = DatasetRegistry(
+            self, self.dataset_dir, self.dataset_memory_mb, self.dataset_idle_s, log_info, log_warn
+        )
+        if self.csv_path:
+            self.load_dataset()
+            self.registry.add_loaded(os.path.splitext(os.path.basename(self.csv_path))[0], self)
+        else:
+            self.registry.scan()
+        log_info(f"Serving {len(self.registry.entry_dict)} datasets, default {self.registry.default_name}")
+        self.registry.start()
+        if self.autosave_policy.enabled():
+            Autosaver(self.registry, self.autosave_policy, log_warn).start()
+        self.transcode_pool = TranscodePool(
+            self.transcode_workers, self.transcode_queue_depth, self.transcode_transport
+        )
+        if self.transcode_workers > 0:
+            log_info(f"Transcoding with {self.transcode_workers} processes, "
+                     f"queue depth {self.transcode_pool.queue_depth}, {self.transcode_transport} transport")
+        if self.stats_dump_path:
+            log_info(f"Dumping metrics to {self.stats_dump_path} every {self.stats_dump_interval}s")
+            MetricsDumper(self, self.stats_dump_path, self.stats_dump_interval, log_warn).start()
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             s.bind((self.host, self.port))
@@ -481,6 +892,8 @@ class BackendServer:
 
             while True:
                 conn, addr = s.accept()
+                # responses are written in several small pieces
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 log_network(f"Connected by {addr}")
                 client_thread = threading.Thread(
                     target=self.handle_client, 
@@ -503,10 +916,27 @@ class BackendServer:
         return bytes(data)
     
     def handle_client(self, conn, addr):
+        conn = CountingConnection(conn)
+        self.metrics.client_connected()
+        # serializes response frames of the reader and the I/O pool threads
+        send_lock = SendLock()
+        # tracks the tagged image requests of this client until they finish, so a
+        # cancel can skip them, and bounds how many of them the pool holds
+        pending_table = PendingTable(self.max_pending_requests)
+        # one timeout for the whole connection, switching the socket between
+        # blocking and timeout mode races with the I/O threads sending on it
+        conn.settimeout(30.0)
+        # the dataset this client works on, the default until it selects one
+        dataset_name = None
+        dataset = None
         try:
             while True:
-                conn.settimeout(None)
-                init_char = conn.recv(1)
+                bytes_in = conn.bytes_in
+                try:
+                    init_char = conn.recv(1)
+                except socket.timeout:
+                    # idle client
+                    continue
                 if not init_char: break
                 else:
                     verifier = struct.unpack('B', init_char)[0]
@@ -516,34 +946,280 @@ class BackendServer:
                 
                 log_network("Header matched, reading socket message")
                 cmd = struct.unpack('B', self.safe_recv(conn,1))[0]
-                
-                # req image
-                if cmd == 0x01: 
-                    self.handle_image_req(conn)
-                # req csv tag
-                elif cmd == 0x02:  
-                    self.handle_tag_req(conn)
-                elif cmd == 0x03:  # req csv change
-                    self.handle_csv_change_req(conn)
-                elif cmd == 0x04:  # save
-                    self.handle_save_req(conn)
-                elif cmd == 0x05:  # camera count
-                    self.handle_clip_req(conn)
-                elif cmd == 0x06:  # req partial csv data
-                    self.handle_partial_csv_req(conn)
-                else:
-                    log_warn(f"Unknown cmd byte {cmd}. Maybe check version?")
+                start_time = time.perf_counter()
+
+                req_id = None
+                priority = PRIORITY_INTERACTIVE
+                if cmd == PRIORITY_OPCODE:
+                    priority, req_id, verifier, cmd = struct.unpack('>BIBB', self.safe_recv(conn,7))
+                    priority = min(priority, len(PRIORITY_NAMES) - 1)
+                elif cmd == TAGGED_OPCODE:
+                    req_id, verifier, cmd = struct.unpack('>IBB', self.safe_recv(conn,6))
+                if req_id is not None and verifier != 0xFF:
+                    log_network(f"Bad byte of {verifier} in tagged request {req_id}, dropping request")
+                    continue
+                writer = ResponseWriter(conn, send_lock, req_id)
+
+                if dataset is None and cmd not in (LIST_DATASETS_OPCODE, SELECT_DATASET_OPCODE):
+                    dataset_name = self.registry.default_name
+                    try:
+                        dataset = self.registry.acquire(dataset_name)
+                    except (Exception, SystemExit) as e:
+                        log_error(f"Default dataset {dataset_name} failed to load: {e}")
+                    if dataset is None:
+                        log_warn(f"No dataset to serve {addr}, closing connection")
+                        break
+
+                # tagged disk bound requests complete out of order on the I/O pool,
+                # everything else is answered inline in request order
+                if req_id is not None and dataset is not None and cmd in dataset.async_request_dict:
+                    parse, handle = dataset.async_request_dict[cmd]
+                    args = parse(conn)
+                    entry = pending_table.add(req_id, args[0])
+                    writer.urgent = False
+                    # past the limit the request is parked, the reader goes on to tag changes and saves
+                    job = (
+                        priority, dataset.run_async_request, writer, cmd, handle, args, conn.bytes_in - bytes_in,
+                        start_time, pending_table, entry, priority
+                    )
+                    if pending_table.admit(job):
+                        self.scheduler.submit(*job)
+                    continue
+
+                with self.tracer.span(f'handle_{OPCODE_NAMES.get(cmd, "unknown")}', 'server', cmd=cmd), \
+                        self.tracer.profile(cmd):
+                    try:
+                        if cmd == CANCEL_OPCODE:
+                            dataset.handle_cancel_req(writer, pending_table)
+                        elif cmd == LIST_DATASETS_OPCODE:
+                            self.handle_list_datasets_req(writer)
+                        elif cmd == SELECT_DATASET_OPCODE:
+                            dataset_name, dataset = self.handle_select_dataset_req(writer, dataset_name, dataset)
+                        else:
+                            dataset.dispatch_request(writer, cmd)
+                    finally:
+                        writer.finish()
+
+                self.metrics.record_request(
+                    cmd, conn.bytes_in - bytes_in, writer.bytes_out,
+                    (time.perf_counter() - start_time) * 1000
+                )
                     
         except ConnectionResetError:
             log_network(f"Client {addr} disconnected")
         finally:
+            if dataset is not None:
+                self.release_dataset(dataset_name, dataset)
+            self.metrics.client_disconnected()
             conn.close()
 
-    def handle_image_req(self,conn):
+    def run_async_request(self, writer, cmd, handle, args, bytes_in, start_time, pending_table, entry, priority):
+        # runs on a scheduler worker, errors are logged since nobody waits for the result.
+        # returns the bytes sent, which the scheduler counts per priority class
+        if not pending_table.start(entry):
+            # cancelled while queued, the cancel response already told the client
+            self.release_pending_slot(pending_table)
+            return 0
+        self.metrics.record_queue_wait(PRIORITY_NAMES[priority], (time.perf_counter() - start_time) * 1000)
+        try:
+            with self.tracer.span(f'handle_{OPCODE_NAMES.get(cmd, "unknown")}', 'server', cmd=cmd), \
+                    self.tracer.profile(cmd):
+                handle(writer, *args)
+        except Exception as e:
+            log_error(f"Request {cmd:#04x} failed: {e}")
+        finally:
+            writer.finish()
+            self.release_pending_slot(pending_table)
+        if pending_table.finish(entry):
+            # a frame cannot be cut short without breaking the stream, it was sent in full
+            self.metrics.record_wasted(writer.bytes_out)
+        self.metrics.record_request(cmd, bytes_in, writer.bytes_out, (time.perf_counter() - start_time) * 1000)
+        return writer.bytes_out
+
+    def release_pending_slot(self, pending_table):
+        # hands the slot of a finished request to the next parked one
+        job = pending_table.release()
+        if job is not None:
+            self.scheduler.submit(*job)
+
+    def handle_cancel_req(self, conn, pending_table):
+        mode, value = struct.unpack('>BI', self.safe_recv(conn,5))
+        if mode == 0:
+            # value request ids follow
+            req_id_list = list(struct.unpack(f'>{value}I', self.safe_recv(conn,4*value)))
+            skipped_list = pending_table.cancel(req_id_list=req_id_list)
+        else:
+            # rows value..index2
+            index2 = struct.unpack('>I', self.safe_recv(conn,4))[0]
+            skipped_list = pending_table.cancel(index1=value, index2=index2)
+        log_network(f'Cancelled {len(skipped_list)} queued requests')
+        # bytes that were not read or sent, rows of unknown size are counted apart
+        skipped_bytes = 0
+        unsized_cnt = 0
+        for entry in skipped_list:
+            size = self.get_known_image_size(entry.index)
+            if size is None:
+                unsized_cnt += 1
+            else:
+                skipped_bytes += size
+        self.metrics.record_cancel(len(skipped_list), skipped_bytes, unsized_cnt)
+        safe_sendall(conn, b'\xff\x0e\x00' + struct.pack(f'>I{len(skipped_list)}I', len(skipped_list),
+                                                       *[entry.req_id for entry in skipped_list]))
+
+    def get_known_image_size(self, index):
+        # size of the image file from what is at hand without touching the disk:
+        # the validator, the pack index or the image cache. None when unknown
+        if not 0 <= index < self.data_cnt:
+            return None
+        if self.row_validator_list[index] is not None:
+            return self.row_validator_list[index][0]
+        if self.image_pack is not None:
+            pack_entry = self.image_pack.lookup(self.data_list[index][self.data_entry_file_path])
+            if pack_entry is not None:
+                return pack_entry[2]
+        if self.image_cache is not None:
+            return self.image_cache.get_size(index)
+        return None
+
+    def handle_list_datasets_req(self,conn):
+        log_network('Received request for dataset list')
+        list_bytes = json.dumps(self.registry.list_datasets()).encode('utf-8')
+        safe_sendall(conn,b'\xff\x10\x00' + struct.pack('>I', len(list_bytes)) + list_bytes)
+
+    def handle_select_dataset_req(self, conn, old_name, old_dataset):
+        # returns the (name, dataset) the connection works on afterwards
+        name_size = struct.unpack('>H', self.safe_recv(conn,2))[0]
+        name = self.safe_recv(conn,name_size).decode('utf-8', errors='replace')
+        log_network(f'Received request selecting dataset {name}')
+        try:
+            dataset = self.registry.acquire(name)
+        except (Exception, SystemExit) as e:
+            log_error(f"Dataset {name} failed to load: {e}")
+            safe_sendall(conn,b'\xff\x11\x02')
+            return old_name, old_dataset
+        if dataset is None:
+            log_warn(f"Client selected unknown dataset {name}")
+            safe_sendall(conn,b'\xff\x11\x01')
+            return old_name, old_dataset
+        if old_dataset is not None:
+            self.release_dataset(old_name, old_dataset)
+        safe_sendall(conn,b'\xff\x11\x00')
+        return name, dataset
+
+    def release_dataset(self, name, dataset):
+        if dataset.warmer is not None:
+            dataset.warmer.forget_client()
+        self.registry.release(name)
+
+    def dispatch_request(self, conn, cmd):
+        # req image
+        if cmd == 0x01: 
+            self.handle_image_req(conn)
+        # req csv tag
+        elif cmd == 0x02:  
+            self.handle_tag_req(conn)
+        elif cmd == 0x03:  # req csv change
+            self.handle_csv_change_req(conn)
+        elif cmd == 0x04:  # save
+            self.handle_save_req(conn)
+        elif cmd == 0x05:  # camera count
+            self.handle_clip_req(conn)
+        elif cmd == 0x06:  # req partial csv data
+            self.handle_partial_csv_req(conn)
+        elif cmd == 0x07:  # req bulk csv change
+            self.handle_csv_bulk_change_req(conn)
+        elif cmd == 0x08:  # req server stats
+            self.handle_stats_req(conn)
+        elif cmd == 0x09:  # req scaled image
+            self.handle_scaled_image_req(conn)
+        elif cmd == 0x0B:  # req row paths and versions
+            self.handle_row_version_req(conn)
+        elif cmd == 0x0C:  # req image unless the client's copy is current
+            self.handle_conditional_image_req(conn)
+        elif cmd == 0x0D:  # req validators of a range or clip
+            self.handle_validator_req(conn)
+        elif cmd == QUERY_OPCODE:  # req rows matching a tag query
+            self.handle_query_req(conn)
+        elif cmd == PROGRESS_OPCODE:  # req labeling progress of clips
+            self.handle_progress_req(conn)
+        else:
+            log_warn(f"Unknown cmd byte {cmd}. Maybe check version?")
+
+    def parse_image_req(self,conn):
         data = self.safe_recv(conn,4)
         index = struct.unpack('>I', data)[0]
         log_network(f'Received request for image {index}')
-        self.send_image(conn, index)
+        if self.warmer is not None and 0 <= index < self.data_cnt:
+            self.warmer.note_request(index)
+        return (index,)
+
+    def handle_image_req(self,conn):
+        self.send_image(conn, *self.parse_image_req(conn))
+
+    def parse_scaled_image_req(self,conn):
+        data = self.safe_recv(conn,10)
+        index, max_width, max_height, format_index, quality = struct.unpack('>IHHBB', data)
+        log_network(f'Received request for image {index} scaled to {max_width}x{max_height}')
+        return (index, max_width, max_height, format_index, quality)
+
+    def handle_scaled_image_req(self,conn):
+        self.send_scaled_image(conn, *self.parse_scaled_image_req(conn))
+
+    def handle_row_version_req(self,conn):
+        index1, index2 = struct.unpack('>II', self.safe_recv(conn,8))
+        log_network(f'Received request for row versions from index {index1} to {index2}')
+        self.send_row_version(conn, index1, index2)
+
+    def parse_conditional_image_req(self,conn):
+        index, etag = struct.unpack('>IQ', self.safe_recv(conn,12))
+        log_network(f'Received conditional request for image {index}')
+        if self.warmer is not None and 0 <= index < self.data_cnt:
+            self.warmer.note_request(index)
+        return (index, etag)
+
+    def handle_conditional_image_req(self,conn):
+        self.send_conditional_image(conn, *self.parse_conditional_image_req(conn))
+
+    def handle_query_req(self,conn):
+        mode, index1, index2, start, program_size = struct.unpack('>BIIIH', self.safe_recv(conn,15))
+        program = self.safe_recv(conn,program_size) if program_size else b''
+        log_network(f'Received tag query mode {mode} over rows {index1} to {index2} from {start}')
+        try:
+            with self.data_lock:
+                match_cnt, run_list = self.tag_index.query(mode, program, index1, index2, start)
+        except ValueError as e:
+            log_error(f"Bad tag query: {e}")
+            safe_sendall(conn,b'\xff\x12\x01' + struct.pack('>II', 0, 0))
+            return
+        safe_sendall(conn,b'\xff\x12\x00' + struct.pack('>II', match_cnt, len(run_list)) + b''.join(
+            struct.pack('>II', first, last) for first, last in run_list
+        ))
+
+    def handle_progress_req(self,conn):
+        clip1, clip2 = struct.unpack('>II', self.safe_recv(conn,8))
+        log_network(f'Received request for progress of clips {clip1} to {clip2}')
+        try:
+            with self.data_lock:
+                clip_progress_list = self.progress.get_clip_progress(clip1, clip2)
+        except ValueError as e:
+            log_error(f"Bad progress request: {e}")
+            safe_sendall(conn,b'\xff\x13\x01' + struct.pack('>I', 0))
+            return
+        safe_sendall(conn,b'\xff\x13\x00' + struct.pack('>I', len(clip_progress_list)) + b''.join(
+            struct.pack('>IIII', *clip_progress) for clip_progress in clip_progress_list
+        ))
+
+    def handle_validator_req(self,conn):
+        mode, value1, value2 = struct.unpack('>BII', self.safe_recv(conn,9))
+        if mode == 1:
+            # whole clip value1
+            if value1 < self.clip_cnt:
+                clip = self.data_clip_list[value1]
+                value1, value2 = clip['begin'], clip['end'] - 1
+            else:
+                value1, value2 = 1, 0
+        log_network(f'Received request for validators from index {value1} to {value2}')
+        self.send_validators(conn, value1, value2)
 
     def handle_tag_req(self,conn):
         log_network(f'Received request for CSV tag name')
@@ -566,15 +1242,44 @@ class BackendServer:
         log_network(f'Received request for CSV change, from index {index1} to {index2}')
         self.update_tag(conn, index1, index2, csv_data_slice)
         safe_sendall(conn,b'\xff\x03\x00')
+
+    def handle_csv_bulk_change_req(self,conn):
+        data = self.safe_recv(conn,8)
+        segment_cnt, tag_index_cnt = struct.unpack('>II', data)
+        segment_list = []
+        for i in range(0,segment_cnt):
+            index1, index2, stride = struct.unpack('>III', self.safe_recv(conn,12))
+            csv_data_slice = [byte == 1 for byte in self.safe_recv(conn,tag_index_cnt)]
+            segment_list.append((index1, index2, stride, csv_data_slice))
+
+        log_network(f'Received request for bulk CSV change with {segment_cnt} segments')
+        row_cnt = self.update_tag_bulk(segment_list)
+        if row_cnt is None:
+            safe_sendall(conn,b'\xff\x07\x01' + struct.pack('>I', 0))
+        else:
+            # acked once applied, saved by the autosave policy like any change
+            safe_sendall(conn,b'\xff\x07\x00' + struct.pack('>I', row_cnt))
     
     def handle_save_req(self,conn):
         log_network('Received request saving')  
-        # save
-        if self.save_csv():
-            safe_sendall(conn,b'\xff\x04\x00')  
+        if getattr(conn, 'req_id', None) is not None:
+            # tagged, answered out of order once the write finished while the reader goes on
+            self.save_writer.request(lambda success: self.send_save_ack(ResponseWriter(conn.conn, conn.send_lock, conn.req_id), success))
         else:
-            safe_sendall(conn,b'\xff\x04\x01')  
+            self.send_save_ack(conn, self.save_csv())
+
+    def send_save_ack(self, conn, success):
+        try:
+            safe_sendall(conn,b'\xff\x04\x00' if success else b'\xff\x04\x01')
+        finally:
+            if isinstance(conn, ResponseWriter):
+                conn.finish()
     
+    def handle_stats_req(self,conn):
+        log_network('Received request for server stats')
+        stats_bytes = json.dumps(self.get_stats()).encode('utf-8')
+        safe_sendall(conn,b'\xff\x08\x00' + struct.pack('>I', len(stats_bytes)) + stats_bytes)
+
     def handle_clip_req(self,conn):
         # data = self.safe_recv(conn,4)
         # index = struct.unpack('>I', data)[0]
@@ -603,16 +1308,8 @@ class BackendServer:
         log_info(f'request received sending image {index} with path {image_path}')
         
         try:
-            with open(image_path, 'rb') as f:
-                image_data = f.read()
-            
-            image_size = len(image_data)
-            log_network(f"Sending image of {image_size} bytes")
-            safe_sendall(conn,b'\xFF\x01\x00')
-            safe_sendall(conn,struct.pack('>I', index))
-            safe_sendall(conn,struct.pack('>I', image_size))
-            safe_sendall(conn,image_data)
-            log_network(f"Sending complete")
+            image_data, pack_entry = self.load_image_data(index, image_path)
+            self.send_image_data(conn, index, image_data, pack_entry)
         
         except IOError as error:
             log_warn(f"Warning: image {index} receive the following IO error:")
@@ -626,6 +1323,159 @@ class BackendServer:
             safe_sendall(conn,struct.pack('>I', error_size))
             safe_sendall(conn,error_bytes)            
 
+    def load_image_data(self, index, image_path):
+        # (image bytes, None), or (None, pack entry) of a pack served with sendfile.
+        # Reads before the first write, since a tagged response holds the send lock from there on
+        pack_entry = None
+        if self.image_pack is not None:
+            pack_entry = self.image_pack.lookup(image_path)
+        if pack_entry is not None and self.pack_serve == 'sendfile':
+            return None, pack_entry
+
+        image_data = None
+        if pack_entry is not None:
+            # slice of the mapped shard, no open and no copy per frame
+            image_data = self.image_pack.view(pack_entry)
+        elif self.image_cache is not None:
+            image_data = self.image_cache.get(index)
+            self.metrics.record_cache('image', image_data is not None)
+        if image_data is None:
+            read_start = time.perf_counter()
+            with self.tracer.span('disk_read', 'io', index=index):
+                with open(image_path, 'rb') as f:
+                    image_data = f.read()
+            self.metrics.record_image_read((time.perf_counter() - read_start) * 1000)
+            if self.image_cache is not None:
+                self.image_cache.put(index, image_data)
+        return image_data, None
+
+    def send_image_data(self, conn, index, image_data, pack_entry, prefix=b''):
+        # a Send Image response after prefix, in one write up to the image bytes
+        if pack_entry is not None:
+            self.sendfile_image(conn, index, pack_entry, prefix)
+            return
+        image_size = len(image_data)
+        log_network(f"Sending image of {image_size} bytes")
+        with self.tracer.span('network_send', 'io', size=image_size):
+            safe_sendall(conn,prefix + b'\xFF\x01\x00' + struct.pack('>II', index, image_size))
+            safe_sendall(conn,image_data)
+        log_network(f"Sending complete")
+
+    def sendfile_image(self, conn, index, pack_entry, prefix=b''):
+        shard, offset, length, _ = pack_entry
+        log_network(f"Sending packed image of {length} bytes")
+        with self.tracer.span('network_send', 'io', size=length):
+            safe_sendall(conn,prefix + b'\xFF\x01\x00' + struct.pack('>II', index, length))
+            safe_sendfile(conn, self.image_pack.file_list[shard], offset, length)
+        log_network(f"Sending complete")
+
+    def send_scaled_image(self, conn, index, max_width, max_height, format_index, quality):
+        # same frame layout as send_image, data is the re-encoded image
+        if index>= self.data_cnt or index<0 or format_index >= len(FORMAT_LIST) or max_width == 0 or max_height == 0:
+            log_error("Error: you are requesting out of bound operation")
+            error_bytes = b'bad scaled image request'
+            safe_sendall(conn,b'\xFF\x09\x01' + struct.pack('>II', index, len(error_bytes)) + error_bytes)
+            return
+
+        image_path = self.data_list[index][self.data_entry_file_path]
+        try:
+            transcode_start = time.perf_counter()
+            with self.tracer.span('transcode', 'cpu', index=index):
+                result = self.transcode_pool.transcode(
+                    image_path, max_width, max_height, FORMAT_LIST[format_index], quality
+                )
+            self.metrics.record_transcode((time.perf_counter() - transcode_start) * 1000)
+            with result:
+                log_network(f"Sending scaled image of {result.size} bytes ({result.width}x{result.height})")
+                with self.tracer.span('network_send', 'io', size=result.size):
+                    safe_sendall(conn,b'\xFF\x09\x00' + struct.pack('>II', index, result.size))
+                    safe_sendall(conn,result.data)
+        except Exception as error:
+            # IOError from the file or any decode error raised in the worker
+            log_warn(f"Warning: scaled image {index} failed: {error}")
+            error_bytes = str(error).encode('utf-8')
+            safe_sendall(conn,b'\xFF\x09\x01' + struct.pack('>II', index, len(error_bytes)) + error_bytes)
+
+    def get_row_validator(self, index):
+        # (size, mtime_ns, etag) of the row's image. The stat is cached for
+        # validator_ttl seconds, the etag is only recomputed when size or
+        # mtime changed. etag 0 means unknown, clients do not cache such rows
+        now = time.time()
+        cached = self.row_validator_list[index]
+        if cached is not None and now - cached[3] < self.validator_ttl:
+            return cached[0:3]
+
+        image_path = self.data_list[index][self.data_entry_file_path]
+        pack_entry = self.image_pack.lookup(image_path) if self.image_pack is not None else None
+        try:
+            if pack_entry is not None:
+                size, mtime_ns = pack_entry[2], pack_entry[3]
+            else:
+                stat = os.stat(image_path)
+                size, mtime_ns = stat.st_size, stat.st_mtime_ns
+            if cached is not None and cached[0] == size and cached[1] == mtime_ns:
+                etag = cached[2]
+            elif not self.validator_hash:
+                etag = int.from_bytes(hashlib.sha1(f'{size}:{mtime_ns}'.encode('utf-8')).digest()[0:8], 'big')
+            elif pack_entry is not None:
+                etag = int.from_bytes(hashlib.sha1(self.image_pack.view(pack_entry)).digest()[0:8], 'big')
+            else:
+                etag = int(self.transcode_pool.hash_file(image_path)[0:16], 16)
+            etag = etag or 1
+        except OSError:
+            size, mtime_ns, etag = 0, 0, 0
+        self.row_validator_list[index] = (size, mtime_ns, etag, now)
+        return size, mtime_ns, etag
+
+    def get_row_version(self, index):
+        return self.get_row_validator(index)[2]
+
+    def send_conditional_image(self, conn, index, client_etag):
+        if index>= self.data_cnt or index<0:
+            log_error("Error: you are requesting out of bound operation")
+            safe_sendall(conn,b'\xff\x0c\x01' + struct.pack('>IQ', index, 0))
+            return
+        etag = self.get_row_validator(index)[2]
+        if etag and etag == client_etag:
+            log_network(f"Image {index} not modified")
+            safe_sendall(conn,b'\xff\x0c\x02' + struct.pack('>IQ', index, etag))
+            return
+        # modified, the new etag followed by a normal image response. The image is read
+        # before anything is written, so the send lock is not held during the read
+        image_path = self.data_list[index][self.data_entry_file_path]
+        try:
+            image_data, pack_entry = self.load_image_data(index, image_path)
+        except IOError as error:
+            log_warn(f"Warning: image {index} receive the following IO error:")
+            log_warn(f"{str(error)}")
+            safe_sendall(conn,b'\xff\x0c\x01' + struct.pack('>IQ', index, 0))
+            return
+        self.send_image_data(conn, index, image_data, pack_entry,
+                             prefix=b'\xff\x0c\x00' + struct.pack('>IQ', index, etag))
+
+    def send_validators(self, conn, index1, index2):
+        if index1 > index2 or index2 >= self.data_cnt:
+            log_error("Error: you are requesting out of bound operation")
+            safe_sendall(conn,b'\xff\x0d\x01' + struct.pack('>II', index1, 0))
+            return
+        data = bytearray(b'\xff\x0d\x00' + struct.pack('>II', index1, index2 - index1 + 1))
+        for index in range(index1, index2 + 1):
+            data += struct.pack('>QQQ', *self.get_row_validator(index))
+        safe_sendall(conn,data)
+
+    def send_row_version(self, conn, index1, index2):
+        server_id_bytes = self.server_id.encode('utf-8')
+        if index1 > index2 or index2 >= self.data_cnt:
+            log_error("Error: you are requesting out of bound operation")
+            safe_sendall(conn,b'\xff\x0b\x01' + struct.pack('>IIH', index1, 0, len(server_id_bytes)) + server_id_bytes)
+            return
+        data = bytearray(b'\xff\x0b\x00' + struct.pack('>IIH', index1, index2 - index1 + 1, len(server_id_bytes)))
+        data += server_id_bytes
+        for index in range(index1, index2 + 1):
+            path_bytes = self.data_list[index][self.data_entry_file_path].encode('utf-8')
+            data += struct.pack('>H', len(path_bytes)) + path_bytes + struct.pack('>Q', self.get_row_version(index))
+        safe_sendall(conn,data)
+
     def send_tag(self, conn):
         # send csv tag encoded
         log_info(f'Need to send {self.data_tag_alias_list}')
@@ -640,15 +1490,49 @@ class BackendServer:
     def update_tag(self, conn, index1, index2, csv_data_slice):
         # update tag in csv database, from index1 to index2
         log_info(f"update tag {index1}, {index2}, {csv_data_slice}")
+        return self.update_tag_bulk([(index1, index2, 1, csv_data_slice)]) is not None
 
-        if index2 >= self.data_cnt or len(csv_data_slice)!=self.tag_cnt:
-            log_error("Error: you are requesting mismatch / out of bound operation")
-            return
+    def update_tag_bulk(self, segment_list):
+        # segment: (index1, index2, stride, csv_data_slice), rows index1..index2 inclusive
+        # check every segment first so a bad one does not leave a half applied change
+        for index1, index2, stride, csv_data_slice in segment_list:
+            if index1 > index2 or index2 >= self.data_cnt or stride < 1 or len(csv_data_slice)!=self.tag_cnt:
+                log_error("Error: you are requesting mismatch / out of bound operation")
+                log_error(f"Segment {index1} to {index2} stride {stride} with {len(csv_data_slice)} tags")
+                return None
+
+        row_cnt = 0
+        with self.data_lock:
+            now = time.monotonic()
+            if self.first_dirty_time is None:
+                self.first_dirty_time = now
+            self.last_change_time = now
+            for index1, index2, stride, csv_data_slice in segment_list:
+                self.dirty_rows.update(range(index1, index2+1, stride))
+                for i in range(index1, index2+1, stride):
+                    row = self.data_list[i]
+                    for tag_index, (entry, status) in enumerate(zip(self.data_tag_entry_list, csv_data_slice)):
+                        if (row[entry] == True) != status:
+                            self.progress.set_cell(i, tag_index, status)
+                        row[entry] = status
+                    row_cnt += 1
+                self.tag_index.set_rows(index1, index2, stride, csv_data_slice)
+        log_info(f'{row_cnt} rows written in {len(segment_list)} segments')
+        self.check_autosave()
+        return row_cnt
 
-        for i in range(index1, index2+1):
-            for j in range (0,self.tag_cnt):
-                self.data_list[i][self.data_tag_entry_list[j]] = csv_data_slice[j]
-                log_info(f'writing row {i} column {self.data_tag_entry_list[j]} to {csv_data_slice[j]}')
+    def check_autosave(self):
+        # queues a save when the autosave policy says one is due, returns at once
+        if self.save_writer.is_busy():
+            return
+        reason = self.autosave_policy.check(
+            len(self.dirty_rows), self.first_dirty_time, self.last_change_time, self.last_save_failed_time,
+            time.monotonic()
+        )
+        if reason is not None:
+            log_info(f'Autosaving {len(self.dirty_rows)} rows ({reason})')
+            self.metrics.record_autosave(reason)
+            self.save_writer.request(lambda success: None)
     
     def send_clip(self,conn):
         safe_sendall(conn,b'\xff\x05\x00')
@@ -808,9 +1692,36 @@ class BackendServer:
         else:
             log_info("No reordering needed")
 
+    def init_dataset_state(self):
+        # guards data_list against a save reading half of a bulk change
+        self.data_lock = threading.Lock()
+        # rows changed since the last successful save
+        self.dirty_rows = set()
+        # enabled in load_dataset() by pack_dir, image_cache_mb and readahead
+        self.image_pack = None
+        self.image_cache = None
+        self.warmer = None
+        self.memory_bytes = 0
+        # writes the save file in the background, started by the first save
+        self.save_writer = SaveWriter(self.write_csv, 'save', log_error)
+        # autosave state, time.monotonic() except last_save_time
+        self.first_dirty_time = None
+        self.last_change_time = None
+        self.last_save_failed_time = None
+        self.last_save_time = None
+        # opcode -> (parse, handle) of requests a tagged envelope sends to the I/O pool
+        self.async_request_dict = {
+            0x01: (self.parse_image_req, self.send_image),
+            0x09: (self.parse_scaled_image_req, self.send_scaled_image),
+            0x0C: (self.parse_conditional_image_req, self.send_conditional_image),
+        }
+
     def __init__(self, setting_path='server_setting.json'):
+        self.init_dataset_state()
+        self.metrics = ServerMetrics()
+        self.registry = None
         self.load_setting_file(setting_path)
 
 if __name__ == "__main__":
-    server = BackendServer()
+    server = BackendServer(sys.argv[1] if len(sys.argv) > 1 else 'server_setting.json')
     server.start()
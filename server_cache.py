@@ -0,0 +1,151 @@
+"""
+Server side image cache and read-ahead.
+
+ImageCache keeps encoded image files in memory under a byte budget.
+ReadAheadWarmer is a background thread that reads ahead of the rows
+clients are viewing, so the first pass over a clip is not bound by disk
+latency. Rows are in clip order after build_csv, so reading ahead means
+walking data_list forward from the last row each client requested.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class ImageCache:
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.entry_dict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, index):
+        with self.lock:
+            data = self.entry_dict.get(index)
+            if data is not None:
+                self.entry_dict.move_to_end(index)
+            return data
+
+    def get_size(self, index):
+        # size of the cached file without counting as a use, None when not cached
+        with self.lock:
+            data = self.entry_dict.get(index)
+            return None if data is None else len(data)
+
+    def __contains__(self, index):
+        with self.lock:
+            return index in self.entry_dict
+
+    def put(self, index, data):
+        if len(data) > self.budget_bytes:
+            return
+        with self.lock:
+            old = self.entry_dict.pop(index, None)
+            if old is not None:
+                self.used_bytes -= len(old)
+            self.entry_dict[index] = data
+            self.used_bytes += len(data)
+            while self.used_bytes > self.budget_bytes:
+                _, evicted = self.entry_dict.popitem(last=False)
+                self.used_bytes -= len(evicted)
+
+class ReadAheadWarmer(threading.Thread):
+    """Reads up to lookahead rows ahead of every client, most recent jump first.
+
+    mode "cache" reads files into image_cache, mode "fadvise" only asks the
+    OS to load them into the page cache (posix_fadvise WILLNEED).
+    """
+    def __init__(self, server, mode, lookahead, mb_per_s, log_warn=print):
+        super().__init__(daemon=True)
+        self.server = server
+        self.mode = mode
+        self.lookahead = lookahead
+        self.bytes_per_s = mb_per_s * 1e6
+        self.log_warn = log_warn
+        self.warmed = bytearray(server.data_cnt)
+        # reader thread ident -> last requested row, most recent last
+        self.position_dict = OrderedDict()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.warmed_cnt = 0
+        self.warmed_bytes = 0
+        # set when the dataset is unloaded
+        self.stopped = False
+
+    def note_request(self, index):
+        # called from the connection reader thread of each client
+        self.server.metrics.record_cache('readahead', self.is_warm(index))
+        with self.lock:
+            key = threading.get_ident()
+            self.position_dict.pop(key, None)
+            self.position_dict[key] = index
+        self.wake.set()
+
+    def stop(self):
+        self.stopped = True
+        self.wake.set()
+
+    def forget_client(self):
+        with self.lock:
+            self.position_dict.pop(threading.get_ident(), None)
+
+    def is_warm(self, index):
+        if self.mode == 'cache':
+            return index in self.server.image_cache
+        return bool(self.warmed[index])
+
+    def next_index(self):
+        with self.lock:
+            position_list = list(reversed(self.position_dict.values())) or [0]
+        for position in position_list:
+            # warmed rows are not read again even if the cache evicted them,
+            # otherwise a lookahead larger than the cache would thrash
+            for index in range(position, min(position + self.lookahead, self.server.data_cnt)):
+                if not self.warmed[index]:
+                    return index
+        return None
+
+    def warm(self, index):
+        image_path = self.server.data_list[index][self.server.data_entry_file_path]
+        pack_entry = None
+        if self.server.image_pack is not None:
+            pack_entry = self.server.image_pack.lookup(image_path)
+        if pack_entry is not None:
+            # packed images are served from the mapping, warm that instead
+            size = self.server.image_pack.warm(pack_entry)
+        elif self.mode == 'cache':
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            self.server.image_cache.put(index, data)
+            size = len(data)
+        else:
+            fd = os.open(image_path, os.O_RDONLY)
+            try:
+                size = os.fstat(fd).st_size
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+        self.warmed[index] = 1
+        self.warmed_cnt += 1
+        self.warmed_bytes += size
+        return size
+
+    def run(self):
+        while not self.stopped:
+            index = self.next_index()
+            if index is None:
+                self.wake.wait(1.0)
+                self.wake.clear()
+                continue
+            start = time.perf_counter()
+            try:
+                size = self.warm(index)
+            except OSError as e:
+                self.log_warn(f"Read-ahead of row {index} failed: {e}")
+                # do not retry a broken file in a loop
+                self.warmed[index] = 1
+                continue
+            if self.bytes_per_s > 0:
+                delay = size / self.bytes_per_s - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
@@ -0,0 +1,224 @@
+"""
+Datasets served by one BackendServer.
+
+Every CSV in dataset_dir is a dataset named by its file name without
+extension, plus the csv_dir dataset the server loads at start. A client
+lists them with 0xFF 0x10 and picks one with 0xFF 0x11, connections that
+never pick one get the default. A dataset is parsed on first use into a
+view of the server (BackendServer.open_dataset) that shares settings,
+metrics, scheduler and transcode pool. The registry thread saves datasets
+with unsaved changes once nobody used them for idle_s and unloads the
+least recently used idle ones while the loaded datasets exceed the memory
+budget. A dataset is never unloaded while a client has it selected or
+while its changes cannot be saved.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+LIST_DATASETS_OPCODE = 0x10
+SELECT_DATASET_OPCODE = 0x11
+
+class DatasetEntry:
+    __slots__ = ('name', 'csv_path', 'read_path', 'dataset', 'user_cnt', 'last_used', 'load_lock', 'pinned')
+
+    def __init__(self, name, csv_path, dataset=None, pinned=False):
+        self.name = name
+        self.csv_path = csv_path
+        # the saved copy once the dataset was saved and unloaded, so changes survive a reload
+        self.read_path = None
+        # the loaded view, None while unloaded
+        self.dataset = dataset
+        # connections with this dataset selected
+        self.user_cnt = 0
+        self.last_used = time.monotonic()
+        # held while loading or unloading, so a dataset is parsed once
+        self.load_lock = threading.Lock()
+        # the csv_dir dataset stays loaded
+        self.pinned = pinned
+
+class DatasetRegistry:
+    def __init__(self, server, dataset_dir, budget_mb, idle_s, log_info=print, log_warn=print):
+        self.server = server
+        self.dataset_dir = dataset_dir
+        self.budget_bytes = int(budget_mb * 1e6)
+        self.idle_s = idle_s
+        self.log_info = log_info
+        self.log_warn = log_warn
+        self.lock = threading.Lock()
+        # name -> DatasetEntry, sorted by name
+        self.entry_dict = OrderedDict()
+        self.default_name = None
+        self.load_cnt = 0
+        self.evict_cnt = 0
+        self.idle_save_cnt = 0
+
+    def add_loaded(self, name, dataset):
+        # the dataset the server parsed at start, served to clients that do not pick one
+        with self.lock:
+            self.entry_dict[name] = DatasetEntry(name, dataset.csv_path, dataset, pinned=True)
+            self.default_name = name
+        self.scan()
+
+    def scan(self):
+        # picks up CSVs added to dataset_dir since the last scan
+        if not self.dataset_dir:
+            return
+        try:
+            file_list = sorted(os.listdir(self.dataset_dir))
+        except OSError as e:
+            self.log_warn(f"Cannot list datasets in {self.dataset_dir}: {e}")
+            return
+        with self.lock:
+            known_path_set = {os.path.abspath(entry.csv_path) for entry in self.entry_dict.values()}
+            # the tag file may sit next to the datasets
+            known_path_set.add(os.path.abspath(self.server.meta_path))
+            for file_name in file_list:
+                name, ext = os.path.splitext(file_name)
+                csv_path = os.path.join(self.dataset_dir, file_name)
+                # saved copies land next to the sources when csv_save_dir is the same folder
+                if ext.lower() != '.csv' or name.endswith('__labelled__') or name in self.entry_dict:
+                    continue
+                if os.path.abspath(csv_path) in known_path_set or not os.path.isfile(csv_path):
+                    continue
+                self.entry_dict[name] = DatasetEntry(name, csv_path)
+            self.entry_dict = OrderedDict(sorted(self.entry_dict.items()))
+            if self.default_name is None and self.entry_dict:
+                self.default_name = next(iter(self.entry_dict))
+
+    def list_datasets(self):
+        self.scan()
+        with self.lock:
+            return [{
+                'name': entry.name,
+                'loaded': entry.dataset is not None,
+                'rows': entry.dataset.data_cnt if entry.dataset is not None else None,
+                'clients': entry.user_cnt,
+                'default': entry.name == self.default_name,
+            } for entry in self.entry_dict.values()]
+
+    def acquire(self, name=None):
+        # the loaded dataset, None if the name is unknown.
+        # Raises whatever parsing the CSV raised, every acquire needs a release
+        if name is None:
+            name = self.default_name
+        with self.lock:
+            entry = self.entry_dict.get(name)
+        if entry is None:
+            self.scan()
+            with self.lock:
+                entry = self.entry_dict.get(name)
+        if entry is None:
+            return None
+        with self.lock:
+            entry.user_cnt += 1
+            entry.last_used = time.monotonic()
+        try:
+            with entry.load_lock:
+                if entry.dataset is None:
+                    self.log_info(f"Loading dataset {name} from {entry.csv_path}")
+                    dataset = self.server.open_dataset(name, entry.csv_path, entry.read_path)
+                    dataset.load_dataset()
+                    entry.dataset = dataset
+                    self.load_cnt += 1
+                dataset = entry.dataset
+        except BaseException:
+            self.release(name)
+            raise
+        self.enforce_budget()
+        return dataset
+
+    def release(self, name):
+        with self.lock:
+            entry = self.entry_dict.get(name)
+            if entry is not None:
+                entry.user_cnt -= 1
+                entry.last_used = time.monotonic()
+
+    def get_loaded_list(self):
+        with self.lock:
+            return [entry.dataset for entry in self.entry_dict.values() if entry.dataset is not None]
+
+    def get_used_bytes(self):
+        with self.lock:
+            return sum(entry.dataset.get_memory_bytes() for entry in self.entry_dict.values()
+                       if entry.dataset is not None)
+
+    def enforce_budget(self):
+        # unload idle datasets, least recently used first, until the rest fit
+        used_bytes = self.get_used_bytes()
+        if used_bytes <= self.budget_bytes:
+            return
+        with self.lock:
+            candidate_list = sorted(
+                [entry for entry in self.entry_dict.values()
+                 if entry.dataset is not None and not entry.pinned and entry.user_cnt == 0],
+                key=lambda entry: entry.last_used
+            )
+        for entry in candidate_list:
+            if used_bytes <= self.budget_bytes:
+                break
+            size = self.unload(entry)
+            if size is not None:
+                used_bytes -= size
+
+    def unload(self, entry):
+        # returns the bytes freed, None if the dataset stays loaded
+        with entry.load_lock:
+            dataset = entry.dataset
+            if dataset is None or entry.user_cnt > 0:
+                return None
+            if dataset.dirty_rows and not dataset.save_csv():
+                self.log_warn(f"Keeping dataset {entry.name} loaded, its changes could not be saved")
+                return None
+            with self.lock:
+                # a client selected it while saving
+                if entry.user_cnt > 0:
+                    return None
+                entry.dataset = None
+                self.evict_cnt += 1
+            try:
+                if os.path.getmtime(dataset.csv_save_path) >= dataset.load_time:
+                    entry.read_path = dataset.csv_save_path
+            except OSError:
+                pass
+            size = dataset.get_memory_bytes()
+            dataset.unload_dataset()
+        self.log_info(f"Unloaded idle dataset {entry.name}, {size / 1e6:.1f} MB")
+        return size
+
+    def save_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            idle_list = [entry for entry in self.entry_dict.values()
+                         if entry.dataset is not None and entry.user_cnt == 0
+                         and now - entry.last_used >= self.idle_s and entry.dataset.dirty_rows]
+        for entry in idle_list:
+            with entry.load_lock:
+                if entry.dataset is not None and entry.dataset.save_csv():
+                    self.idle_save_cnt += 1
+
+    def run(self):
+        while True:
+            time.sleep(min(self.idle_s, 10.0))
+            try:
+                self.save_idle()
+                self.enforce_budget()
+            except Exception as e:
+                self.log_warn(f"Dataset housekeeping failed: {e}")
+
+    def start(self):
+        threading.Thread(target=self.run, name='datasets', daemon=True).start()
+
+    def snapshot(self):
+        stats = {
+            'loaded': sum(1 for entry in self.entry_dict.values() if entry.dataset is not None),
+            'known': len(self.entry_dict),
+            'used_mb': self.get_used_bytes() / 1e6,
+            'budget_mb': self.budget_bytes / 1e6,
+            'loads': self.load_cnt,
+            'evictions': self.evict_cnt,
+            'idle_saves': self.idle_save_cnt,
+        }
+        return stats
@@ -0,0 +1,172 @@
+"""
+Per-connection response framing for BackendServer.
+
+Requests wrapped in the tagged envelope (0xFF 0x0A req_id) may be answered
+out of order: image requests run on the I/O thread pool while the reader
+keeps parsing and answers tag changes and saves inline. Every response is
+written through a ResponseWriter, which holds the connection send lock
+from its first byte until the handler finishes, so frames never interleave.
+Inline responses take the lock before image frames waiting for it, so an
+ack waits at most for the one frame being sent.
+
+PendingTable tracks the tagged requests of one connection between parsing
+and completion. Past its limit of requests on the I/O pool, further ones
+are parked in the table instead of stalling the reader, and each finished
+request hands its slot to the oldest parked one. A cancel request (0xFF 0x0E) names request ids or a row
+range; entries that have not started are skipped without a response,
+entries already sending finish normally and their bytes count as wasted.
+"""
+import collections
+import struct
+import threading
+
+TAGGED_OPCODE = 0x0A
+CANCEL_OPCODE = 0x0E
+# tagged envelope with a priority class, see server_scheduler.py
+PRIORITY_OPCODE = 0x0F
+
+class PendingRequest:
+    __slots__ = ('req_id', 'index', 'started', 'cancelled')
+
+    def __init__(self, req_id, index):
+        self.req_id = req_id
+        self.index = index
+        self.started = False
+        self.cancelled = False
+
+class PendingTable:
+    def __init__(self, limit):
+        self.lock = threading.Lock()
+        # req_id -> PendingRequest, parsed and not finished
+        self.entry_dict = {}
+        # requests on the I/O pool, at most limit, the others wait in parked_list
+        self.limit = limit
+        self.running_cnt = 0
+        self.parked_list = collections.deque()
+
+    def add(self, req_id, index):
+        entry = PendingRequest(req_id, index)
+        with self.lock:
+            self.entry_dict[req_id] = entry
+        return entry
+
+    def admit(self, job):
+        # True when job may go to the I/O pool now, otherwise it is parked
+        # until release hands it a slot
+        with self.lock:
+            if self.running_cnt < self.limit:
+                self.running_cnt += 1
+                return True
+            self.parked_list.append(job)
+            return False
+
+    def release(self):
+        # a request left the pool, returns the parked job taking its slot or None
+        with self.lock:
+            if self.parked_list:
+                return self.parked_list.popleft()
+            self.running_cnt -= 1
+            return None
+
+    def start(self, entry):
+        # False when the request was cancelled before its turn
+        with self.lock:
+            if entry.cancelled:
+                return False
+            entry.started = True
+            return True
+
+    def finish(self, entry):
+        # True when the request was cancelled while it was sending
+        with self.lock:
+            self.entry_dict.pop(entry.req_id, None)
+            return entry.cancelled
+
+    def cancel(self, req_id_list=None, index1=None, index2=None):
+        # entries matching the ids or rows index1..index2, returns the ones
+        # that had not started and will never be answered
+        with self.lock:
+            if req_id_list is not None:
+                match_list = [self.entry_dict[req_id] for req_id in req_id_list if req_id in self.entry_dict]
+            else:
+                match_list = [entry for entry in self.entry_dict.values() if index1 <= entry.index <= index2]
+            skipped_list = []
+            for entry in match_list:
+                if entry.cancelled:
+                    continue
+                entry.cancelled = True
+                if not entry.started:
+                    del self.entry_dict[entry.req_id]
+                    skipped_list.append(entry)
+            return skipped_list
+
+class SendLock:
+    """Send lock of one connection.
+
+    Urgent holders (inline responses) go before the others (image frames
+    from the I/O pool) still waiting, a frame already being sent finishes
+    first.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.held = False
+        self.urgent_cnt = 0
+
+    def acquire(self, urgent=True):
+        with self.cond:
+            if urgent:
+                self.urgent_cnt += 1
+                while self.held:
+                    self.cond.wait()
+                self.urgent_cnt -= 1
+            else:
+                while self.held or self.urgent_cnt:
+                    self.cond.wait()
+            self.held = True
+
+    def release(self):
+        with self.cond:
+            self.held = False
+            self.cond.notify_all()
+
+class ResponseWriter:
+    """Socket stand-in handed to request handlers.
+
+    recv goes to the connection, sendall takes the send lock on first use
+    and prefixes the envelope header when the request was tagged.
+    """
+    def __init__(self, conn, send_lock, req_id=None, urgent=True):
+        self.conn = conn
+        self.send_lock = send_lock
+        self.req_id = req_id
+        # False for requests served on the I/O pool, see SendLock
+        self.urgent = urgent
+        self.locked = False
+        self.bytes_out = 0
+
+    def recv(self, size):
+        return self.conn.recv(size)
+
+    def sendall(self, data):
+        if not self.locked:
+            self.send_lock.acquire(self.urgent)
+            self.locked = True
+            if self.req_id is not None:
+                # one write with the first chunk, a separate small write would
+                # wait for the delayed ack of the header
+                data = b'\xff' + bytes([TAGGED_OPCODE]) + struct.pack('>I', self.req_id) + data
+        self.conn.sendall(data)
+        self.bytes_out += len(data)
+
+    def sendfile(self, file, offset, count):
+        # only after sendall, which took the lock and wrote the frame header
+        self.conn.sendfile(file, offset, count)
+        self.bytes_out += count
+
+    def finish(self):
+        if self.locked:
+            self.locked = False
+            self.send_lock.release()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
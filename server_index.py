@@ -0,0 +1,160 @@
+"""
+Tag bitmaps of one dataset, for tag queries (0xFF 0x12).
+
+TagIndex keeps one bit per row for every tag, plus one for rows without
+any tag, in bytearrays (bit i & 7 of byte i >> 3 is row i).
+update_tag_bulk sets the bits of the rows it writes, so a change costs
+what writing the rows costs and the index never needs a rebuild. A query
+is a postfix program over the bitmaps of a row range:
+
+    0x00 tag(2 bytes)   push the rows with this tag
+    0x01                push the rows without any tag
+    0x02                NOT of the top entry
+    0x03                AND of the top two entries
+    0x04                OR of the top two entries
+
+and leaves one bitmap, searched for the first or last match or listed as
+runs of rows. Bitmaps of a range are Python ints, so the operators run in
+C over whole machine words.
+"""
+import struct
+
+import numpy as np
+
+QUERY_OPCODE = 0x12
+
+QUERY_NEXT = 0
+QUERY_PREV = 1
+QUERY_LIST = 2
+
+OP_TAG = 0x00
+OP_UNLABELED = 0x01
+OP_NOT = 0x02
+OP_AND = 0x03
+OP_OR = 0x04
+
+def pack_bits(state_array):
+    return bytearray(np.packbits(state_array, bitorder='little').tobytes())
+
+class TagIndex:
+    def __init__(self, state_array_list, row_cnt):
+        # state_array_list: a bool array of row_cnt entries per tag
+        self.row_cnt = row_cnt
+        self.tag_cnt = len(state_array_list)
+        self.bitmap_list = [pack_bits(state_array) for state_array in state_array_list]
+        if state_array_list:
+            labeled = np.logical_or.reduce(state_array_list)
+        else:
+            labeled = np.zeros(row_cnt, dtype=bool)
+        self.unlabeled = pack_bits(~labeled)
+
+    def get_memory_bytes(self):
+        return (self.tag_cnt + 1) * ((self.row_cnt + 7) >> 3)
+
+    def set_rows(self, index1, index2, stride, state_list):
+        # rows index1, index1+stride, ... index2 get the tags of state_list
+        unlabeled = not any(state_list)
+        if stride == 1:
+            for bitmap, state in zip(self.bitmap_list, state_list):
+                self.fill_range(bitmap, index1, index2, state)
+            self.fill_range(self.unlabeled, index1, index2, unlabeled)
+            return
+        bitmap_state_list = list(zip(self.bitmap_list, state_list)) + [(self.unlabeled, unlabeled)]
+        for i in range(index1, index2+1, stride):
+            byte, bit = i >> 3, 1 << (i & 7)
+            for bitmap, state in bitmap_state_list:
+                if state:
+                    bitmap[byte] |= bit
+                else:
+                    bitmap[byte] &= ~bit
+
+    def fill_range(self, bitmap, index1, index2, state):
+        # bits of rows index1..index2 inclusive, whole bytes at once
+        byte1, byte2 = (index1 + 7) >> 3, (index2 + 1) >> 3
+        if byte1 >= byte2:
+            edge_list = [range(index1, index2+1)]
+        else:
+            edge_list = [range(index1, byte1 << 3), range(byte2 << 3, index2+1)]
+            bitmap[byte1:byte2] = (b'\xff' if state else b'\x00') * (byte2 - byte1)
+        for edge in edge_list:
+            for i in edge:
+                if state:
+                    bitmap[i >> 3] |= 1 << (i & 7)
+                else:
+                    bitmap[i >> 3] &= ~(1 << (i & 7))
+
+    def get_range(self, bitmap, index1, index2):
+        # rows index1..index2 as an int, bit 0 is index1
+        value = int.from_bytes(bitmap[index1 >> 3:(index2 >> 3) + 1], 'little') >> (index1 & 7)
+        return value & ((1 << (index2 - index1 + 1)) - 1)
+
+    def evaluate(self, program, index1, index2):
+        # the rows index1..index2 matching program as an int, bit 0 is index1.
+        # Raises ValueError for a malformed program
+        full = (1 << (index2 - index1 + 1)) - 1
+        stack = []
+        pos = 0
+        while pos < len(program):
+            op = program[pos]
+            pos += 1
+            if op == OP_TAG:
+                if pos + 2 > len(program):
+                    raise ValueError("truncated tag operand")
+                tag_index = struct.unpack('>H', program[pos:pos+2])[0]
+                pos += 2
+                if tag_index >= self.tag_cnt:
+                    raise ValueError(f"tag {tag_index} out of {self.tag_cnt}")
+                stack.append(self.get_range(self.bitmap_list[tag_index], index1, index2))
+            elif op == OP_UNLABELED:
+                stack.append(self.get_range(self.unlabeled, index1, index2))
+            elif op == OP_NOT:
+                if not stack:
+                    raise ValueError("NOT without operand")
+                stack.append(~stack.pop() & full)
+            elif op in (OP_AND, OP_OR):
+                if len(stack) < 2:
+                    raise ValueError("AND/OR needs two operands")
+                right, left = stack.pop(), stack.pop()
+                stack.append(left & right if op == OP_AND else left | right)
+            else:
+                raise ValueError(f"unknown query op {op}")
+        if len(stack) != 1:
+            raise ValueError(f"query leaves {len(stack)} results")
+        return stack[0]
+
+    def query(self, mode, program, index1, index2, start):
+        # (match_cnt, [(first, last)]) of the rows index1..index2 matching program:
+        # QUERY_NEXT the first at or after start, QUERY_PREV the last at or before start,
+        # QUERY_LIST every one as runs. Raises ValueError for a bad request
+        if index1 > index2 or index2 >= self.row_cnt:
+            raise ValueError(f"range {index1} to {index2} out of {self.row_cnt} rows")
+        if mode == QUERY_NEXT:
+            if start > index2:
+                return 0, []
+            begin = max(start, index1)
+            match = self.evaluate(program, begin, index2)
+            if not match:
+                return 0, []
+            row = begin + (match & -match).bit_length() - 1
+            return 1, [(row, row)]
+        if mode == QUERY_PREV:
+            if start < index1:
+                return 0, []
+            end = min(start, index2)
+            match = self.evaluate(program, index1, end)
+            if not match:
+                return 0, []
+            row = index1 + match.bit_length() - 1
+            return 1, [(row, row)]
+        if mode == QUERY_LIST:
+            match = self.evaluate(program, index1, index2)
+            row_cnt = index2 - index1 + 1
+            bit_array = np.unpackbits(
+                np.frombuffer(match.to_bytes((row_cnt + 7) >> 3, 'little'), dtype=np.uint8), bitorder='little'
+            )[0:row_cnt].astype(np.int8)
+            # run starts and ends where the bits change
+            edge_array = np.flatnonzero(np.diff(np.concatenate(([0], bit_array, [0]))))
+            run_list = [(index1 + int(begin), index1 + int(end) - 1)
+                        for begin, end in zip(edge_array[0::2], edge_array[1::2])]
+            return int(bit_array.sum()), run_list
+        raise ValueError(f"unknown query mode {mode}")
@@ -0,0 +1,253 @@
+"""
+Live metrics for BackendServer.
+
+ServerMetrics is updated from the client threads and read by the stats
+opcode (0xFF 0x08) and the optional JSON-lines dump thread.
+"""
+import json
+import threading
+import time
+
+OPCODE_NAMES = {
+    0x01: 'image',
+    0x02: 'csv_tag',
+    0x03: 'csv_change',
+    0x04: 'save',
+    0x05: 'clip',
+    0x06: 'partial_csv',
+    0x07: 'csv_bulk_change',
+    0x08: 'stats',
+    0x09: 'scaled_image',
+    0x0A: 'tagged',
+    0x0B: 'row_version',
+    0x0C: 'conditional_image',
+    0x0D: 'validators',
+    0x0E: 'cancel',
+    0x0F: 'priority',
+    0x10: 'list_datasets',
+    0x11: 'select_dataset',
+    0x12: 'query',
+    0x13: 'progress',
+}
+
+# histogram bucket upper bounds in milliseconds, last bucket is everything above
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+class Histogram:
+    def __init__(self, bucket_list=LATENCY_BUCKETS_MS):
+        self.bucket_list = bucket_list
+        self.count_list = [0] * (len(bucket_list) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        index = len(self.bucket_list)
+        for i, bound in enumerate(self.bucket_list):
+            if value <= bound:
+                index = i
+                break
+        self.count_list[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, pct):
+        # upper bound of the bucket holding the percentile
+        if self.count == 0:
+            return None
+        rank = pct / 100 * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.count_list):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return self.bucket_list[i] if i < len(self.bucket_list) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'buckets': self.bucket_list,
+            'counts': list(self.count_list),
+        }
+
+class CountingConnection:
+    """Socket proxy counting bytes in and out, so handlers stay unchanged."""
+    def __init__(self, conn):
+        self.conn = conn
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def recv(self, size):
+        data = self.conn.recv(size)
+        self.bytes_in += len(data)
+        return data
+
+    def sendall(self, data):
+        self.conn.sendall(data)
+        self.bytes_out += len(data)
+
+    def sendfile(self, file, offset, count):
+        self.conn.sendfile(file, offset, count)
+        self.bytes_out += count
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+class ServerMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.request_dict = {}
+        self.image_read_ms = Histogram()
+        self.transcode_ms = Histogram()
+        # time tagged image requests waited for a worker, per priority class
+        self.queue_wait_dict = {}
+        self.save_ms = Histogram()
+        self.save_failed = 0
+        self.last_save_time = None
+        # saves the autosave policy started, per rule
+        self.autosave_dict = {}
+        self.cache_dict = {}
+        self.client_cnt = 0
+        self.client_total = 0
+        # image requests skipped by a cancel, and ones cancelled too late to skip
+        self.cancelled_cnt = 0
+        self.cancelled_bytes = 0
+        # skipped requests of rows whose size the server did not know, not in cancelled_bytes
+        self.cancelled_unsized_cnt = 0
+        self.wasted_cnt = 0
+        self.wasted_bytes = 0
+
+    def client_connected(self):
+        with self.lock:
+            self.client_cnt += 1
+            self.client_total += 1
+
+    def client_disconnected(self):
+        with self.lock:
+            self.client_cnt -= 1
+
+    def record_request(self, cmd, bytes_in, bytes_out, duration_ms):
+        name = OPCODE_NAMES.get(cmd, f'unknown_{cmd:#04x}')
+        with self.lock:
+            entry = self.request_dict.get(name)
+            if entry is None:
+                entry = {'count': 0, 'bytes_in': 0, 'bytes_out': 0, 'ms': Histogram()}
+                self.request_dict[name] = entry
+            entry['count'] += 1
+            entry['bytes_in'] += bytes_in
+            entry['bytes_out'] += bytes_out
+            entry['ms'].add(duration_ms)
+
+    def record_image_read(self, duration_ms):
+        with self.lock:
+            self.image_read_ms.add(duration_ms)
+
+    def record_transcode(self, duration_ms):
+        with self.lock:
+            self.transcode_ms.add(duration_ms)
+
+    def record_queue_wait(self, name, duration_ms):
+        with self.lock:
+            histogram = self.queue_wait_dict.get(name)
+            if histogram is None:
+                histogram = Histogram()
+                self.queue_wait_dict[name] = histogram
+            histogram.add(duration_ms)
+
+    def record_save(self, duration_ms, success):
+        with self.lock:
+            self.save_ms.add(duration_ms)
+            if success:
+                self.last_save_time = time.time()
+            else:
+                self.save_failed += 1
+
+    def record_autosave(self, reason):
+        with self.lock:
+            self.autosave_dict[reason] = self.autosave_dict.get(reason, 0) + 1
+
+    def record_cancel(self, request_cnt, size, unsized_cnt=0):
+        with self.lock:
+            self.cancelled_cnt += request_cnt
+            self.cancelled_bytes += size
+            self.cancelled_unsized_cnt += unsized_cnt
+
+    def record_wasted(self, size):
+        with self.lock:
+            self.wasted_cnt += 1
+            self.wasted_bytes += size
+
+    def record_cache(self, name, hit):
+        with self.lock:
+            entry = self.cache_dict.setdefault(name, {'hits': 0, 'misses': 0})
+            if hit:
+                entry['hits'] += 1
+            else:
+                entry['misses'] += 1
+
+    def snapshot(self, dirty_rows=0):
+        with self.lock:
+            now = time.time()
+            cache = {}
+            for name, entry in self.cache_dict.items():
+                total = entry['hits'] + entry['misses']
+                cache[name] = dict(entry, hit_rate=entry['hits'] / total if total else None)
+            return {
+                'time': now,
+                'uptime_s': now - self.start_time,
+                'clients': self.client_cnt,
+                'clients_total': self.client_total,
+                'dirty_rows': dirty_rows,
+                'requests': {
+                    name: {
+                        'count': entry['count'],
+                        'bytes_in': entry['bytes_in'],
+                        'bytes_out': entry['bytes_out'],
+                        'ms': entry['ms'].snapshot(),
+                    }
+                    for name, entry in self.request_dict.items()
+                },
+                'image_read_ms': self.image_read_ms.snapshot(),
+                'transcode_ms': self.transcode_ms.snapshot(),
+                'queue_wait_ms': {name: histogram.snapshot() for name, histogram in self.queue_wait_dict.items()},
+                'cache': cache,
+                'cancel': {
+                    'cancelled': self.cancelled_cnt,
+                    'cancelled_bytes': self.cancelled_bytes,
+                    'cancelled_unsized': self.cancelled_unsized_cnt,
+                    'wasted': self.wasted_cnt,
+                    'wasted_bytes': self.wasted_bytes,
+                },
+                'save': {
+                    'count': self.save_ms.count,
+                    'failed': self.save_failed,
+                    'last_save_time': self.last_save_time,
+                    'autosave': dict(self.autosave_dict),
+                    'ms': self.save_ms.snapshot(),
+                },
+            }
+
+class MetricsDumper(threading.Thread):
+    """Appends one JSON snapshot per interval to a JSON-lines file."""
+    def __init__(self, server, path, interval, log_warn=print):
+        super().__init__(daemon=True)
+        self.server = server
+        self.path = path
+        self.interval = interval
+        self.log_warn = log_warn
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with open(self.path, 'a') as dump_file:
+                    dump_file.write(json.dumps(self.server.get_stats()) + '\n')
+            except OSError as e:
+                self.log_warn(f'Metrics dump to {self.path} failed: {e}')
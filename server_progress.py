@@ -0,0 +1,157 @@
+"""
+Labeling progress of one dataset, for the stats (0xFF 0x08) and clip
+progress (0xFF 0x13) requests.
+
+LabelProgress counts per clip the rows with each tag, the rows and frames
+with any tag and the labeled rows of every camera. A frame is labeled once
+every camera of it has a tag. build_csv counts everything in one numpy
+pass; after that update_tag_bulk reports every cell it flips, which costs
+a few counter updates, so no request ever scans the rows.
+
+Rows past the last clip (the last row, see get_data_clip_list) are not
+counted.
+"""
+import numpy as np
+
+PROGRESS_OPCODE = 0x13
+
+class LabelProgress:
+    def __init__(self, state_array_list, clip_list, row_cam_array, cam_name_list, row_cnt):
+        # state_array_list: a bool array of row_cnt entries per tag, clip_list: data_clip_list,
+        # row_cam_array: the index in cam_name_list of every row's camera, None to
+        # name cameras by their place in the frame
+        self.tag_cnt = len(state_array_list)
+        self.clip_cnt = len(clip_list)
+
+        begin_array = np.array([clip['begin'] for clip in clip_list], dtype=np.int64)
+        size_array = np.array([clip['end'] - clip['begin'] for clip in clip_list], dtype=np.int64)
+        step_array = np.array([clip['cam'] for clip in clip_list], dtype=np.int64)
+        frame_cnt_array = -(-size_array // step_array)
+        # first frame of every clip, empty without clips
+        frame_begin_array = np.cumsum(frame_cnt_array) - frame_cnt_array
+
+        # clip and frame of every row, -1 past the last clip
+        covered = int(size_array.sum())
+        self.row_clip = np.full(row_cnt, -1, dtype=np.int32)
+        self.row_frame = np.full(row_cnt, -1, dtype=np.int32)
+        clip_of_row = np.repeat(np.arange(self.clip_cnt), size_array)
+        offset_array = np.arange(covered) - np.repeat(begin_array, size_array)
+        self.row_clip[0:covered] = clip_of_row
+        self.row_frame[0:covered] = np.repeat(frame_begin_array, size_array) + offset_array // np.repeat(step_array, size_array)
+        if row_cam_array is None:
+            self.row_cam = np.zeros(row_cnt, dtype=np.int32)
+            self.row_cam[0:covered] = offset_array % np.repeat(step_array, size_array)
+            cam_name_list = [f"cam{i}" for i in range(0, int(step_array.max(initial=1)))]
+        else:
+            self.row_cam = np.asarray(row_cam_array, dtype=np.int32)
+        self.cam_name_list = list(cam_name_list)
+        cam_cnt = max(len(self.cam_name_list), 1)
+
+        if state_array_list:
+            state_matrix = np.stack(state_array_list, axis=1)[0:covered]
+        else:
+            state_matrix = np.zeros((covered, 0), dtype=bool)
+        self.row_tag_cnt = np.zeros(row_cnt, dtype=np.int32)
+        self.row_tag_cnt[0:covered] = state_matrix.sum(axis=1)
+        labeled = self.row_tag_cnt[0:covered] > 0
+
+        self.clip_tag_rows = np.zeros((self.clip_cnt, self.tag_cnt), dtype=np.int64)
+        for tag_index in range(0, self.tag_cnt):
+            self.clip_tag_rows[:, tag_index] = np.bincount(clip_of_row, weights=state_matrix[:, tag_index], minlength=self.clip_cnt)
+        self.clip_rows = size_array
+        self.clip_labeled_rows = np.bincount(clip_of_row, weights=labeled, minlength=self.clip_cnt).astype(np.int64)
+
+        frame_cnt = int(frame_cnt_array.sum())
+        row_frame = self.row_frame[0:covered]
+        self.frame_rows = np.bincount(row_frame, minlength=frame_cnt).astype(np.int32)
+        self.frame_labeled_rows = np.bincount(row_frame, weights=labeled, minlength=frame_cnt).astype(np.int32)
+        frame_clip = np.repeat(np.arange(self.clip_cnt), frame_cnt_array)
+        self.clip_frames = frame_cnt_array
+        self.clip_labeled_frames = np.bincount(
+            frame_clip, weights=self.frame_labeled_rows == self.frame_rows, minlength=self.clip_cnt
+        ).astype(np.int64)
+
+        cam_of_row = self.row_cam[0:covered]
+        self.clip_cam_rows = np.bincount(
+            clip_of_row * cam_cnt + cam_of_row, minlength=self.clip_cnt * cam_cnt
+        ).reshape(self.clip_cnt, cam_cnt).astype(np.int64)
+        self.clip_cam_labeled_rows = np.bincount(
+            clip_of_row * cam_cnt + cam_of_row, weights=labeled, minlength=self.clip_cnt * cam_cnt
+        ).reshape(self.clip_cnt, cam_cnt).astype(np.int64)
+
+        self.set_clip_range(0, self.clip_cnt)
+
+    def set_clip_range(self, clip_begin, clip_end):
+        # the clips the totals cover, a shard's own clips
+        self.clip_begin, self.clip_end = clip_begin, clip_end
+        clip_slice = slice(clip_begin, clip_end)
+        self.total_rows = int(self.clip_rows[clip_slice].sum())
+        self.total_labeled_rows = int(self.clip_labeled_rows[clip_slice].sum())
+        self.total_frames = int(self.clip_frames[clip_slice].sum())
+        self.total_labeled_frames = int(self.clip_labeled_frames[clip_slice].sum())
+        self.total_tag_rows = self.clip_tag_rows[clip_slice].sum(axis=0).tolist()
+        self.total_cam_rows = self.clip_cam_rows[clip_slice].sum(axis=0).tolist()
+        self.total_cam_labeled_rows = self.clip_cam_labeled_rows[clip_slice].sum(axis=0).tolist()
+
+    def get_memory_bytes(self):
+        return sum(array.nbytes for array in (
+            self.row_clip, self.row_frame, self.row_cam, self.row_tag_cnt, self.frame_rows, self.frame_labeled_rows,
+            self.clip_tag_rows, self.clip_cam_rows, self.clip_cam_labeled_rows,
+        ))
+
+    def set_cell(self, row, tag_index, state):
+        # tag tag_index of row flipped to state, called under data_lock
+        clip = int(self.row_clip[row])
+        if clip < 0:
+            return
+        delta = 1 if state else -1
+        in_range = self.clip_begin <= clip < self.clip_end
+        self.clip_tag_rows[clip, tag_index] += delta
+        if in_range:
+            self.total_tag_rows[tag_index] += delta
+        tag_cnt = int(self.row_tag_cnt[row]) + delta
+        self.row_tag_cnt[row] = tag_cnt
+        # the row gained its first tag or lost its last one
+        if tag_cnt != (1 if state else 0):
+            return
+        cam = int(self.row_cam[row])
+        self.clip_labeled_rows[clip] += delta
+        self.clip_cam_labeled_rows[clip, cam] += delta
+        frame = int(self.row_frame[row])
+        labeled_rows = int(self.frame_labeled_rows[frame]) + delta
+        self.frame_labeled_rows[frame] = labeled_rows
+        # the frame got its last camera labeled or lost it
+        frame_flip = labeled_rows == int(self.frame_rows[frame]) - (0 if state else 1)
+        if frame_flip:
+            self.clip_labeled_frames[clip] += delta
+        if in_range:
+            self.total_labeled_rows += delta
+            self.total_cam_labeled_rows[cam] += delta
+            if frame_flip:
+                self.total_labeled_frames += delta
+
+    def get_clip_progress(self, clip1, clip2):
+        # [(frames, labeled frames, rows, labeled rows)] of clips clip1..clip2 inclusive.
+        # Raises ValueError for a bad range
+        if clip1 > clip2 or clip2 >= self.clip_cnt:
+            raise ValueError(f"clips {clip1} to {clip2} out of {self.clip_cnt}")
+        clip_slice = slice(clip1, clip2 + 1)
+        return list(zip(
+            self.clip_frames[clip_slice].tolist(), self.clip_labeled_frames[clip_slice].tolist(),
+            self.clip_rows[clip_slice].tolist(), self.clip_labeled_rows[clip_slice].tolist(),
+        ))
+
+    def snapshot(self):
+        # totals of the clip range, the 'progress' entry of the stats
+        return {
+            'clips': [self.clip_begin, self.clip_end],
+            'rows': self.total_rows,
+            'labeled_rows': self.total_labeled_rows,
+            'frames': self.total_frames,
+            'labeled_frames': self.total_labeled_frames,
+            'tag_rows': list(self.total_tag_rows),
+            'cams': {
+                str(name): [labeled_rows, rows]
+                for name, labeled_rows, rows in zip(self.cam_name_list, self.total_cam_labeled_rows, self.total_cam_rows)
+            },
+        }
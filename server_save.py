@@ -0,0 +1,187 @@
+"""
+Background CSV saves for BackendServer.
+
+Every dataset has a SaveWriter thread that owns its save file. A save
+request queues a callback and returns; the writer takes a snapshot of the
+rows under data_lock, writes it to a temp file next to the save file,
+fsyncs it and renames it over the save file, so a crash leaves either the
+old or the new file, never half of one. Requests that arrive while a
+write runs are answered together by one follow-up write, whose snapshot
+includes every change made before they were sent. Callbacks run on the
+writer thread once the data is durable, or failed to save.
+
+AutosavePolicy decides when unsaved changes are saved without a request:
+update_tag_bulk checks the row count after every change and the Autosaver
+thread checks the time rules of every loaded dataset.
+"""
+import os
+import threading
+import time
+
+class SaveWriter:
+    def __init__(self, write, name='save', log_error=print):
+        # write() -> bool does one snapshot and durable write
+        self.write = write
+        self.name = name
+        self.log_error = log_error
+        self.cond = threading.Condition()
+        # callbacks of requests the next write answers
+        self.waiting_list = []
+        self.writing = False
+        self.stopped = False
+        self.thread = None
+        self.request_cnt = 0
+        self.write_cnt = 0
+
+    def request(self, callback):
+        # callback(success) runs on the writer thread after the write
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+                self.thread.start()
+            self.waiting_list.append(callback)
+            self.request_cnt += 1
+            self.cond.notify()
+
+    def save(self, timeout=None):
+        # blocks until a write that started after this call finished, False on failure or timeout
+        done = threading.Event()
+        result = []
+        def callback(success):
+            result.append(success)
+            done.set()
+        self.request(callback)
+        if not done.wait(timeout):
+            return False
+        return result[0]
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.waiting_list and not self.stopped:
+                    self.cond.wait()
+                if not self.waiting_list:
+                    # a request after this starts a new thread
+                    self.thread = None
+                    return
+                callback_list = self.waiting_list
+                self.waiting_list = []
+                self.writing = True
+            try:
+                success = self.write()
+            except Exception as e:
+                self.log_error(f"Save failed: {e}")
+                success = False
+            with self.cond:
+                self.writing = False
+                self.write_cnt += 1
+            for callback in callback_list:
+                try:
+                    callback(success)
+                except Exception as e:
+                    self.log_error(f"Save callback failed: {e}")
+
+    def stop(self):
+        # requests already queued, or made later, are still written
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+    def is_busy(self):
+        # a write is queued or running, changes it misses are caught by the next check
+        with self.cond:
+            return bool(self.waiting_list) or self.writing
+
+    def snapshot(self):
+        with self.cond:
+            return {
+                'requests': self.request_cnt,
+                'writes': self.write_cnt,
+                'waiting': len(self.waiting_list),
+                'writing': self.writing,
+            }
+
+def write_file_atomic(path, write_to):
+    # write_to(file) fills a temp file in the same folder, which replaces path once it is on disk
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as tmp_file:
+            write_to(tmp_file)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        try:
+            # keep the mode of the file being replaced, e.g. with save_to_same_file
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except OSError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    # the rename itself is durable once the folder is synced, not possible on Windows
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+class AutosavePolicy:
+    """When a dataset's unsaved changes are saved without a client asking.
+
+    A save is due once max_rows rows changed, once the oldest unsaved change
+    is max_age_s old, or once no change came for idle_s, whichever is first.
+    0 turns a rule off. After a failed save the rules wait retry_s.
+    """
+    def __init__(self, max_rows, max_age_s, idle_s, retry_s=10.0):
+        self.max_rows = max_rows
+        self.max_age_s = max_age_s
+        self.idle_s = idle_s
+        self.retry_s = retry_s
+
+    def enabled(self):
+        return self.max_rows > 0 or self.max_age_s > 0 or self.idle_s > 0
+
+    def get_tick(self):
+        # seconds between checks of the time rules
+        limit_list = [limit for limit in (self.max_age_s, self.idle_s) if limit > 0]
+        return min(max(min(limit_list, default=1.0) / 4, 0.1), 1.0)
+
+    def check(self, dirty_cnt, first_dirty_time, last_change_time, last_failed_time, now):
+        # the rule that makes a save due, None if none does. Times are time.monotonic()
+        if dirty_cnt == 0 or first_dirty_time is None:
+            return None
+        if last_failed_time is not None and now - last_failed_time < self.retry_s:
+            return None
+        if self.max_rows > 0 and dirty_cnt >= self.max_rows:
+            return 'max_rows'
+        if self.max_age_s > 0 and now - first_dirty_time >= self.max_age_s:
+            return 'max_age'
+        if self.idle_s > 0 and now - last_change_time >= self.idle_s:
+            return 'idle'
+        return None
+
+class Autosaver(threading.Thread):
+    """Applies the time rules of an AutosavePolicy to every loaded dataset."""
+    def __init__(self, registry, policy, log_warn=print):
+        super().__init__(name='autosave', daemon=True)
+        self.registry = registry
+        self.policy = policy
+        self.log_warn = log_warn
+
+    def run(self):
+        tick = self.policy.get_tick()
+        while True:
+            time.sleep(tick)
+            for dataset in self.registry.get_loaded_list():
+                try:
+                    dataset.check_autosave()
+                except Exception as e:
+                    self.log_warn(f"Autosave check failed: {e}")
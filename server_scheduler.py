@@ -0,0 +1,110 @@
+"""
+Priority scheduling of tagged image requests for BackendServer.
+
+Requests carry a class: interactive (the frame on screen), prefetch (frames
+likely needed next) or bulk ("Load All Image" and other sweeps). Plain
+tagged requests (0xFF 0x0A) are interactive, the priority envelope
+(0xFF 0x0F) names the class. Worker threads take the next job by
+
+    1. any job that waited longer than starvation_ms, oldest first
+    2. bulk, while its share of the recently sent bytes is below bulk_share
+    3. interactive, then prefetch, then bulk
+
+Rule 2 only matters while other classes wait, an otherwise idle server
+serves bulk at full speed. One worker never takes bulk jobs, so a request
+for the frame on screen does not wait for every thread to finish a bulk
+read.
+"""
+import threading
+import time
+from collections import deque
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = ['interactive', 'prefetch', 'bulk']
+
+class PriorityScheduler:
+    def __init__(self, worker_cnt, starvation_ms=500, bulk_share=0.2, name='io'):
+        self.worker_cnt = worker_cnt
+        self.starvation_s = starvation_ms / 1000
+        self.bulk_share = bulk_share
+        self.cond = threading.Condition()
+        # per class, (enqueue time, fn, args)
+        self.queue_list = [deque() for _ in PRIORITY_NAMES]
+        self.running_list = [0] * len(PRIORITY_NAMES)
+        # bytes sent per class, halved every second
+        self.recent_bytes_list = [0.0] * len(PRIORITY_NAMES)
+        self.decay_time = time.monotonic()
+        self.served_list = [0] * len(PRIORITY_NAMES)
+        self.promoted_cnt = 0
+        for i in range(0, worker_cnt):
+            threading.Thread(target=self.run_worker, name=f'{name}_{i}', daemon=True).start()
+
+    def submit(self, priority, fn, *args):
+        # fn returns the bytes it sent, that is what bulk_share counts
+        with self.cond:
+            self.queue_list[priority].append((time.monotonic(), fn, args))
+            self.cond.notify()
+
+    def take(self):
+        # next (priority, job) by the rules above, None when nothing may run
+        now = time.monotonic()
+        if now - self.decay_time >= 1.0:
+            factor = 0.5 ** (now - self.decay_time)
+            self.recent_bytes_list = [size * factor for size in self.recent_bytes_list]
+            self.decay_time = now
+        bulk_allowed = self.worker_cnt == 1 or self.running_list[PRIORITY_BULK] < self.worker_cnt - 1
+
+        oldest = None
+        for priority, queue in enumerate(self.queue_list):
+            if not queue or (priority == PRIORITY_BULK and not bulk_allowed):
+                continue
+            if now - queue[0][0] > self.starvation_s and (oldest is None or queue[0][0] < self.queue_list[oldest][0][0]):
+                oldest = priority
+        if oldest is not None:
+            if oldest != PRIORITY_INTERACTIVE:
+                self.promoted_cnt += 1
+            return oldest, self.queue_list[oldest].popleft()
+
+        if self.queue_list[PRIORITY_BULK] and bulk_allowed:
+            if self.recent_bytes_list[PRIORITY_BULK] < self.bulk_share * sum(self.recent_bytes_list):
+                return PRIORITY_BULK, self.queue_list[PRIORITY_BULK].popleft()
+
+        for priority, queue in enumerate(self.queue_list):
+            if queue and (priority != PRIORITY_BULK or bulk_allowed):
+                return priority, queue.popleft()
+        return None
+
+    def run_worker(self):
+        while True:
+            with self.cond:
+                entry = self.take()
+                while entry is None:
+                    self.cond.wait()
+                    entry = self.take()
+                priority, (_, fn, args) = entry
+                self.running_list[priority] += 1
+            size = 0
+            try:
+                size = fn(*args) or 0
+            finally:
+                with self.cond:
+                    self.running_list[priority] -= 1
+                    self.served_list[priority] += 1
+                    self.recent_bytes_list[priority] += size
+                    # a bulk job held back for the reserved worker may run now
+                    self.cond.notify()
+
+    def snapshot(self):
+        with self.cond:
+            stats = {
+                name: {
+                    'queued': len(self.queue_list[priority]),
+                    'running': self.running_list[priority],
+                    'served': self.served_list[priority],
+                }
+                for priority, name in enumerate(PRIORITY_NAMES)
+            }
+            stats['promoted'] = self.promoted_cnt
+            return stats
@@ -0,0 +1,57 @@
+"""
+Clip range sharding for router.py.
+
+Every shard is a BackendServer that parses the whole CSV, so row indices
+stay global, but owns a contiguous range of clips: it serves the images of
+those rows and saves only those rows, to its own part file. The router
+sends every request to the shard owning its row and, after a save, joins
+the part files in shard order into the file an unsharded server writes.
+"""
+import os
+
+def split_clip_list(clip_list, shard_cnt, row_cnt):
+    # contiguous clip ranges with about the same number of rows each,
+    # [(clip_begin, clip_end, row_begin, row_end)] per shard
+    range_list = []
+    clip_begin = 0
+    for shard in range(0, shard_cnt):
+        if shard == shard_cnt - 1:
+            clip_end = len(clip_list)
+        else:
+            target = row_cnt * (shard + 1) / shard_cnt
+            # leave a clip for every later shard while there are enough
+            clip_limit = len(clip_list) - (shard_cnt - shard - 1)
+            clip_end = clip_begin
+            while clip_end < clip_limit and (clip_end == clip_begin or clip_list[clip_end]['end'] <= target):
+                clip_end += 1
+        if clip_end > clip_begin:
+            row_begin, row_end = clip_list[clip_begin]['begin'], clip_list[clip_end - 1]['end']
+        else:
+            row_begin = row_end = range_list[-1][3] if range_list else 0
+        range_list.append((clip_begin, clip_end, row_begin, row_end))
+        clip_begin = clip_end
+    # the last clip of build_csv ends one row early, the last shard saves up to row_cnt
+    range_list[-1] = range_list[-1][0:3] + (row_cnt,)
+    return range_list
+
+def get_part_path(save_path, shard_index, shard_cnt):
+    save_path_noext, ext = os.path.splitext(save_path)
+    return f"{save_path_noext}.part{shard_index}of{shard_cnt}{ext}"
+
+def merge_parts(save_path, shard_cnt):
+    # header of the first part, rows of every part. Raises OSError if a part is missing
+    tmp_path = save_path + '.tmp'
+    with open(tmp_path, 'wb') as out_file:
+        for shard_index in range(0, shard_cnt):
+            with open(get_part_path(save_path, shard_index, shard_cnt), 'rb') as part_file:
+                header = part_file.readline()
+                if shard_index == 0:
+                    out_file.write(header)
+                while True:
+                    chunk = part_file.read(1 << 20)
+                    if not chunk:
+                        break
+                    out_file.write(chunk)
+        out_file.flush()
+        os.fsync(out_file.fileno())
+    os.replace(tmp_path, save_path)
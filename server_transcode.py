@@ -0,0 +1,138 @@
+"""
+Process pool for CPU heavy image work on the server.
+
+Decoding, resizing, re-encoding and hashing run in worker processes so
+they do not hold the GIL of the connection threads. Encoded results come
+back through shared memory (or a temp file) and only a small descriptor is
+pickled. With worker_cnt 0 the same work runs in the calling thread.
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+# format byte of the scaled image request
+FORMAT_LIST = ['JPEG', 'PNG', 'WEBP']
+
+def encode_scaled(image_path, max_width, max_height, image_format, quality):
+    with Image.open(image_path) as image:
+        if image.format == 'JPEG':
+            # decode at reduced size straight from the DCT data when possible
+            image.draft('RGB', (max_width, max_height))
+        image.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, quality=quality)
+        return buffer.getbuffer(), image.size
+
+def transcode_worker(image_path, max_width, max_height, image_format, quality, transport, temp_dir):
+    # runs in the pool, returns (location, size, width, height, sha1)
+    data, (width, height) = encode_scaled(image_path, max_width, max_height, image_format, quality)
+    digest = hashlib.sha1(data).hexdigest()
+    size = len(data)
+    if transport == 'shm':
+        shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        shm.buf[:size] = data
+        location = shm.name
+        shm.close()
+    else:
+        fd, location = tempfile.mkstemp(prefix='fitt_', suffix='.img', dir=temp_dir)
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+    return location, size, width, height, digest
+
+def hash_worker(image_path):
+    sha1 = hashlib.sha1()
+    with open(image_path, 'rb') as image_file:
+        for chunk in iter(lambda: image_file.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+class TranscodeResult:
+    """Encoded image living in shared memory, a temp file or local bytes.
+
+    Use as a context manager; data is only valid inside the with block.
+    """
+    def __init__(self, transport, location, size, width, height, digest, data=None):
+        self.transport = transport
+        self.location = location
+        self.size = size
+        self.width = width
+        self.height = height
+        self.digest = digest
+        self.data = data
+        self.shm = None
+
+    def __enter__(self):
+        if self.transport == 'shm':
+            self.shm = shared_memory.SharedMemory(name=self.location)
+            self.data = self.shm.buf[:self.size]
+        elif self.transport == 'file':
+            with open(self.location, 'rb') as temp_file:
+                self.data = temp_file.read()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def release(self):
+        if self.transport == 'shm' and self.location:
+            if self.shm is None:
+                self.shm = shared_memory.SharedMemory(name=self.location)
+            if isinstance(self.data, memoryview):
+                self.data.release()
+            self.data = None
+            self.shm.close()
+            self.shm.unlink()
+            self.location = None
+        elif self.transport == 'file' and self.location:
+            self.data = None
+            try:
+                os.remove(self.location)
+            except OSError:
+                pass
+            self.location = None
+
+class TranscodePool:
+    def __init__(self, worker_cnt=0, queue_depth=0, transport='shm', temp_dir=None):
+        self.worker_cnt = worker_cnt
+        self.transport = transport
+        self.temp_dir = temp_dir
+        # jobs submitted but not finished, callers block beyond this
+        self.queue_depth = queue_depth or max(1, worker_cnt * 2)
+        self.slots = threading.BoundedSemaphore(self.queue_depth)
+        self.executor = None
+        if worker_cnt > 0:
+            # spawn, forking a process with live socket threads is unsafe
+            self.executor = ProcessPoolExecutor(
+                max_workers=worker_cnt, mp_context=multiprocessing.get_context('spawn')
+            )
+
+    def transcode(self, image_path, max_width, max_height, image_format='JPEG', quality=85):
+        if self.executor is None:
+            data, (width, height) = encode_scaled(image_path, max_width, max_height, image_format, quality)
+            return TranscodeResult('local', None, len(data), width, height, hashlib.sha1(data).hexdigest(), data)
+        with self.slots:
+            location, size, width, height, digest = self.executor.submit(
+                transcode_worker, image_path, max_width, max_height, image_format, quality,
+                self.transport, self.temp_dir,
+            ).result()
+        return TranscodeResult(self.transport, location, size, width, height, digest)
+
+    def hash_file(self, image_path):
+        if self.executor is None:
+            return hash_worker(image_path)
+        with self.slots:
+            return self.executor.submit(hash_worker, image_path).result()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
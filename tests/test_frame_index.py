@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+from frame_index import FrameIndex
+
+def build_combined_lists(clip_list):
+    # the per frame lists HeadlessClient built before FrameIndex
+    combined_entry_list = []
+    combined_clip_list = []
+    combined_clip_of_frame = []
+    for clip_index, clip in enumerate(clip_list):
+        combined_clip_begin_index = len(combined_entry_list)
+        for i in range(clip['begin'], clip['end'], clip['cam']):
+            combined_entry_list.append(list(range(i, i + clip['cam'])))
+            combined_clip_of_frame.append(clip_index)
+        combined_clip_end_index = len(combined_entry_list)
+        for i in range(clip['begin'], clip['end'], clip['cam']):
+            combined_clip_list.append((combined_clip_begin_index, combined_clip_end_index))
+    return combined_entry_list, combined_clip_list, combined_clip_of_frame
+
+def make_clip_list(spec_list):
+    # [(row count, cam)] of consecutive clips
+    clip_list = []
+    begin = 0
+    for size, cam in spec_list:
+        clip_list.append({'begin': begin, 'end': begin + size, 'cam': cam})
+        begin += size
+    return clip_list
+
+CLIP_SPEC_LIST = [
+    # single frame clips
+    [(1, 1), (3, 3), (2, 2), (1, 1)],
+    # camera counts that do not divide the clip
+    [(10, 2), (15, 4), (1, 1), (14, 3), (7, 5)],
+    # clips without frames between and after others
+    [(6, 2), (0, 3), (6, 3), (0, 1)],
+    [(60, 1), (60, 2), (60, 3), (59, 4)],
+]
+
+def check_round_trip(clip_list):
+    frame_index = FrameIndex(clip_list)
+    combined_entry_list, combined_clip_list, combined_clip_of_frame = build_combined_lists(clip_list)
+    assert len(frame_index) == len(combined_entry_list)
+    for frame, entry in enumerate(combined_entry_list):
+        assert frame_index.get_rows(frame) == entry
+        assert frame_index.get_clip_range(frame) == combined_clip_list[frame]
+        assert frame_index.get_clip(frame) == combined_clip_of_frame[frame]
+        # every row of the frame inside its clip maps back to it
+        clip = clip_list[combined_clip_of_frame[frame]]
+        for row in entry:
+            if row < clip['end']:
+                assert frame_index.get_clip_of_row(row) == combined_clip_of_frame[frame]
+                assert frame_index.get_frame(row) == frame
+
+@pytest.mark.parametrize('spec_list', CLIP_SPEC_LIST)
+def test_round_trip_against_combined_lists(spec_list):
+    check_round_trip(make_clip_list(spec_list))
+
+def test_round_trip_random_clips():
+    rng = random.Random(7)
+    for _ in range(0, 50):
+        check_round_trip(make_clip_list(
+            [(rng.randint(0, 30), rng.randint(1, 6)) for _ in range(0, rng.randint(1, 12))]
+        ))
+
+def test_frame_out_of_range_raises():
+    frame_index = FrameIndex(make_clip_list([(4, 2), (3, 1)]))
+    assert len(frame_index) == 5
+    for frame in (-1, 5):
+        with pytest.raises(IndexError):
+            frame_index.get_rows(frame)
+
+def test_without_clips():
+    frame_index = FrameIndex([])
+    assert len(frame_index) == 0
+    with pytest.raises(IndexError):
+        frame_index.get_clip(0)
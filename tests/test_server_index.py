@@ -0,0 +1,101 @@
+import struct
+
+import numpy as np
+import pytest
+
+from server_index import TagIndex, QUERY_NEXT, QUERY_PREV, QUERY_LIST
+
+ROW_CNT = 37
+
+def tag(tag_index):
+    return b'\x00' + struct.pack('>H', tag_index)
+
+UNLABELED = b'\x01'
+NOT = b'\x02'
+AND = b'\x03'
+OR = b'\x04'
+
+# program, the same query over the per row tag lists
+PROGRAM_LIST = [
+    (tag(0), lambda row: row[0]),
+    (UNLABELED, lambda row: not any(row)),
+    (tag(1) + NOT, lambda row: not row[1]),
+    (tag(0) + tag(1) + AND, lambda row: row[0] and row[1]),
+    (tag(0) + tag(2) + OR, lambda row: row[0] or row[2]),
+    (tag(0) + tag(2) + NOT + AND + UNLABELED + OR, lambda row: (row[0] and not row[2]) or not any(row)),
+    (tag(1) + tag(2) + OR + NOT, lambda row: not (row[1] or row[2])),
+]
+
+def make_state_array_list(seed):
+    rng = np.random.default_rng(seed)
+    return [rng.random(ROW_CNT) < 0.4 for _ in range(0, 3)]
+
+def brute_rows(state_array_list, predicate, index1, index2):
+    return [i for i in range(index1, index2 + 1) if predicate([bool(state[i]) for state in state_array_list])]
+
+def to_runs(row_list):
+    run_list = []
+    for row in row_list:
+        if run_list and run_list[-1][1] == row - 1:
+            run_list[-1] = (run_list[-1][0], row)
+        else:
+            run_list.append((row, row))
+    return run_list
+
+@pytest.mark.parametrize('program, predicate', PROGRAM_LIST)
+def test_evaluate_matches_brute_force_on_every_range(program, predicate):
+    state_array_list = make_state_array_list(1)
+    index = TagIndex(state_array_list, ROW_CNT)
+    # ranges starting and ending inside, on and across byte boundaries
+    for index1 in range(0, ROW_CNT):
+        for index2 in range(index1, ROW_CNT):
+            match = index.evaluate(program, index1, index2)
+            row_list = [index1 + i for i in range(0, index2 - index1 + 1) if match >> i & 1]
+            assert row_list == brute_rows(state_array_list, predicate, index1, index2), (index1, index2)
+
+@pytest.mark.parametrize('program, predicate', PROGRAM_LIST)
+def test_query_modes(program, predicate):
+    state_array_list = make_state_array_list(2)
+    index = TagIndex(state_array_list, ROW_CNT)
+    for index1, index2 in [(0, ROW_CNT - 1), (3, 17), (8, 15), (7, 8), (9, 33)]:
+        row_list = brute_rows(state_array_list, predicate, index1, index2)
+        assert index.query(QUERY_LIST, program, index1, index2, index1) == (len(row_list), to_runs(row_list))
+        for start in range(index1 - 1, index2 + 2):
+            after = [row for row in row_list if row >= start]
+            before = [row for row in row_list if row <= start]
+            assert index.query(QUERY_NEXT, program, index1, index2, start) == \
+                ((1, [(after[0], after[0])]) if after else (0, []))
+            assert index.query(QUERY_PREV, program, index1, index2, start) == \
+                ((1, [(before[-1], before[-1])]) if before else (0, []))
+
+@pytest.mark.parametrize('stride', [1, 2, 3])
+def test_set_rows_keeps_bitmaps_in_sync(stride):
+    state_array_list = make_state_array_list(3)
+    index = TagIndex(state_array_list, ROW_CNT)
+    rng = np.random.default_rng(stride)
+    # every start and end offset within a byte comes up
+    for _ in range(0, 300):
+        index1 = int(rng.integers(0, ROW_CNT))
+        index2 = int(rng.integers(index1, ROW_CNT))
+        state_list = [bool(state) for state in rng.random(3) < 0.5]
+        index.set_rows(index1, index2, stride, state_list)
+        for row in range(index1, index2 + 1, stride):
+            for state_array, state in zip(state_array_list, state_list):
+                state_array[row] = state
+        for program, predicate in PROGRAM_LIST:
+            match = index.evaluate(program, 0, ROW_CNT - 1)
+            row_list = [i for i in range(0, ROW_CNT) if match >> i & 1]
+            assert row_list == brute_rows(state_array_list, predicate, 0, ROW_CNT - 1), (index1, index2)
+
+@pytest.mark.parametrize('program', [b'', tag(0) + tag(1), AND, tag(0) + OR, NOT, tag(3), b'\x00\x00', b'\x09'])
+def test_malformed_program_raises(program):
+    index = TagIndex(make_state_array_list(4), ROW_CNT)
+    with pytest.raises(ValueError):
+        index.evaluate(program, 0, ROW_CNT - 1)
+
+def test_bad_range_raises():
+    index = TagIndex(make_state_array_list(5), ROW_CNT)
+    with pytest.raises(ValueError):
+        index.query(QUERY_LIST, tag(0), 5, 4, 5)
+    with pytest.raises(ValueError):
+        index.query(QUERY_LIST, tag(0), 0, ROW_CNT, 0)
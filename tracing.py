@@ -0,0 +1,139 @@
+"""
+Opt-in tracing and profiling shared by server.py and client.py.
+
+Tracer records wall and CPU time spans and writes them as a Chrome trace
+(open the file in chrome://tracing or https://ui.perfetto.dev). It can also
+run cProfile around every request of one chosen opcode. A Tracer without a
+trace_path and without a profile_opcode does nothing and costs one call.
+"""
+import atexit
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        self.cpu_start_ns = time.thread_time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_ns = time.perf_counter_ns()
+        self.args['cpu_us'] = (time.thread_time_ns() - self.cpu_start_ns) / 1000
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add_event({
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': (self.start_ns - self.tracer.origin_ns) / 1000,
+            'dur': (end_ns - self.start_ns) / 1000,
+            'pid': self.tracer.pid,
+            'tid': threading.get_ident(),
+            'args': self.args,
+        })
+        return False
+
+class ProfileSpan:
+    # cProfile hooks the calling thread only and cannot run twice at once,
+    # so requests arriving while another one is profiled are skipped
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.active = False
+
+    def __enter__(self):
+        self.active = self.tracer.profile_lock.acquire(blocking=False)
+        if self.active:
+            self.tracer.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.active:
+            self.tracer.profiler.disable()
+            self.tracer.profile_cnt += 1
+            self.tracer.profile_lock.release()
+        return False
+
+class Tracer:
+    def __init__(self, trace_path='', profile_opcode=-1, profile_path='', process_name='', max_events=1000000):
+        self.trace_path = trace_path
+        self.enabled = bool(trace_path)
+        self.profile_opcode = profile_opcode
+        self.profile_path = profile_path or f'profile_{profile_opcode:#04x}.prof'
+        self.max_events = max_events
+
+        self.pid = os.getpid()
+        self.origin_ns = time.perf_counter_ns()
+        self.event_list = []
+        self.dropped_cnt = 0
+        self.event_lock = threading.Lock()
+
+        self.profiler = cProfile.Profile() if profile_opcode >= 0 else None
+        self.profile_lock = threading.Lock()
+        self.profile_cnt = 0
+
+        if self.enabled and process_name:
+            self.event_list.append({
+                'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'args': {'name': process_name},
+            })
+        if self.enabled or self.profiler:
+            atexit.register(self.flush)
+
+    def span(self, name, category='', **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args)
+
+    def profile(self, cmd):
+        if self.profiler is None or cmd != self.profile_opcode:
+            return NULL_SPAN
+        return ProfileSpan(self)
+
+    def add_event(self, event):
+        with self.event_lock:
+            if len(self.event_list) < self.max_events:
+                self.event_list.append(event)
+            else:
+                self.dropped_cnt += 1
+
+    def flush(self):
+        if self.enabled:
+            with self.event_lock:
+                trace = {
+                    'traceEvents': list(self.event_list),
+                    'displayTimeUnit': 'ms',
+                    'otherData': {'dropped_events': self.dropped_cnt},
+                }
+            with open(self.trace_path, 'w') as trace_file:
+                json.dump(trace, trace_file)
+        if self.profiler is not None and self.profile_cnt:
+            with self.profile_lock:
+                self.profiler.dump_stats(self.profile_path)
+
+def traced(name, tracer_of=lambda self: self.tracer):
+    """Method decorator recording a span named name on the object's tracer."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with tracer_of(self).span(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator